@@ -1,2 +1,3 @@
-from Domain.account import Account
+from Domain.account import Account, AccountBatch
 from Domain.customer import Customer
+from Domain.transaction import TransactionResult
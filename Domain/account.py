@@ -1,7 +1,10 @@
-from typing import Optional
+from array import array
+from typing import Iterable, Iterator, Optional, Tuple
 
 
 class Account:
+    __slots__ = ("balance", "account_id", "customer_id", "account_number")
+
     def __init__(self, account_id: int, customer_id: int, account_number: int, balance: Optional[int] = 0):
         """
         Initialize an Account object.
@@ -25,6 +28,18 @@ class Account:
         """
         self.account_id = account_id
 
+    @staticmethod
+    def validate_amount(amount: float) -> None:
+        """
+        Check that a transaction amount is acceptable for a deposit or withdrawal.
+
+        :param amount: Amount to validate.
+        :return: None
+        :raises ValueError: If the amount is negative or zero.
+        """
+        if amount<=0:
+            raise ValueError("Amount cannot be negative or zero.")
+
     def deposit(self, amount: float) -> float:
         """
         Deposit funds into the account.
@@ -32,8 +47,7 @@ class Account:
         :param amount: Amount to deposit.
         :return: Updated balance after the deposit.
         """
-        if amount<=0:
-            raise ValueError("Amount cannot be negative or zero.")
+        self.validate_amount(amount)
         self.balance += amount
         return self.balance
 
@@ -45,9 +59,8 @@ class Account:
         :return: Updated balance after the withdrawal.
         :raises ValueError: If there are insufficient funds for the withdrawal.
         """
-        if amount<=0:
-            raise ValueError("Amount cannot be negative or zero.")
-        elif self.balance >= amount:
+        self.validate_amount(amount)
+        if self.balance >= amount:
             self.balance -= amount
             return self.balance
         else:
@@ -60,3 +73,98 @@ class Account:
         :return: Current balance of the account.
         """
         return self.balance
+
+
+class AccountBatch:
+    __slots__ = ("_account_ids", "_customer_ids", "_account_numbers", "_balances")
+
+    def __init__(self, rows: Iterable[Tuple[int, int, int, float]]):
+        """
+        Initialize an AccountBatch object.
+
+        The AccountBatch is a compact, read-only, column-oriented view of many accounts, for scans that
+        would otherwise build one Account object per row. Columns are packed into typed arrays; Account
+        objects are only created when an item is indexed.
+
+        :param rows: (account_id, customer_id, account_number, balance) rows.
+        """
+        self._account_ids = array("q")
+        self._customer_ids = array("q")
+        self._account_numbers = array("q")
+        self._balances = array("d")
+        for account_id, customer_id, account_number, balance in rows:
+            self._account_ids.append(account_id)
+            self._customer_ids.append(customer_id)
+            self._account_numbers.append(int(account_number))
+            self._balances.append(balance or 0)
+
+    @property
+    def account_ids(self) -> memoryview:
+        """
+        Read-only view of the account IDs.
+
+        :return: Memoryview over the column.
+        """
+        return memoryview(self._account_ids).toreadonly()
+
+    @property
+    def customer_ids(self) -> memoryview:
+        """
+        Read-only view of the customer IDs.
+
+        :return: Memoryview over the column.
+        """
+        return memoryview(self._customer_ids).toreadonly()
+
+    @property
+    def account_numbers(self) -> memoryview:
+        """
+        Read-only view of the account numbers.
+
+        :return: Memoryview over the column.
+        """
+        return memoryview(self._account_numbers).toreadonly()
+
+    @property
+    def balances(self) -> memoryview:
+        """
+        Read-only view of the balances.
+
+        :return: Memoryview over the column.
+        """
+        return memoryview(self._balances).toreadonly()
+
+    def total_balance(self) -> float:
+        """
+        Get the sum of the balances in the batch.
+
+        :return: The total balance.
+        """
+        return sum(self._balances)
+
+    def __len__(self) -> int:
+        """
+        Get the number of accounts in the batch.
+
+        :return: The number of accounts.
+        """
+        return len(self._account_ids)
+
+    def __getitem__(self, index: int) -> Account:
+        """
+        Build an Account for one row of the batch.
+
+        :param index: Position of the row.
+        :return: A new Account; changing it does not change the batch.
+        """
+        return Account(self._account_ids[index], self._customer_ids[index], self._account_numbers[index],
+                       self._balances[index])
+
+    def __iter__(self) -> Iterator[Account]:
+        """
+        Iterate over the batch as Account objects.
+
+        :return: Iterator of new Account objects.
+        """
+        for index in range(len(self._account_ids)):
+            yield self[index]
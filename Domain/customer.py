@@ -1,4 +1,11 @@
+import re
+
+_NON_DIGITS = re.compile(r"[^0-9]")
+
+
 class Customer:
+    __slots__ = ("customer_id", "name", "phone_number", "email")
+
     def __init__(self, customer_id: int, name: str, phone_number: str, email: str):
         """
         Initialize a Customer object.
@@ -12,3 +19,41 @@ class Customer:
         self.name = name
         self.phone_number = phone_number
         self.email = email
+
+    def lookup_keys(self) -> tuple:
+        """
+        Get the normalized keys the customer is looked up by.
+
+        :return: (email key, phone key, name key).
+        """
+        return self.email_key(self.email), self.phone_key(self.phone_number), self.name_key(self.name)
+
+    @staticmethod
+    def email_key(email: str) -> str:
+        """
+        Normalize an email address for lookups: surrounding whitespace removed and case-folded.
+
+        :param email: Email address.
+        :return: The lookup key.
+        """
+        return str(email).strip().casefold()
+
+    @staticmethod
+    def phone_key(phone_number: str) -> str:
+        """
+        Normalize a phone number for lookups: digits only.
+
+        :param phone_number: Phone number in any format.
+        :return: The lookup key.
+        """
+        return _NON_DIGITS.sub("", str(phone_number))
+
+    @staticmethod
+    def name_key(name: str) -> str:
+        """
+        Normalize a name, or name prefix, for lookups: whitespace collapsed and case-folded.
+
+        :param name: Name of the customer.
+        :return: The lookup key.
+        """
+        return " ".join(str(name).split()).casefold()
@@ -0,0 +1,20 @@
+from typing import NamedTuple, Optional
+
+
+class TransactionResult(NamedTuple):
+    """
+    Outcome of one row of a batch of transactions.
+
+    :param account_id: The ID of the account the row targeted.
+    :param amount: The amount of the transaction.
+    :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+    :param success: Whether the row was applied.
+    :param balance: Balance of the account right after the row was applied, if it succeeded.
+    :param error: Reason the row was rejected, if it failed.
+    """
+    account_id: int
+    amount: float
+    transaction_type: str
+    success: bool
+    balance: Optional[float] = None
+    error: Optional[str] = None
@@ -1 +1,7 @@
-from Infrastructure.account_repository import AccountRepository
\ No newline at end of file
+from Infrastructure.account_cache import AccountCache
+from Infrastructure.idempotency import IdempotencyKeyFilter
+from Infrastructure.account_repository import AccountRepository
+from Infrastructure.ledger_engine import InMemoryLedgerRepository
+from Infrastructure.sharded_repository import ShardedAccountRepository
+from Infrastructure.transaction_archive import TransactionArchive
+from Infrastructure.statement_cache import CachedStatement, StatementCache
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from Domain import Account
+
+
+class AccountCache:
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = None) -> None:
+        """
+        Initialize an AccountCache object.
+
+        The AccountCache is a bounded, thread-safe LRU cache of account rows keyed by account_id, with a
+        secondary customer_id index. Entries are stored as plain tuples and every lookup returns a new
+        Account, so callers can mutate what they get without corrupting the cache.
+
+        Readers take a `generation()` before reading from the database and pass it to `put`. A row read
+        before an invalidation of its account or customer is then not cached, even if it is put after it.
+
+        :param max_entries: Maximum number of cached accounts; the least recently used one is evicted first.
+        :param ttl: Seconds an entry stays valid after it was cached, or None for no expiry.
+        :return: None
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive.")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_customer = {}
+        self._lock = threading.Lock()
+        # Generation of the last invalidation per account and customer ID. The maps are cleared once they
+        # outgrow max_entries, and `_floor` then rejects every read that started before the clear.
+        self._generation = 0
+        self._floor = 0
+        self._invalidated_accounts = {}
+        self._invalidated_customers = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_by_id(self, account_id: int) -> Optional[Account]:
+        """
+        Get a cached account by its ID.
+
+        :param account_id: The ID of the account.
+        :return: A copy of the cached account, or None on a miss.
+        """
+        with self._lock:
+            return self._get(account_id)
+
+    def get_by_customer_id(self, customer_id: int) -> Optional[Account]:
+        """
+        Get a cached account by the ID of its customer.
+
+        :param customer_id: The ID of the customer.
+        :return: A copy of the cached account, or None on a miss.
+        """
+        with self._lock:
+            account_id = self._by_customer.get(customer_id)
+            if account_id is None:
+                self.misses += 1
+                return None
+            return self._get(account_id)
+
+    def generation(self) -> int:
+        """
+        Get the current invalidation generation, to be taken before reading an account from the database.
+
+        :return: The generation to pass to `put`.
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, account: Account, generation: Optional[int] = None) -> None:
+        """
+        Cache an account as read from committed database state.
+
+        :param account: The account to cache.
+        :param generation: The `generation()` taken before the account was read. The account is not cached
+                           if it, or its customer, was invalidated since then. None caches it unconditionally.
+        :return: None
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        row = (account.account_id, account.customer_id, account.account_number, account.balance)
+        with self._lock:
+            if generation is not None and (
+                    generation < self._floor
+                    or self._invalidated_accounts.get(account.account_id, -1) > generation
+                    or self._invalidated_customers.get(account.customer_id, -1) > generation):
+                return
+            self._entries[account.account_id] = (expires_at, row)
+            self._entries.move_to_end(account.account_id)
+            self._by_customer[account.customer_id] = account.account_id
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, account_id: Optional[int] = None, customer_id: Optional[int] = None) -> None:
+        """
+        Drop the cached entries for an account and/or a customer.
+
+        :param account_id: The ID of the account to drop.
+        :param customer_id: The ID of the customer whose account should be dropped.
+        :return: None
+        """
+        with self._lock:
+            self._generation += 1
+            if len(self._invalidated_accounts) + len(self._invalidated_customers) >= self.max_entries:
+                self._invalidated_accounts.clear()
+                self._invalidated_customers.clear()
+                self._floor = self._generation
+            if customer_id is not None:
+                self._invalidated_customers[customer_id] = self._generation
+                cached_id = self._by_customer.pop(customer_id, None)
+                if cached_id is not None:
+                    self._remove(cached_id)
+            if account_id is not None:
+                self._invalidated_accounts[account_id] = self._generation
+                self._remove(account_id)
+
+    def clear(self) -> None:
+        """
+        Drop every cached entry. Statistics are kept.
+
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._by_customer.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics.
+
+        :return: A dict with the hit, miss and eviction counters and the current size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+    def _get(self, account_id: int) -> Optional[Account]:
+        """
+        Look an entry up by account ID; the caller holds the lock.
+
+        :param account_id: The ID of the account.
+        :return: A copy of the cached account, or None on a miss.
+        """
+        entry = self._entries.get(account_id)
+        if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+            if entry is not None:
+                self._remove(account_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(account_id)
+        self.hits += 1
+        return Account(*entry[1])
+
+    def _remove(self, account_id: int) -> None:
+        """
+        Remove an entry and its customer index; the caller holds the lock.
+
+        :param account_id: The ID of the account.
+        :return: None
+        """
+        entry = self._entries.pop(account_id, None)
+        if entry is not None:
+            customer_id = entry[1][1]
+            if self._by_customer.get(customer_id) == account_id:
+                del self._by_customer[customer_id]
@@ -1,19 +1,87 @@
 from db.db_client import DatabaseConnection
-from Domain import Account, Customer
-from typing import Optional, Union
+from Infrastructure.account_cache import AccountCache
+from Infrastructure.idempotency import IdempotencyKeyFilter, idempotent_row
+from Domain import Account, AccountBatch, Customer, TransactionResult
+from datetime import date, datetime
+from typing import ContextManager, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+import sqlite3
+import sys
+from contextlib import nullcontext
 from sqlite3 import connect
 
 
+# Explicit Accounts column list in the order account_row_factory expects.
+ACCOUNT_COLUMNS = "account_id, customer_id, account_number, balance"
+
+# Explicit Customers column list in Customer constructor order.
+CUSTOMER_COLUMNS = "customer_id, name, phone_number, email"
+
+# Signed ledger amount: deposits add to the balance, withdrawals subtract from it.
+SIGNED_AMOUNT_SQL = "CASE WHEN transaction_type = 'deposit' THEN amount ELSE -amount END"
+
+# Columns of the daily activity tables, in the order the activity queries return them.
+ACTIVITY_COLUMNS = "deposit_count, deposit_sum, withdrawal_count, withdrawal_sum"
+# Ranking expressions accepted by get_top_accounts, over a group of DailyAccountActivity rows.
+ACTIVITY_METRICS = {
+    'net_flow': "SUM(deposit_sum) - SUM(withdrawal_sum)",
+    'deposits': "SUM(deposit_sum)",
+    'withdrawals': "SUM(withdrawal_sum)",
+    'transactions': "SUM(deposit_count) + SUM(withdrawal_count)",
+}
+
+
+def account_row_factory(cursor, row: tuple) -> Account:
+    """
+    sqlite3 row factory mapping an ACCOUNT_COLUMNS row straight into an Account.
+
+    :param cursor: The cursor the row was read from.
+    :param row: (account_id, customer_id, account_number, balance) row.
+    :return: The account.
+    """
+    return Account(row[0], row[1], int(row[2]), row[3])
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Find the smallest string sorting above every string that starts with a prefix.
+
+    Trailing U+10FFFF characters cannot be incremented and are dropped, and the surrogate range, which cannot
+    be stored as text, is skipped.
+
+    :param prefix: The prefix.
+    :return: The exclusive upper bound, or None if the prefix is empty or only holds U+10FFFF characters.
+    """
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    code = ord(stripped[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return stripped[:-1] + chr(code)
+
+
 class AccountRepository:
-    def __init__(self, db_connection=DatabaseConnection()) -> None:
+    # Number of IDs bound per "IN (...)" query; SQLite builds older than 3.32 allow 999 parameters.
+    ID_CHUNK_SIZE = 500
+
+    def __init__(self, db_connection=DatabaseConnection(), cache: Optional[AccountCache] = None,
+                 idempotency_filter: Optional[IdempotencyKeyFilter] = None) -> None:
         """
         Initialize an AccountRepository object.
 
         The AccountRepository interacts with the database to perform operations on accounts and customers.
 
+        :param db_connection: The database connection to use.
+        :param cache: Optional read-through cache for account lookups. It is only filled from committed
+                      state and entries are dropped on every write to the account.
+        :param idempotency_filter: Filter in front of the idempotency key index (a default one is created on
+                                   first use). It is loaded with the keys already recorded when first used.
         :return: None
         """
         self.db_connection = db_connection
+        self.cache = cache
+        self._idempotency_filter = idempotency_filter
+        self._idempotency_filter_loaded = False
 
     def save_account(self, account: Account, customer: Optional[Customer] = None) -> Account:
         """
@@ -26,10 +94,7 @@ class AccountRepository:
         :return: The saved or updated account.
         :raises RuntimeError: If an error occurs during the database operation.
         """
-        connection = self.db_connection.create_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        try:
+        with self.db_connection.connection() as connection:
             already_account = self.find_accounts_by_customer_id(account.customer_id)
             if already_account:
                 account.account_id = already_account.account_id
@@ -40,13 +105,8 @@ class AccountRepository:
             self._save_customer(customer, connection)
             _, account_id = self._save_account(account, connection)
             account.set_account_id(account_id)
-            connection.commit()
-            return account
-        except RuntimeError as e:
-            connection.rollback()
-            raise RuntimeError(e)
-        finally:
-            connection.close()
+            self._invalidate_cache(account_id, account.customer_id)
+        return account
 
     def _save_customer(self, customer: Customer, connection: connect):
         """
@@ -58,8 +118,10 @@ class AccountRepository:
         """
         if customer:
             return self.db_connection.execute_query(
-                "INSERT OR IGNORE INTO Customers (customer_id, name, phone_number, email) VALUES(?,?,?,?)",
-                (customer.customer_id, customer.name, customer.phone_number, customer.email), connection)
+                f"INSERT OR IGNORE INTO Customers ({CUSTOMER_COLUMNS}, email_key, phone_key, name_key) "
+                "VALUES(?,?,?,?,?,?,?)",
+                (customer.customer_id, customer.name, customer.phone_number, customer.email)
+                + customer.lookup_keys(), connection)
         return None, None
 
     def _save_account(self, account: Account, connection: connect):
@@ -83,6 +145,428 @@ class AccountRepository:
                 (account.customer_id, account.account_number, account.balance),
                 connection)
 
+    def allocate_account_numbers(self, count: int) -> range:
+        """
+        Reserve a block of account numbers from the database sequence.
+
+        Numbers are never handed out twice, even across processes; numbers reserved but not used are
+        simply skipped.
+
+        :param count: Number of account numbers to reserve.
+        :return: The reserved account numbers.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if count <= 0:
+            return range(0)
+        with self.db_connection.connection(immediate=True) as connection:
+            self.db_connection.execute_query(
+                "UPDATE AccountNumberSequence SET next_value = next_value + ? WHERE id = 1", (count,), connection)
+            data_list, _ = self.db_connection.execute_query(
+                "SELECT next_value FROM AccountNumberSequence WHERE id = 1", (), connection)
+        end = data_list[0][0]
+        return range(end - count, end)
+
+    def save_new_customers(self, customers: Sequence[Customer]) -> List[Tuple[int, str]]:
+        """
+        Insert customers, each with a new zero-balance account, in a single DB transaction.
+
+        Customers whose ID already exists, in the database or earlier in the batch, are rejected. The
+        others are written with executemany and get account numbers from the account number sequence.
+
+        :param customers: The customers to onboard.
+        :return: (position in `customers`, reason) for every rejected customer.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        rejected = []
+        with self.db_connection.connection(immediate=True) as connection:
+            existing = set()
+            customer_ids = [customer.customer_id for customer in customers]
+            for start in range(0, len(customer_ids), self.ID_CHUNK_SIZE):
+                chunk = customer_ids[start:start + self.ID_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                data_list, _ = self.db_connection.execute_query(
+                    f"SELECT customer_id FROM Customers WHERE customer_id IN ({placeholders})",
+                    tuple(chunk), connection)
+                existing.update(row[0] for row in data_list or ())
+
+            accepted = []
+            for position, customer in enumerate(customers):
+                if customer.customer_id in existing:
+                    rejected.append((position, "Customer already exists"))
+                    continue
+                existing.add(customer.customer_id)
+                accepted.append(customer)
+
+            account_numbers = self.allocate_account_numbers(len(accepted))
+            self.db_connection.execute_many(
+                f"INSERT INTO Customers ({CUSTOMER_COLUMNS}, email_key, phone_key, name_key) VALUES(?,?,?,?,?,?,?)",
+                [(customer.customer_id, customer.name, customer.phone_number, customer.email)
+                 + customer.lookup_keys() for customer in accepted],
+                connection)
+            self.db_connection.execute_many(
+                "INSERT INTO Accounts (customer_id, account_number, balance) VALUES (?,?,0)",
+                [(customer.customer_id, account_number)
+                 for customer, account_number in zip(accepted, account_numbers)],
+                connection)
+        return rejected
+
+    def record_transaction(self, account_id: int, amount: float, transaction_type: str) -> None:
+        """
+        Insert a ledger row without changing the account balance.
+
+        :param account_id: The ID of the account associated with the transaction.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :return: None
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        with self.db_connection.connection() as connection:
+            self.db_connection.execute_query(
+                "INSERT INTO Transactions (account_id, amount, transaction_type) VALUES (?,?,?)",
+                (account_id, amount, transaction_type),
+                connection)
+
+    def apply_transaction(self, account_id: int, amount: float, transaction_type: str,
+                          idempotency_key: Optional[str] = None) -> Account:
+        """
+        Apply a deposit or withdrawal and record it in the ledger in a single DB transaction.
+
+        The balance is changed with one conditional UPDATE, so concurrent writers cannot lose each
+        other's updates and a withdrawal can never overdraw the account. A transaction with an idempotency
+        key that was already recorded is not applied again; the account is returned with the balance
+        recorded by the original transaction.
+
+        :param account_id: The ID of the account on which the transaction is performed.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param idempotency_key: Optional client key identifying the transaction across retries.
+        :return: The account as stored after the transaction.
+        :raises ValueError: If the type or amount is invalid, the account does not exist, funds are insufficient
+                            or the idempotency key was recorded for a different transaction.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if idempotency_key is not None:
+            recorded = self._find_recorded_transactions([idempotency_key]).get(idempotency_key)
+            if recorded is not None:
+                return self._replay_transaction(recorded, account_id, amount, transaction_type)
+        try:
+            with self.db_connection.connection() as connection:
+                account = self._apply_transaction(account_id, amount, transaction_type, connection, idempotency_key)
+        except RuntimeError as e:
+            if not self._is_duplicate_key_error(e, idempotency_key):
+                raise
+            # Recorded by another process since the filter was loaded; the unique index caught it.
+            recorded = self._find_recorded_transactions([idempotency_key], verify=True).get(idempotency_key)
+            if recorded is None:
+                raise
+            return self._replay_transaction(recorded, account_id, amount, transaction_type)
+        if idempotency_key is not None:
+            self._remember_keys({idempotency_key: (account_id, amount, transaction_type, account.balance)})
+        return account
+
+    def _apply_transaction(self, account_id: int, amount: float, transaction_type: str,
+                           connection: connect, idempotency_key: Optional[str] = None) -> Account:
+        """
+        Apply a deposit or withdrawal on the given connection without committing.
+
+        :param account_id: The ID of the account on which the transaction is performed.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param connection: The database connection.
+        :param idempotency_key: Optional client key recorded with the ledger row.
+        :return: The account as stored after the transaction.
+        :raises ValueError: If the type or amount is invalid, the account does not exist or funds are insufficient.
+        """
+        Account.validate_amount(amount)
+        if transaction_type == "deposit":
+            query = "UPDATE Accounts SET balance = balance + ? WHERE account_id = ?"
+            query_data = (amount, account_id)
+        elif transaction_type == "withdraw":
+            query = "UPDATE Accounts SET balance = balance - ? WHERE account_id = ? AND balance >= ?"
+            query_data = (amount, account_id, amount)
+        else:
+            raise ValueError("Invalid transaction type")
+
+        changes_before = connection.total_changes
+        self.db_connection.execute_query(query, query_data, connection)
+        self._invalidate_cache(account_id)
+        if connection.total_changes == changes_before:
+            # Nothing was updated: tell a missing account apart from an overdraft.
+            self.find_account_by_id(account_id)
+            raise ValueError("Insufficient funds")
+
+        self.db_connection.execute_query(
+            "INSERT INTO Transactions (account_id, amount, transaction_type, idempotency_key, balance_after) "
+            "VALUES (?,?,?,?,(SELECT balance FROM Accounts WHERE account_id = ?))",
+            (account_id, amount, transaction_type, idempotency_key, account_id),
+            connection)
+        return self.find_account_by_id(account_id)
+
+    def apply_transactions(self, transactions: Sequence[Tuple[int, float, str]]) -> List[TransactionResult]:
+        """
+        Apply a batch of deposits and withdrawals in a single DB transaction.
+
+        Rows are validated in order against the Account deposit/withdraw rules, so a withdrawal can use
+        funds deposited by an earlier row of the same batch. Rejected rows are reported and skipped
+        without affecting the rest of the batch. Each account's balance is then updated once with its
+        net change and all accepted rows are written to the ledger with executemany.
+
+        Rows may carry an idempotency key as a fourth element. A row whose key was already recorded, by an
+        earlier batch or an earlier row of the same batch, is not applied again and gets the originally
+        recorded result.
+
+        :param transactions: Sequence of (account_id, amount, transaction_type[, idempotency_key]) rows.
+        :return: One TransactionResult per input row, in input order.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        try:
+            with self.db_connection.connection(immediate=True) as connection:
+                results, recorded = self._apply_transactions(transactions, connection)
+        except RuntimeError as e:
+            if not self._is_duplicate_key_error(e, True):
+                raise
+            # A key recorded by another process slipped past the filter; check every key against the index.
+            with self.db_connection.connection(immediate=True) as connection:
+                results, recorded = self._apply_transactions(transactions, connection, verify_keys=True)
+        self._remember_keys(recorded)
+        return results
+
+    def _apply_transactions(self, transactions: Sequence[tuple], connection: connect,
+                            verify_keys: bool = False) -> Tuple[List[TransactionResult], Dict[str, tuple]]:
+        """
+        Apply a batch of deposits and withdrawals on the given connection without committing.
+
+        :param transactions: Sequence of (account_id, amount, transaction_type[, idempotency_key]) rows.
+        :param connection: The database connection.
+        :param verify_keys: Look every idempotency key up in the database instead of trusting the filter.
+        :return: One TransactionResult per input row, in input order, and the idempotency keys recorded by
+                 the batch with their (account_id, amount, transaction_type, balance_after) rows.
+        """
+        transactions = [idempotent_row(row) for row in transactions]
+        keys = [row[3] for row in transactions if row[3] is not None]
+        recorded = self._find_recorded_transactions(keys, connection, verify_keys) if keys else {}
+        new_keys = {}
+        accounts = self._find_accounts_by_ids({row[0] for row in transactions}, connection)
+        net_changes = {}
+        ledger_rows = []
+        results = []
+        for account_id, amount, transaction_type, idempotency_key in transactions:
+            if idempotency_key is not None and idempotency_key in recorded:
+                try:
+                    balance = self._replay_transaction(recorded[idempotency_key], account_id, amount,
+                                                       transaction_type, accounts).balance
+                    results.append(TransactionResult(account_id, amount, transaction_type, True, balance))
+                except ValueError as e:
+                    results.append(TransactionResult(account_id, amount, transaction_type, False, error=str(e)))
+                continue
+            account = accounts.get(account_id)
+            try:
+                if account is None:
+                    raise ValueError("Account not found for given account id.")
+                if transaction_type == "deposit":
+                    balance = account.deposit(amount)
+                    change = amount
+                elif transaction_type == "withdraw":
+                    balance = account.withdraw(amount)
+                    change = -amount
+                else:
+                    raise ValueError("Invalid transaction type")
+            except (ValueError, TypeError) as e:
+                results.append(TransactionResult(account_id, amount, transaction_type, False, error=str(e)))
+                continue
+            net_changes[account_id] = net_changes.get(account_id, 0) + change
+            ledger_rows.append((account_id, amount, transaction_type, idempotency_key, balance))
+            results.append(TransactionResult(account_id, amount, transaction_type, True, balance))
+            if idempotency_key is not None:
+                recorded[idempotency_key] = new_keys[idempotency_key] = (account_id, amount, transaction_type,
+                                                                         balance)
+
+        self.db_connection.execute_many(
+            "UPDATE Accounts SET balance = balance + ? WHERE account_id = ?",
+            [(change, account_id) for account_id, change in sorted(net_changes.items())],
+            connection)
+        for account_id in net_changes:
+            self._invalidate_cache(account_id)
+        self.db_connection.execute_many(
+            "INSERT INTO Transactions (account_id, amount, transaction_type, idempotency_key, balance_after) "
+            "VALUES (?,?,?,?,?)",
+            ledger_rows,
+            connection)
+        return results, new_keys
+
+    def _find_recorded_transactions(self, keys: Sequence[str], connection: Optional[connect] = None,
+                                    verify: bool = False) -> Dict[str, tuple]:
+        """
+        Look up the transactions already recorded under idempotency keys.
+
+        Keys the filter has never seen are skipped without a query, and recently recorded keys are answered
+        from the filter's cache, unless `verify` is set.
+
+        :param keys: The idempotency keys.
+        :param connection: The database connection (a read connection is used if None).
+        :param verify: Look every key up in the database.
+        :return: (account_id, amount, transaction_type, balance_after) per recorded key.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        key_filter = self._idempotency_keys()
+        recorded = {}
+        lookups = []
+        for key in keys:
+            if verify:
+                lookups.append(key)
+            elif key_filter.might_contain(key):
+                row = key_filter.get_recent(key)
+                if row is None:
+                    lookups.append(key)
+                else:
+                    recorded[key] = row
+        if not lookups:
+            return recorded
+        with self.db_connection.read_connection() if connection is None else nullcontext(connection) as connection:
+            for start in range(0, len(lookups), self.ID_CHUNK_SIZE):
+                chunk = lookups[start:start + self.ID_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                data_list, _ = self.db_connection.execute_query(
+                    "SELECT idempotency_key, account_id, amount, transaction_type, balance_after FROM Transactions "
+                    f"WHERE idempotency_key IN ({placeholders}) UNION ALL "
+                    "SELECT idempotency_key, account_id, amount, transaction_type, balance_after "
+                    f"FROM ArchivedIdempotencyKeys WHERE idempotency_key IN ({placeholders})",
+                    tuple(chunk) * 2, connection)
+                recorded.update((row[0], row[1:]) for row in data_list or ())
+        return recorded
+
+    def _replay_transaction(self, recorded: tuple, account_id: int, amount: float, transaction_type: str,
+                            accounts: Optional[Dict[int, Account]] = None) -> Account:
+        """
+        Build the result of a transaction already recorded under the same idempotency key.
+
+        :param recorded: The recorded (account_id, amount, transaction_type, balance_after) row.
+        :param account_id: The ID of the account of the retried transaction.
+        :param amount: The amount of the retried transaction.
+        :param transaction_type: The type of the retried transaction.
+        :param accounts: Accounts already loaded, by ID.
+        :return: The account with the balance recorded after the original transaction.
+        :raises ValueError: If the key was recorded for a different transaction.
+        """
+        if tuple(recorded[:3]) != (account_id, amount, transaction_type):
+            raise ValueError("Idempotency key was already used for a different transaction.")
+        account = (accounts or {}).get(account_id) or self.find_account_by_id(account_id)
+        return Account(account_id, account.customer_id, account.account_number, recorded[3])
+
+    def _remember_keys(self, recorded: Dict[str, tuple]) -> None:
+        """
+        Add committed idempotency keys and their results to the filter.
+
+        :param recorded: (account_id, amount, transaction_type, balance_after) per key.
+        :return: None
+        """
+        if recorded:
+            key_filter = self._idempotency_keys()
+            self.db_connection.on_commit(lambda: [key_filter.add(key, row) for key, row in recorded.items()])
+
+    def _idempotency_keys(self) -> IdempotencyKeyFilter:
+        """
+        Get the idempotency key filter, loading the keys already recorded on first use.
+
+        :return: The filter.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if self._idempotency_filter is None:
+            self._idempotency_filter = IdempotencyKeyFilter()
+        if not self._idempotency_filter_loaded:
+            with self.db_connection.read_connection() as connection:
+                for rows in self.db_connection.iter_query(
+                        "SELECT idempotency_key FROM Transactions WHERE idempotency_key IS NOT NULL "
+                        "UNION ALL SELECT idempotency_key FROM ArchivedIdempotencyKeys", (), connection, 10000):
+                    self._idempotency_filter.add_all(row[0] for row in rows)
+            self._idempotency_filter_loaded = True
+        return self._idempotency_filter
+
+    def _is_duplicate_key_error(self, error: RuntimeError, idempotency_key) -> bool:
+        """
+        Tell whether a failed write hit the idempotency key index and can be retried as a lookup.
+
+        Only the outermost transaction can recover, since an enclosing one would keep the partial write.
+
+        :param error: The error raised by the write.
+        :param idempotency_key: The key of the write, or a truthy value for batches.
+        :return: True if the write failed on a duplicate idempotency key.
+        """
+        return (idempotency_key is not None and isinstance(error.__cause__, sqlite3.IntegrityError)
+                and "idempotency_key" in str(error) and not self.db_connection.in_transaction())
+
+    def apply_transfer(self, source_account_id: int, credits: Sequence[Tuple[int, float]]) -> Account:
+        """
+        Debit one account and credit one or many others in a single DB transaction.
+
+        The source is checked for funds and debited once, against the total of all credits, then every
+        credited account is updated with one executemany in ascending account_id order. The ledger gets one
+        withdrawal on the source for the total and one deposit per credit, inserted with executemany.
+
+        :param source_account_id: The ID of the account to debit.
+        :param credits: (account_id, amount) for every credit; an account may appear more than once.
+        :return: The source account as stored after the transfer.
+        :raises ValueError: If there are no credits, an amount is invalid, an account does not exist, the source
+                            is also credited, or the source has insufficient funds.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if not credits:
+            raise ValueError("A transfer needs at least one credit.")
+        net_credits = {}
+        for account_id, amount in credits:
+            Account.validate_amount(amount)
+            if account_id == source_account_id:
+                raise ValueError("Cannot transfer to the source account.")
+            net_credits[account_id] = net_credits.get(account_id, 0) + amount
+        total = sum(amount for _, amount in credits)
+
+        with self.db_connection.connection(immediate=True) as connection:
+            targets = self._find_accounts_by_ids(net_credits, connection)
+            if len(targets) != len(net_credits):
+                raise ValueError("Account not found for given account id.")
+
+            changes_before = connection.total_changes
+            self.db_connection.execute_query(
+                "UPDATE Accounts SET balance = balance - ? WHERE account_id = ? AND balance >= ?",
+                (total, source_account_id, total), connection)
+            if connection.total_changes == changes_before:
+                self.find_account_by_id(source_account_id)
+                raise ValueError("Insufficient funds")
+            self.db_connection.execute_many(
+                "UPDATE Accounts SET balance = balance + ? WHERE account_id = ?",
+                [(change, account_id) for account_id, change in sorted(net_credits.items())],
+                connection)
+            for account_id in [source_account_id, *net_credits]:
+                self._invalidate_cache(account_id)
+
+            ledger_rows = [(source_account_id, total, "withdraw")]
+            ledger_rows.extend((account_id, amount, "deposit") for account_id, amount in credits)
+            self.db_connection.execute_many(
+                "INSERT INTO Transactions (account_id, amount, transaction_type) VALUES (?,?,?)",
+                ledger_rows,
+                connection)
+            return self.find_account_by_id(source_account_id)
+
+    def _find_accounts_by_ids(self, account_ids: Iterable[int], connection: connect) -> Dict[int, Account]:
+        """
+        Load several accounts at once, querying in chunks to stay under SQLite's parameter limit.
+
+        :param account_ids: The IDs of the accounts to load.
+        :param connection: The database connection.
+        :return: Mapping of account ID to account for the accounts that exist.
+        """
+        account_ids = list(account_ids)
+        accounts = {}
+        for start in range(0, len(account_ids), self.ID_CHUNK_SIZE):
+            chunk = account_ids[start:start + self.ID_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            data_list, _ = self.db_connection.execute_query(
+                f"SELECT {ACCOUNT_COLUMNS} FROM Accounts WHERE account_id IN ({placeholders})", tuple(chunk),
+                connection, row_factory=account_row_factory)
+            for account in data_list or ():
+                accounts[account.account_id] = account
+        return accounts
+
     def find_account_by_id(self, account_id: int) -> Account:
         """
         Find an account by its ID in the database.
@@ -91,13 +575,20 @@ class AccountRepository:
         :return: The found account.
         :raises ValueError: If the account is not found for the given ID.
         """
-        connection = self.db_connection.create_db_connection()
-        data_list, _ = self.db_connection.execute_query("SELECT * FROM Accounts WHERE account_id =?",
-                                                        (account_id,),
-                                                        connection)
+        generation = None
+        if self.cache is not None:
+            account = self.cache.get_by_id(account_id)
+            if account is not None:
+                return account
+            generation = self.cache.generation()
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(
+                f"SELECT {ACCOUNT_COLUMNS} FROM Accounts WHERE account_id =?",
+                (account_id,),
+                connection, row_factory=account_row_factory)
+            cacheable = not connection.in_transaction
         if data_list:
-            data = data_list[0]
-            return Account(data[0], data[1], int(data[2]), data[3])
+            return self._cache_account(data_list[0], cacheable, generation)
         raise ValueError("Account not found for given account id.")
 
     def find_accounts_by_customer_id(self, customer_id: int) -> Union[None, Account]:
@@ -107,11 +598,391 @@ class AccountRepository:
         :param customer_id: The ID of the customer.
         :return: The found account or None if not found.
         """
-        connection = self.db_connection.create_db_connection()
-        data_list, _ = self.db_connection.execute_query("SELECT * FROM Accounts WHERE customer_id =?",
-                                                        (customer_id,),
-                                                        connection)
+        generation = None
+        if self.cache is not None:
+            account = self.cache.get_by_customer_id(customer_id)
+            if account is not None:
+                return account
+            generation = self.cache.generation()
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(
+                f"SELECT {ACCOUNT_COLUMNS} FROM Accounts WHERE customer_id =?",
+                (customer_id,),
+                connection, row_factory=account_row_factory)
+            cacheable = not connection.in_transaction
         if data_list:
-            data = data_list[0]
-            return Account(data[0], data[1], int(data[2]), data[3])
+            return self._cache_account(data_list[0], cacheable, generation)
         return None
+
+    def find_customers_by_email(self, email: str) -> List[Customer]:
+        """
+        Find the customers registered with an email address, ignoring case and surrounding whitespace.
+
+        :param email: The email address.
+        :return: The matching customers in customer_id order.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        return self._find_customers("email_key = ?", (Customer.email_key(email),))
+
+    def find_customers_by_phone(self, phone_number: str) -> List[Customer]:
+        """
+        Find the customers registered with a phone number, comparing digits only.
+
+        :param phone_number: The phone number in any format.
+        :return: The matching customers in customer_id order.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        return self._find_customers("phone_key = ?", (Customer.phone_key(phone_number),))
+
+    def search_customers_by_name(self, prefix: str, limit: int = 50,
+                                 after: Optional[Customer] = None) -> List[Customer]:
+        """
+        Find customers whose name starts with a prefix, ignoring case and repeated whitespace.
+
+        Results are ordered by normalized name, then customer_id, and read as a range of the name index, so
+        each page costs the same however deep it is.
+
+        :param prefix: The name prefix.
+        :param limit: Maximum number of customers returned.
+        :param after: The last customer of the previous page, or None for the first page.
+        :return: The matching customers.
+        :raises ValueError: If the limit is not positive.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if limit <= 0:
+            raise ValueError("limit must be positive.")
+        start = Customer.name_key(prefix)
+        where, query_data = "name_key >= ?", [start]
+        end = _prefix_upper_bound(start)
+        if end is not None:
+            where += " AND name_key < ?"
+            query_data.append(end)
+        if after is not None:
+            where += " AND (name_key, customer_id) > (?, ?)"
+            query_data.extend((Customer.name_key(after.name), after.customer_id))
+        return self._find_customers(where, tuple(query_data), order_by="name_key, customer_id", limit=limit)
+
+    def find_existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        """
+        Check which email addresses are already registered, e.g. before onboarding a batch.
+
+        :param emails: The email addresses.
+        :return: The given addresses that belong to a customer, compared like find_customers_by_email.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        by_key = {}
+        for email in emails:
+            by_key.setdefault(Customer.email_key(email), []).append(email)
+        keys = list(by_key)
+        existing = set()
+        with self.db_connection.read_connection() as connection:
+            for start in range(0, len(keys), self.ID_CHUNK_SIZE):
+                chunk = keys[start:start + self.ID_CHUNK_SIZE]
+                data_list, _ = self.db_connection.execute_query(
+                    f"SELECT DISTINCT email_key FROM Customers WHERE email_key IN ({','.join('?' * len(chunk))})",
+                    tuple(chunk), connection)
+                for row in data_list or ():
+                    existing.update(by_key[row[0]])
+        return existing
+
+    def _find_customers(self, where: str, query_data: tuple, order_by: str = "customer_id",
+                        limit: Optional[int] = None) -> List[Customer]:
+        """
+        Read customers matching a condition.
+
+        :param where: Condition of the query.
+        :param query_data: Parameters of the condition.
+        :param order_by: Ordering of the result.
+        :param limit: Maximum number of customers returned, or None for all.
+        :return: The customers.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        query = f"SELECT {CUSTOMER_COLUMNS} FROM Customers WHERE {where} ORDER BY {order_by}"
+        if limit is not None:
+            query, query_data = query + " LIMIT ?", query_data + (limit,)
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(query, query_data, connection)
+        return [Customer(*row) for row in data_list or ()]
+
+    def _cache_account(self, account: Account, cacheable: bool, generation: Optional[int]) -> Account:
+        """
+        Store a freshly read account in the cache when it reflects committed state.
+
+        Reads made inside a write transaction may see uncommitted changes, so they are not cached. Neither
+        are reads overtaken by a write that invalidated the account after the read started.
+
+        :param account: The account read from the database.
+        :param cacheable: Whether the read ran outside of a write transaction.
+        :param generation: The cache generation taken before the read.
+        :return: The account.
+        """
+        if self.cache is not None and cacheable:
+            self.cache.put(account, generation)
+        return account
+
+    def _invalidate_cache(self, account_id: Optional[int] = None, customer_id: Optional[int] = None) -> None:
+        """
+        Drop cached entries for an account being written, now and again once the write has committed.
+
+        The second invalidation stops readers on other connections, which may have read the old committed
+        row while this transaction was still open, from caching it afterwards.
+
+        :param account_id: The ID of the account being written.
+        :param customer_id: The ID of the customer whose account is being written.
+        :return: None
+        """
+        if self.cache is None:
+            return
+        self.cache.invalidate(account_id, customer_id)
+        self.db_connection.on_commit(lambda: self.cache.invalidate(account_id, customer_id))
+
+    def iter_account_batches(self, batch_size: int = 10000) -> Iterator[AccountBatch]:
+        """
+        Stream every account in account_id order as compact read-only batches.
+
+        :param batch_size: Number of accounts per batch.
+        :return: Iterator of AccountBatch objects.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        with self.db_connection.read_connection() as connection:
+            for rows in self.db_connection.iter_query(f"SELECT {ACCOUNT_COLUMNS} FROM Accounts ORDER BY account_id",
+                                                      (), connection, batch_size):
+                yield AccountBatch(rows)
+
+    def iter_transactions(self, account_id: int, start: Union[None, str, datetime] = None,
+                          end: Union[None, str, datetime] = None, after_transaction_id: Optional[int] = None,
+                          limit: Optional[int] = None, fetch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Stream the ledger rows of an account in transaction_id order.
+
+        Rows are fetched from the cursor in batches of `fetch_size`, so memory does not grow with the
+        length of the account history.
+
+        :param account_id: The ID of the account.
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :param after_transaction_id: Only include transactions with a greater transaction_id (keyset pagination).
+        :param limit: Maximum number of rows to return.
+        :param fetch_size: Number of rows fetched from the cursor at a time.
+        :return: Iterator of (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        query = ("SELECT transaction_id, account_id, amount, transaction_type, timestamp "
+                 "FROM Transactions WHERE account_id = ?")
+        query_data = [account_id]
+        if after_transaction_id is not None:
+            query += " AND transaction_id > ?"
+            query_data.append(after_transaction_id)
+        if start is not None:
+            query += " AND timestamp >= ?"
+            query_data.append(self.format_timestamp(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            query_data.append(self.format_timestamp(end))
+        query += " ORDER BY transaction_id"
+        if limit is not None:
+            query += " LIMIT ?"
+            query_data.append(limit)
+
+        with self.db_connection.read_connection() as connection:
+            for rows in self.db_connection.iter_query(query, tuple(query_data), connection, fetch_size):
+                yield from rows
+
+    def get_balance_at(self, account_id: int, moment: Union[str, datetime], archive=None) -> float:
+        """
+        Compute an account's balance from its ledger as of a point in time.
+
+        The nearest daily checkpoint closing before `moment` is used as the starting point, so only the
+        ledger rows between that checkpoint and `moment` are summed. Rows already archived out of that range
+        are read from `archive`.
+
+        :param account_id: The ID of the account.
+        :param moment: Only transactions strictly before this time are counted.
+        :param archive: Optional TransactionArchive holding ledger rows moved out of the database.
+        :return: The balance as of `moment`.
+        :raises ValueError: If rows between the checkpoint and `moment` were archived and no archive is given.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        moment = self.format_timestamp(moment)
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(
+                "SELECT date(day, '+1 day'), balance FROM BalanceCheckpoints WHERE account_id = ? AND day < date(?) "
+                "ORDER BY day DESC LIMIT 1",
+                (account_id, moment), connection)
+            since, balance = data_list[0] if data_list else (None, 0)
+            data_list, _ = self.db_connection.execute_query(
+                f"SELECT COALESCE(SUM({SIGNED_AMOUNT_SQL}), 0) FROM Transactions "
+                "WHERE account_id = ? AND timestamp >= ? AND timestamp < ?",
+                (account_id, since or "", moment), connection)
+            balance += data_list[0][0]
+            if archive is None:
+                archived, _ = self.db_connection.execute_query(
+                    "SELECT 1 FROM ArchiveSegments WHERE min_timestamp < ? AND max_timestamp >= ? LIMIT 1",
+                    (moment, since or ""), connection)
+                if archived:
+                    raise ValueError(f"Ledger rows before {moment} were archived; pass the archive.")
+        if archive is not None:
+            since = since if since is None else self.format_timestamp(date.fromisoformat(since))
+            for row in archive.iter_transactions(account_id, start=since, end=moment):
+                balance += row[2] if row[3] == "deposit" else -row[2]
+        return balance
+
+    def compact_balance_checkpoints(self, up_to_day: Union[str, date]) -> int:
+        """
+        Write daily closing balance checkpoints for every account active since the last compaction.
+
+        Days after the newest existing checkpoint, up to and including `up_to_day`, are summed per account
+        and day and added to each account's previous checkpoint. Running the compaction again for the same
+        days rewrites the same values. Only completed days should be compacted, since ledger rows written
+        later for an already compacted day are not picked up.
+
+        :param up_to_day: Last day (UTC, as stored by CURRENT_TIMESTAMP) to checkpoint.
+        :return: The number of checkpoints written.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        up_to_day = up_to_day.isoformat() if isinstance(up_to_day, date) else up_to_day
+        with self.db_connection.connection(immediate=True) as connection:
+            data_list, _ = self.db_connection.execute_query(
+                "SELECT MAX(day) FROM BalanceCheckpoints", (), connection)
+            last_day = data_list[0][0]
+            from_day = "0000-00-00" if last_day is None else self.db_connection.execute_query(
+                "SELECT date(?, '+1 day')", (last_day,), connection)[0][0][0]
+            changes_before = connection.total_changes
+            self.db_connection.execute_query(
+                "INSERT OR REPLACE INTO BalanceCheckpoints (account_id, day, balance) "
+                "SELECT d.account_id, d.day, "
+                "       COALESCE((SELECT c.balance FROM BalanceCheckpoints c "
+                "                 WHERE c.account_id = d.account_id AND c.day < ? "
+                "                 ORDER BY c.day DESC LIMIT 1), 0) "
+                "       + SUM(d.delta) OVER (PARTITION BY d.account_id ORDER BY d.day) "
+                f"FROM (SELECT account_id, date(timestamp) AS day, SUM({SIGNED_AMOUNT_SQL}) AS delta "
+                "      FROM Transactions WHERE timestamp >= ? AND timestamp < date(?, '+1 day') "
+                "      GROUP BY account_id, date(timestamp)) d",
+                (from_day, from_day, up_to_day), connection)
+            return connection.total_changes - changes_before
+
+    def get_daily_activity(self, start_day: Union[str, date], end_day: Union[str, date],
+                           account_id: Optional[int] = None) -> List[tuple]:
+        """
+        Read the daily activity totals of one account, or of the whole bank, for a range of days.
+
+        The totals are maintained by a trigger on every ledger insert, so this reads one row per active day
+        whatever the size of the ledger.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param account_id: The ID of the account, or None for bank-wide totals.
+        :return: (day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum) rows in day order,
+                 for the days with activity.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        query_data = (self.format_timestamp(start_day), self.format_timestamp(end_day))
+        if account_id is None:
+            query = f"SELECT day, {ACTIVITY_COLUMNS} FROM DailyActivity WHERE day BETWEEN date(?) AND date(?)"
+        else:
+            query = (f"SELECT day, {ACTIVITY_COLUMNS} FROM DailyAccountActivity "
+                     "WHERE account_id = ? AND day BETWEEN date(?) AND date(?)")
+            query_data = (account_id,) + query_data
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(query + " ORDER BY day", query_data, connection)
+        return data_list or []
+
+    def get_top_accounts(self, start_day: Union[str, date], end_day: Union[str, date], metric: str = "net_flow",
+                         limit: int = 10) -> List[tuple]:
+        """
+        Rank accounts by their activity totals over a range of days.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param metric: Name of the ranking expression in ACTIVITY_METRICS.
+        :param limit: Number of accounts returned.
+        :return: (account_id, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum, metric value) rows,
+                 highest value first.
+        :raises ValueError: If the metric is unknown.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if metric not in ACTIVITY_METRICS:
+            raise ValueError(f"Unsupported activity metric: {metric}")
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(
+                "SELECT account_id, SUM(deposit_count), SUM(deposit_sum), SUM(withdrawal_count), "
+                f"SUM(withdrawal_sum), {ACTIVITY_METRICS[metric]} AS value FROM DailyAccountActivity "
+                "WHERE day BETWEEN date(?) AND date(?) GROUP BY account_id ORDER BY value DESC, account_id LIMIT ?",
+                (self.format_timestamp(start_day), self.format_timestamp(end_day), limit), connection)
+        return data_list or []
+
+    def iter_reconciliation_chunks(self, fetch_size: int = 100000) -> Iterator[Tuple[str, list]]:
+        """
+        Stream every stored balance, then every signed ledger amount, from one consistent snapshot.
+
+        Both scans run in the same read transaction, so writes committed meanwhile are not seen by either.
+
+        :param fetch_size: Number of rows per chunk.
+        :return: Iterator of ("accounts", [(account_id, balance), ...]) chunks in account_id order, followed by
+                 ("ledger", [(account_id, signed amount), ...]) chunks; archived rows count as one row per
+                 account holding their total.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        with self.db_connection.read_connection() as connection:
+            snapshot = not connection.in_transaction
+            try:
+                if snapshot:
+                    connection.execute("BEGIN")
+                for kind, query in (
+                        ("accounts", "SELECT account_id, COALESCE(balance, 0) FROM Accounts ORDER BY account_id"),
+                        ("ledger", f"SELECT account_id, {SIGNED_AMOUNT_SQL} FROM Transactions "
+                                   "UNION ALL SELECT account_id, amount FROM ArchivedTotals")):
+                    for rows in self.db_connection.iter_query(query, (), connection, fetch_size):
+                        yield kind, rows
+            except sqlite3.Error as e:
+                raise RuntimeError(f"Could not execute query: {e}") from e
+            finally:
+                if snapshot and connection.in_transaction:
+                    connection.rollback()
+
+    def snapshot(self) -> ContextManager:
+        """
+        Run the repository's reads on the current thread against one read-only, point-in-time view.
+
+        Use it as `with account_repository.snapshot(): ...` around the queries of one report or statement,
+        so they are consistent with each other and do not contend with writers.
+
+        :return: Context manager providing the snapshot connection.
+        """
+        return self.db_connection.snapshot()
+
+    def backup(self, target_path: str) -> None:
+        """
+        Checkpoint, then copy the database into a detached file that reports can query without touching it.
+
+        :param target_path: Path of the copy; an existing file is overwritten.
+        :return: None
+        :raises RuntimeError: If the backup fails.
+        """
+        self.checkpoint()
+        self.db_connection.backup(target_path)
+
+    def checkpoint(self) -> int:
+        """
+        Make every acknowledged write visible in the database before it is read by other means.
+
+        This repository writes through to the database, so there is nothing to do; backends buffering
+        writes, such as InMemoryLedgerRepository, flush them here.
+
+        :return: The number of transactions written.
+        """
+        return 0
+
+    @staticmethod
+    def format_timestamp(value: Union[str, date, datetime]) -> str:
+        """
+        Format a time bound the way SQLite's CURRENT_TIMESTAMP stores the timestamp column.
+
+        :param value: A datetime, a date (meaning its midnight) or an already formatted string.
+        :return: The formatted timestamp.
+        """
+        if isinstance(value, datetime):
+            return value.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(value, date):
+            return value.strftime("%Y-%m-%d 00:00:00")
+        return value
@@ -0,0 +1,104 @@
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+
+class IdempotencyKeyFilter:
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.01, recent_size: int = 10000) -> None:
+        """
+        Initialize an IdempotencyKeyFilter object.
+
+        The IdempotencyKeyFilter sits in front of the unique idempotency key index. A bloom filter answers
+        "definitely new" for keys never recorded, so first attempts do not query the database, and a bounded
+        cache keeps the recorded result of recent keys, so most retries are answered without a query too.
+        The unique index stays the source of truth: keys recorded by other processes are caught there.
+
+        :param capacity: Number of keys the bloom filter is sized for; beyond it false positives, i.e.
+                         extra lookups, become more frequent.
+        :param error_rate: Target false positive rate at capacity.
+        :param recent_size: Number of recent keys whose result is kept.
+        :return: None
+        """
+        if capacity <= 0 or not 0 < error_rate < 1 or recent_size < 0:
+            raise ValueError("capacity must be positive, error_rate within (0, 1) and recent_size not negative.")
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.recent_size = recent_size
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._recent: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def might_contain(self, key: str) -> bool:
+        """
+        Tell whether a key may have been recorded.
+
+        :param key: The idempotency key.
+        :return: False if the key was definitely never added, True if it may have been.
+        """
+        return all(self._bits[bit >> 3] & (1 << (bit & 7)) for bit in self._bit_positions(key))
+
+    def add(self, key: str, result: Optional[tuple] = None) -> None:
+        """
+        Record a key, and optionally its result in the recent-key cache.
+
+        :param key: The idempotency key.
+        :param result: The recorded (account_id, amount, transaction_type, balance_after) row.
+        :return: None
+        """
+        with self._lock:
+            for bit in self._bit_positions(key):
+                self._bits[bit >> 3] |= 1 << (bit & 7)
+            if result is not None and self.recent_size:
+                self._recent[key] = result
+                self._recent.move_to_end(key)
+                if len(self._recent) > self.recent_size:
+                    self._recent.popitem(last=False)
+
+    def add_all(self, keys: Iterable[str]) -> None:
+        """
+        Record many keys without results, e.g. when loading the keys already in the database.
+
+        :param keys: The idempotency keys.
+        :return: None
+        """
+        for key in keys:
+            self.add(key)
+
+    def get_recent(self, key: str) -> Optional[tuple]:
+        """
+        Get the recorded result of a recent key.
+
+        :param key: The idempotency key.
+        :return: The (account_id, amount, transaction_type, balance_after) row, or None if it is not cached.
+        """
+        with self._lock:
+            result = self._recent.get(key)
+            if result is not None:
+                self._recent.move_to_end(key)
+            return result
+
+    def _bit_positions(self, key: str) -> Iterable[int]:
+        """
+        Compute the bloom filter bits of a key by double hashing one digest.
+
+        :param key: The idempotency key.
+        :return: The bit positions.
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self.bit_count for index in range(self.hash_count))
+
+
+def idempotent_row(row: Tuple) -> Tuple[int, float, str, Optional[str]]:
+    """
+    Split a transaction row into its fields and optional idempotency key.
+
+    :param row: (account_id, amount, transaction_type) or (account_id, amount, transaction_type, idempotency_key).
+    :return: (account_id, amount, transaction_type, idempotency_key or None).
+    """
+    if len(row) == 4:
+        return row
+    account_id, amount, transaction_type = row
+    return account_id, amount, transaction_type, None
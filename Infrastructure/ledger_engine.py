@@ -0,0 +1,677 @@
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from db.db_client import DatabaseConnection
+from Domain import Account, AccountBatch, Customer, TransactionResult
+from Infrastructure.account_repository import AccountRepository, ACCOUNT_COLUMNS
+from Infrastructure.idempotency import idempotent_row
+
+# WAL layout: a sequence of groups, each written with a single write call. A group is a header holding the
+# payload length and its CRC32, followed by the records. A torn or corrupt group fails its CRC and is
+# discarded as a whole, so multi-row operations such as transfers are recovered all-or-nothing.
+GROUP_HEADER = struct.Struct("<II")
+# sequence, account_id, amount, transaction type code, unix timestamp
+RECORD = struct.Struct("<QqdBd")
+# A record with an idempotency key has KEYED_RECORD set in its type code and is followed by the key's length
+# and its UTF-8 bytes.
+KEYED_RECORD = 0x80
+KEY_LENGTH = struct.Struct("<I")
+
+TRANSACTION_TYPE_CODES = {"deposit": 0, "withdraw": 1}
+TRANSACTION_TYPES = {code: name for name, code in TRANSACTION_TYPE_CODES.items()}
+
+
+class InMemoryLedgerRepository(AccountRepository):
+    def __init__(self, db_connection=DatabaseConnection(), wal_path: str = 'db/ledger.wal', group_commit: bool = True,
+                 sync_every: int = 1000, sync_interval: Optional[float] = 0.005,
+                 checkpoint_every: int = 100000) -> None:
+        """
+        Initialize an InMemoryLedgerRepository object.
+
+        The InMemoryLedgerRepository is an AccountRepository backend that keeps every account and balance in
+        memory, so lookups and balance updates are dictionary operations. Each transaction is appended to a
+        binary write-ahead log before it is acknowledged, and accumulated transactions are periodically
+        checkpointed into the Accounts and Transactions tables, after which the WAL is truncated. On startup
+        the state is loaded from SQLite and the WAL records newer than the last checkpoint are replayed.
+
+        With group commit, the default, a transaction is only acknowledged once the WAL has been fsynced
+        past its record. Callers waiting at the same time share one fsync: one of them syncs everything
+        written so far while the others keep appending, and the next fsync covers those. Without group
+        commit the WAL is fsynced once `sync_every` records are pending or `sync_interval` seconds have
+        passed, whichever comes first, so on power loss up to that many acknowledged transactions can be
+        lost. The engine must be the only writer of account balances while it runs, since checkpoints store
+        the in-memory balances.
+
+        :param db_connection: The database connection to use.
+        :param wal_path: Path of the write-ahead log file.
+        :param group_commit: Acknowledge transactions only once they are fsynced; False opts into
+                             acknowledging them as soon as they are written, with the syncs below.
+        :param sync_every: Without group commit, number of unsynced WAL records that triggers an fsync.
+        :param sync_interval: Without group commit, maximum seconds a WAL record stays unsynced (None disables
+                              the background sync).
+        :param checkpoint_every: Number of un-checkpointed transactions that triggers a checkpoint.
+        :return: None
+        """
+        super().__init__(db_connection)
+        if sync_every <= 0 or checkpoint_every <= 0:
+            raise ValueError("sync_every and checkpoint_every must be positive.")
+        self.wal_path = wal_path
+        self.group_commit = group_commit
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.checkpoint_every = checkpoint_every
+        self._lock = threading.RLock()
+        self._accounts: Dict[int, Tuple[int, int]] = {}
+        self._balances: Dict[int, float] = {}
+        self._by_customer: Dict[int, int] = {}
+        self._pending: List[tuple] = []
+        # Idempotency keys logged since the last checkpoint, with their (account_id, amount, transaction_type,
+        # balance_after) rows; older keys are answered from SQLite through the key filter.
+        self._pending_keys: Dict[str, tuple] = {}
+        self._next_sequence = 1
+        # Sequences up to _written_sequence are in the WAL, those up to _synced_sequence are durable. Only
+        # the thread that set _syncing fsyncs; the others wait on _durable for it to finish.
+        self._durable = threading.Condition()
+        self._syncing = False
+        self._recover()
+        self._written_sequence = self._synced_sequence = self._next_sequence - 1
+        self._wal_fd = os.open(self.wal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._stop = threading.Event()
+        self._syncer = None
+        if not group_commit and sync_interval is not None:
+            self._syncer = threading.Thread(target=self._sync_periodically, name="ledger-wal-sync", daemon=True)
+            self._syncer.start()
+
+    def find_account_by_id(self, account_id: int) -> Account:
+        """
+        Find an account by its ID in memory.
+
+        :param account_id: The ID of the account to search for.
+        :return: The found account.
+        :raises ValueError: If the account is not found for the given ID.
+        """
+        with self._lock:
+            return self._account(account_id)
+
+    def find_accounts_by_customer_id(self, customer_id: int) -> Union[None, Account]:
+        """
+        Find the account of a customer in memory.
+
+        :param customer_id: The ID of the customer.
+        :return: The found account or None if not found.
+        """
+        with self._lock:
+            account_id = self._by_customer.get(customer_id)
+            return None if account_id is None else self._account(account_id)
+
+    def save_account(self, account: Account, customer: Optional[Customer] = None) -> Account:
+        """
+        Save an account and its associated customer to the database and load it into memory.
+
+        Pending transactions are checkpointed first, so SQLite and memory agree on balances before the row is
+        written.
+
+        :param account: The account to be saved or updated.
+        :param customer: The associated customer, if any.
+        :return: The saved or updated account.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        with self._lock:
+            self.checkpoint()
+            account = super().save_account(account, customer)
+            self._load_accounts("WHERE account_id = ?", (account.account_id,))
+            return account
+
+    def save_new_customers(self, customers: Sequence[Customer]) -> List[Tuple[int, str]]:
+        """
+        Insert customers, each with a new zero-balance account, and load the new accounts into memory.
+
+        :param customers: The customers to onboard.
+        :return: (position in `customers`, reason) for every rejected customer.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        with self._lock:
+            rejected = super().save_new_customers(customers)
+            rejected_positions = {position for position, _ in rejected}
+            customer_ids = [customer.customer_id for position, customer in enumerate(customers)
+                            if position not in rejected_positions]
+            for start in range(0, len(customer_ids), self.ID_CHUNK_SIZE):
+                chunk = customer_ids[start:start + self.ID_CHUNK_SIZE]
+                self._load_accounts(f"WHERE customer_id IN ({','.join('?' * len(chunk))})", tuple(chunk))
+            return rejected
+
+    def record_transaction(self, account_id: int, amount: float, transaction_type: str) -> None:
+        """
+        Insert a ledger row without changing the account balance, after checkpointing pending transactions.
+
+        The WAL only holds balance changes, so the row is written to SQLite directly, in a durable commit, and
+        pending transactions are checkpointed first to keep the ledger in order.
+
+        :param account_id: The ID of the account associated with the transaction.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :return: None
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        with self._lock:
+            self.checkpoint()
+            with self.db_connection.connection(durable=True):
+                super().record_transaction(account_id, amount, transaction_type)
+
+    def apply_transaction(self, account_id: int, amount: float, transaction_type: str,
+                          idempotency_key: Optional[str] = None) -> Account:
+        """
+        Apply a deposit or withdrawal in memory after logging it to the WAL.
+
+        :param account_id: The ID of the account on which the transaction is performed.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param idempotency_key: Optional client key identifying the transaction across retries.
+        :return: The account after the transaction, or with the recorded balance for a retried key.
+        :raises ValueError: If the type or amount is invalid, the account does not exist, funds are insufficient
+                            or the idempotency key was recorded for a different transaction.
+        """
+        if idempotency_key is not None:
+            result = self.apply_transactions([(account_id, amount, transaction_type, idempotency_key)])[0]
+            if not result.success:
+                raise ValueError(result.error)
+            with self._lock:
+                account = self._account(account_id)
+            return Account(account_id, account.customer_id, account.account_number, result.balance)
+        with self._lock:
+            balance = self._checked_balance(account_id, amount, transaction_type)
+            sequence = self._append([(account_id, amount, transaction_type, None, balance)])
+            self._balances[account_id] = balance
+            account = self._account(account_id)
+        self._commit(sequence)
+        return account
+
+    def apply_transactions(self, transactions: Sequence[tuple]) -> List[TransactionResult]:
+        """
+        Apply a batch of deposits and withdrawals in memory, logging the accepted rows as one WAL group.
+
+        Idempotency keys are logged with their rows. A retried key is answered with the balance recorded after
+        the original transaction, from memory while the key is pending and from SQLite once it was checkpointed.
+
+        :param transactions: Sequence of (account_id, amount, transaction_type[, idempotency_key]) rows.
+        :return: One TransactionResult per input row, in input order.
+        """
+        transactions = [idempotent_row(row) for row in transactions]
+        results = []
+        with self._lock:
+            keys = [row[3] for row in transactions if row[3] is not None and row[3] not in self._pending_keys]
+            recorded = self._find_recorded_transactions(keys) if keys else {}
+            balances = {}
+            new_keys = {}
+            accepted = []
+            for account_id, amount, transaction_type, idempotency_key in transactions:
+                previous = None
+                if idempotency_key is not None:
+                    previous = recorded.get(idempotency_key) or self._pending_keys.get(idempotency_key)
+                try:
+                    if previous is not None:
+                        balance = self._replay_transaction(previous, account_id, amount, transaction_type,
+                                                           {account_id: self._account(account_id)}).balance
+                        results.append(TransactionResult(account_id, amount, transaction_type, True, balance))
+                        continue
+                    current = balances.get(account_id, self._balances.get(account_id))
+                    balance = self._checked_balance(account_id, amount, transaction_type, current)
+                except (ValueError, TypeError) as e:
+                    results.append(TransactionResult(account_id, amount, transaction_type, False, error=str(e)))
+                    continue
+                balances[account_id] = balance
+                accepted.append((account_id, amount, transaction_type, idempotency_key, balance))
+                results.append(TransactionResult(account_id, amount, transaction_type, True, balance))
+                if idempotency_key is not None:
+                    recorded[idempotency_key] = new_keys[idempotency_key] = (account_id, amount, transaction_type,
+                                                                             balance)
+            sequence = self._append(accepted)
+            self._balances.update(balances)
+            self._pending_keys.update(new_keys)
+        self._commit(sequence)
+        return results
+
+    def apply_transfer(self, source_account_id: int, credits: Sequence[Tuple[int, float]]) -> Account:
+        """
+        Debit one account and credit one or many others atomically, logging the transfer as one WAL group.
+
+        :param source_account_id: The ID of the account to debit.
+        :param credits: (account_id, amount) for every credit; an account may appear more than once.
+        :return: The source account after the transfer.
+        :raises ValueError: If there are no credits, an amount is invalid, an account does not exist, the source
+                            is also credited, or the source has insufficient funds.
+        """
+        if not credits:
+            raise ValueError("A transfer needs at least one credit.")
+        for account_id, amount in credits:
+            Account.validate_amount(amount)
+            if account_id == source_account_id:
+                raise ValueError("Cannot transfer to the source account.")
+        total = sum(amount for _, amount in credits)
+        with self._lock:
+            for account_id, _ in credits:
+                self._account(account_id)
+            source_balance = self._checked_balance(source_account_id, total, "withdraw")
+            rows = [(source_account_id, total, "withdraw", None, source_balance)]
+            balances = {source_account_id: source_balance}
+            for account_id, amount in credits:
+                balances[account_id] = balances.get(account_id, self._balances[account_id]) + amount
+                rows.append((account_id, amount, "deposit", None, balances[account_id]))
+            sequence = self._append(rows)
+            self._balances.update(balances)
+            account = self._account(source_account_id)
+        self._commit(sequence)
+        return account
+
+    def iter_transactions(self, *args, **kwargs) -> Iterator[tuple]:
+        """
+        Stream the ledger rows of an account, checkpointing pending transactions first.
+
+        Takes the same arguments as AccountRepository.iter_transactions.
+
+        :return: Iterator of (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+        """
+        self.checkpoint()
+        return super().iter_transactions(*args, **kwargs)
+
+    def get_balance_at(self, account_id: int, moment, archive=None) -> float:
+        """
+        Compute an account's balance as of a point in time, checkpointing pending transactions first.
+
+        :param account_id: The ID of the account.
+        :param moment: Only transactions strictly before this time are counted.
+        :param archive: Optional TransactionArchive holding ledger rows moved out of the database.
+        :return: The balance as of `moment`.
+        """
+        self.checkpoint()
+        return super().get_balance_at(account_id, moment, archive)
+
+    def compact_balance_checkpoints(self, up_to_day) -> int:
+        """
+        Write daily balance checkpoints, checkpointing pending transactions first.
+
+        :param up_to_day: Last day to checkpoint.
+        :return: The number of checkpoints written.
+        """
+        self.checkpoint()
+        return super().compact_balance_checkpoints(up_to_day)
+
+    def get_daily_activity(self, *args, **kwargs) -> List[tuple]:
+        """
+        Read daily activity totals, checkpointing pending transactions first.
+
+        Takes the same arguments as AccountRepository.get_daily_activity.
+
+        :return: (day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum) rows in day order.
+        """
+        self.checkpoint()
+        return super().get_daily_activity(*args, **kwargs)
+
+    def get_top_accounts(self, *args, **kwargs) -> List[tuple]:
+        """
+        Rank accounts by their activity totals, checkpointing pending transactions first.
+
+        Takes the same arguments as AccountRepository.get_top_accounts.
+
+        :return: (account_id, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum, metric value) rows.
+        """
+        self.checkpoint()
+        return super().get_top_accounts(*args, **kwargs)
+
+    def iter_reconciliation_chunks(self, fetch_size: int = 100000) -> Iterator[Tuple[str, list]]:
+        """
+        Stream stored balances and signed ledger amounts, checkpointing pending transactions first.
+
+        :param fetch_size: Number of rows per chunk.
+        :return: Iterator of ("accounts", rows) chunks followed by ("ledger", rows) chunks.
+        """
+        self.checkpoint()
+        return super().iter_reconciliation_chunks(fetch_size)
+
+    def iter_account_batches(self, batch_size: int = 10000) -> Iterator[AccountBatch]:
+        """
+        Stream every account in account_id order as compact read-only batches, from memory.
+
+        :param batch_size: Number of accounts per batch.
+        :return: Iterator of AccountBatch objects.
+        """
+        with self._lock:
+            rows = [(account_id, customer_id, account_number, self._balances[account_id])
+                    for account_id, (customer_id, account_number) in sorted(self._accounts.items())]
+        for start in range(0, len(rows), batch_size):
+            yield AccountBatch(rows[start:start + batch_size])
+
+    @contextmanager
+    def snapshot(self) -> Iterator[sqlite3.Connection]:
+        """
+        Checkpoint pending transactions, then run the reads on the current thread against one read-only view.
+
+        Transactions applied while the snapshot is open stay pending and are not part of it.
+
+        :return: The snapshot connection.
+        """
+        self.checkpoint()
+        with super().snapshot() as connection:
+            yield connection
+
+    def checkpoint(self) -> int:
+        """
+        Write every pending transaction, with its idempotency key, and the touched balances to SQLite, then
+        truncate the WAL.
+
+        The last checkpointed WAL sequence is committed in the same DB transaction, so WAL records that
+        survive a crash between the commit and the truncation are not replayed twice. The commit is made
+        durable (`synchronous=FULL`) before the WAL is truncated, since the WAL may then hold the only copy
+        of acknowledged transactions. Inside a snapshot, which cannot write, nothing is checkpointed.
+
+        :return: The number of transactions checkpointed.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if self.db_connection.in_snapshot():
+            return 0
+        with self._lock:
+            pending = self._pending
+            if not pending:
+                return 0
+            touched = sorted({row[1] for row in pending})
+            with self.db_connection.connection(immediate=True, durable=True) as connection:
+                self.db_connection.execute_many(
+                    "UPDATE Accounts SET balance = ? WHERE account_id = ?",
+                    [(self._balances[account_id], account_id) for account_id in touched],
+                    connection)
+                self.db_connection.execute_many(
+                    "INSERT INTO Transactions (account_id, amount, transaction_type, timestamp, idempotency_key, "
+                    "balance_after) VALUES (?,?,?,?,?,?)",
+                    [(account_id, amount, TRANSACTION_TYPES[type_code], self._format_unix_time(timestamp), key,
+                      balance_after)
+                     for _, account_id, amount, type_code, timestamp, key, balance_after in pending],
+                    connection)
+                self.db_connection.execute_query(
+                    "UPDATE LedgerCheckpoint SET last_sequence = ? WHERE id = 1", (pending[-1][0],), connection)
+                self._remember_keys(self._pending_keys)
+            self._pending = []
+            self._pending_keys = {}
+            os.ftruncate(self._wal_fd, 0)
+            os.fsync(self._wal_fd)
+            self._mark_synced(self._written_sequence)
+            logging.info(f"Checkpointed {len(pending)} ledger transactions")
+            return len(pending)
+
+    def sync(self) -> None:
+        """
+        Force every WAL record written so far to stable storage.
+
+        :return: None
+        """
+        self._wait_durable(self._written_sequence)
+
+    def close(self) -> None:
+        """
+        Stop the background sync, checkpoint everything and close the WAL.
+
+        :return: None
+        """
+        self._stop.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        with self._lock:
+            if self._wal_fd is None:
+                return
+            self.sync()
+            self.checkpoint()
+            with self._durable:
+                # An fsync in progress uses the descriptor; wait for it before closing.
+                while self._syncing:
+                    self._durable.wait()
+                os.close(self._wal_fd)
+                self._wal_fd = None
+
+    def _account(self, account_id: int) -> Account:
+        """
+        Build an Account from the in-memory state; the caller holds the lock.
+
+        :param account_id: The ID of the account.
+        :return: The account.
+        :raises ValueError: If the account is not found for the given ID.
+        """
+        details = self._accounts.get(account_id)
+        if details is None:
+            raise ValueError("Account not found for given account id.")
+        return Account(account_id, details[0], details[1], self._balances[account_id])
+
+    def _checked_balance(self, account_id: int, amount: float, transaction_type: str,
+                         balance: Optional[float] = None) -> float:
+        """
+        Validate a transaction against the Account rules and return the balance it would leave.
+
+        :param account_id: The ID of the account.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param balance: Balance to start from (defaults to the in-memory balance).
+        :return: The balance after the transaction.
+        :raises ValueError: If the type or amount is invalid, the account does not exist or funds are insufficient.
+        """
+        Account.validate_amount(amount)
+        if account_id not in self._accounts:
+            raise ValueError("Account not found for given account id.")
+        account = Account(account_id, None, None, self._balances[account_id] if balance is None else balance)
+        if transaction_type == "deposit":
+            return account.deposit(amount)
+        if transaction_type == "withdraw":
+            return account.withdraw(amount)
+        raise ValueError("Invalid transaction type")
+
+    def _append(self, rows: List[Tuple[int, float, str, Optional[str], float]]) -> int:
+        """
+        Log rows to the WAL as one group and queue them for the next checkpoint; the caller holds the lock.
+
+        :param rows: (account_id, amount, transaction_type, idempotency_key or None, balance_after) rows.
+        :return: The WAL sequence of the last row, which must be durable before the rows are acknowledged.
+        """
+        if not rows:
+            return self._written_sequence
+        if self._wal_fd is None:
+            raise RuntimeError("The ledger engine is closed.")
+        now = time.time()
+        records = []
+        chunks = []
+        for account_id, amount, transaction_type, key, balance_after in rows:
+            type_code = TRANSACTION_TYPE_CODES[transaction_type]
+            records.append((self._next_sequence, account_id, amount, type_code, now, key, balance_after))
+            if key is None:
+                chunks.append(RECORD.pack(self._next_sequence, account_id, amount, type_code, now))
+            else:
+                encoded = key.encode("utf-8")
+                chunks.append(RECORD.pack(self._next_sequence, account_id, amount, type_code | KEYED_RECORD, now))
+                chunks.append(KEY_LENGTH.pack(len(encoded)) + encoded)
+            self._next_sequence += 1
+        payload = b"".join(chunks)
+        os.write(self._wal_fd, GROUP_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._pending.extend(records)
+        self._written_sequence = records[-1][0]
+        if not self.group_commit and self._written_sequence - self._synced_sequence >= self.sync_every:
+            self.sync()
+        return self._written_sequence
+
+    def _commit(self, sequence: int) -> None:
+        """
+        Finish an operation whose rows were logged: wait until they are durable (with group commit), then
+        checkpoint when enough transactions are pending. The caller does not hold the lock.
+
+        :param sequence: WAL sequence of the operation's last row.
+        :return: None
+        """
+        if self.group_commit:
+            self._wait_durable(sequence)
+        if len(self._pending) >= self.checkpoint_every:
+            self.checkpoint()
+
+    def _wait_durable(self, sequence: int) -> None:
+        """
+        Return once the WAL is fsynced up to a sequence, fsyncing it unless another thread already is.
+
+        The thread that fsyncs covers every record written before it started, so concurrent callers are
+        acknowledged together; records written during the fsync are covered by the next one.
+
+        :param sequence: WAL sequence that must be durable.
+        :return: None
+        """
+        with self._durable:
+            while self._synced_sequence < sequence:
+                if not self._syncing:
+                    self._syncing = True
+                    wal_fd, target = self._wal_fd, self._written_sequence
+                    break
+                self._durable.wait()
+            else:
+                return
+        synced = False
+        try:
+            # A closed WAL was checkpointed first, which made every record durable.
+            if wal_fd is not None:
+                os.fsync(wal_fd)
+            synced = True
+        finally:
+            with self._durable:
+                self._syncing = False
+                if synced:
+                    self._synced_sequence = max(self._synced_sequence, target)
+                self._durable.notify_all()
+
+    def _mark_synced(self, sequence: int) -> None:
+        """
+        Record that the WAL is durable up to a sequence and wake the waiting callers.
+
+        :param sequence: WAL sequence now durable.
+        :return: None
+        """
+        with self._durable:
+            self._synced_sequence = max(self._synced_sequence, sequence)
+            self._durable.notify_all()
+
+    def _sync_periodically(self) -> None:
+        """
+        Background loop bounding how long a WAL record stays unsynced.
+
+        :return: None
+        """
+        while not self._stop.wait(self.sync_interval):
+            if self._synced_sequence < self._written_sequence:
+                self.sync()
+
+    def _recover(self) -> None:
+        """
+        Load accounts from SQLite and replay the WAL records newer than the last checkpoint, rebuilding the
+        pending idempotency keys.
+
+        A torn or corrupt group at the end of the WAL is discarded and truncated away.
+
+        :return: None
+        """
+        self._load_accounts("", ())
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(
+                "SELECT last_sequence FROM LedgerCheckpoint WHERE id = 1", (), connection)
+        last_sequence = data_list[0][0] if data_list else 0
+        self._next_sequence = last_sequence + 1
+        if not os.path.exists(self.wal_path):
+            return
+
+        with open(self.wal_path, "rb") as wal:
+            data = wal.read()
+        offset = 0
+        replayed = 0
+        while offset + GROUP_HEADER.size <= len(data):
+            length, crc = GROUP_HEADER.unpack_from(data, offset)
+            payload = data[offset + GROUP_HEADER.size:offset + GROUP_HEADER.size + length]
+            records = self._parse_group(payload) if len(payload) == length and zlib.crc32(payload) == crc else None
+            if records is None:
+                break
+            for record in records:
+                sequence, account_id, amount, type_code, timestamp, key = record
+                self._next_sequence = max(self._next_sequence, sequence + 1)
+                if sequence <= last_sequence:
+                    continue
+                if account_id not in self._balances:
+                    logging.warning(f"Skipping WAL record {sequence} for unknown account {account_id}")
+                    continue
+                transaction_type = TRANSACTION_TYPES[type_code]
+                self._balances[account_id] += amount if transaction_type == "deposit" else -amount
+                balance = self._balances[account_id]
+                self._pending.append((sequence, account_id, amount, type_code, timestamp, key, balance))
+                if key is not None:
+                    self._pending_keys[key] = (account_id, amount, transaction_type, balance)
+                replayed += 1
+            offset += GROUP_HEADER.size + length
+        if offset != len(data):
+            logging.warning(f"Discarding {len(data) - offset} bytes of torn WAL data")
+            with open(self.wal_path, "r+b") as wal:
+                wal.truncate(offset)
+                os.fsync(wal.fileno())
+        if replayed:
+            logging.info(f"Replayed {replayed} ledger transactions from the WAL")
+
+    @staticmethod
+    def _parse_group(payload: bytes) -> Optional[List[tuple]]:
+        """
+        Split the payload of a WAL group into its records.
+
+        :param payload: The group payload.
+        :return: (sequence, account_id, amount, type code, timestamp, idempotency_key or None) records, or None
+                 if the payload is malformed.
+        """
+        records = []
+        offset = 0
+        while offset < len(payload):
+            if offset + RECORD.size > len(payload):
+                return None
+            sequence, account_id, amount, type_code, timestamp = RECORD.unpack_from(payload, offset)
+            offset += RECORD.size
+            key = None
+            if type_code & KEYED_RECORD:
+                if offset + KEY_LENGTH.size > len(payload):
+                    return None
+                (key_length,) = KEY_LENGTH.unpack_from(payload, offset)
+                offset += KEY_LENGTH.size
+                if offset + key_length > len(payload):
+                    return None
+                key = payload[offset:offset + key_length].decode("utf-8")
+                offset += key_length
+                type_code &= ~KEYED_RECORD
+            if type_code not in TRANSACTION_TYPES:
+                return None
+            records.append((sequence, account_id, amount, type_code, timestamp, key))
+        return records
+
+    def _load_accounts(self, where: str, query_data: tuple) -> None:
+        """
+        Load accounts from SQLite into memory; the caller holds the lock or is still initializing.
+
+        :param where: Optional WHERE clause selecting the accounts.
+        :param query_data: Parameters of the WHERE clause.
+        :return: None
+        """
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(
+                f"SELECT {ACCOUNT_COLUMNS} FROM Accounts {where}", query_data, connection)
+        for account_id, customer_id, account_number, balance in data_list or ():
+            self._accounts[account_id] = (customer_id, int(account_number))
+            self._balances[account_id] = balance or 0
+            self._by_customer.setdefault(customer_id, account_id)
+
+    @staticmethod
+    def _format_unix_time(timestamp: float) -> str:
+        """
+        Format a unix timestamp the way SQLite's CURRENT_TIMESTAMP does (UTC).
+
+        :param timestamp: Seconds since the epoch.
+        :return: The formatted timestamp.
+        """
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
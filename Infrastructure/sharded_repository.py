@@ -0,0 +1,413 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from db.sharding import ShardedDatabase
+from Domain import Account, AccountBatch, Customer, TransactionResult
+from Infrastructure.account_repository import AccountRepository
+
+
+class ShardedAccountRepository:
+    format_timestamp = staticmethod(AccountRepository.format_timestamp)
+
+    def __init__(self, sharded_database: ShardedDatabase, parallel: bool = True) -> None:
+        """
+        Initialize a ShardedAccountRepository object.
+
+        The ShardedAccountRepository offers the AccountRepository interface over a ShardedDatabase, with
+        one AccountRepository per shard. Lookups, saves and transactions are routed to the shard owning the
+        account or customer; batches are split per shard and reporting queries fan out over every shard.
+        Each shard has its own writer lock, so writes to different shards proceed concurrently.
+
+        :param sharded_database: The sharded database to use.
+        :param parallel: Apply the per-shard parts of batches and fan-out queries on one thread per shard.
+        :return: None
+        """
+        self.sharded_database = sharded_database
+        self.shards: List[AccountRepository] = [AccountRepository(db_connection)
+                                                for db_connection in sharded_database.shards]
+        self._executor = None
+        if parallel and len(self.shards) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="db-shard")
+
+    def save_account(self, account: Account, customer: Optional[Customer] = None) -> Account:
+        """
+        Save an account and its associated customer to the shard owning them.
+
+        New accounts go to the shard of their customer; existing ones to the shard their ID belongs to.
+
+        :param account: The account to be saved or updated.
+        :param customer: The associated customer, if any.
+        :return: The saved or updated account.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        if account.account_id is None:
+            shard = self.sharded_database.shard_for_customer_id(account.customer_id)
+        else:
+            shard = self.sharded_database.shard_for_account_id(account.account_id)
+        return self.shards[shard].save_account(account, customer)
+
+    def allocate_account_numbers(self, count: int) -> range:
+        """
+        Reserve a block of account numbers from the first shard's sequence.
+
+        The caller does not know yet which shard its accounts will land on, so every such block comes from
+        shard 0's range of the number space. Bulk onboarding numbers accounts from the sequence of the shard
+        they are written to. Every shard sequence starts in its own range, so numbers stay unique across shards.
+
+        :param count: Number of account numbers to reserve.
+        :return: The reserved account numbers.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        return self.shards[0].allocate_account_numbers(count)
+
+    def save_new_customers(self, customers: Sequence[Customer]) -> List[Tuple[int, str]]:
+        """
+        Insert customers, each with a new zero-balance account, in one DB transaction per shard.
+
+        :param customers: The customers to onboard.
+        :return: (position in `customers`, reason) for every rejected customer.
+        :raises RuntimeError: If an error occurs during the database operation; other shards may have committed.
+        """
+        positions = self._partition(customers, lambda customer: self.sharded_database.shard_for_customer_id(
+            customer.customer_id))
+        rejected = []
+        results = self._map(lambda shard: self.shards[shard].save_new_customers(
+            [customers[position] for position in positions[shard]]), positions)
+        for shard, shard_rejected in zip(positions, results):
+            rejected.extend((positions[shard][position], reason) for position, reason in shard_rejected)
+        rejected.sort()
+        return rejected
+
+    def record_transaction(self, account_id: int, amount: float, transaction_type: str) -> None:
+        """
+        Insert a ledger row on the shard owning the account without changing its balance.
+
+        :param account_id: The ID of the account associated with the transaction.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :return: None
+        :raises ValueError: If the ID does not belong to any shard.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        self._shard(account_id).record_transaction(account_id, amount, transaction_type)
+
+    def apply_transaction(self, account_id: int, amount: float, transaction_type: str,
+                          idempotency_key: Optional[str] = None) -> Account:
+        """
+        Apply a deposit or withdrawal on the shard owning the account.
+
+        Idempotency keys are unique per shard; a retry always reaches the shard of its account.
+
+        :param account_id: The ID of the account on which the transaction is performed.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param idempotency_key: Optional client key identifying the transaction across retries.
+        :return: The account as stored after the transaction.
+        :raises ValueError: If the type or amount is invalid, the account does not exist, funds are insufficient
+                            or the idempotency key was recorded for a different transaction.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        return self._shard(account_id).apply_transaction(account_id, amount, transaction_type, idempotency_key)
+
+    def apply_transactions(self, transactions: Sequence[tuple]) -> List[TransactionResult]:
+        """
+        Apply a batch of deposits and withdrawals, in one DB transaction per shard.
+
+        Rows keep their relative order within each shard, and every account lives on a single shard, so each
+        row gets the same result it would get in an unsharded batch.
+
+        :param transactions: Sequence of (account_id, amount, transaction_type[, idempotency_key]) rows.
+        :return: One TransactionResult per input row, in input order.
+        :raises RuntimeError: If a shard could not be written; other shards may have committed.
+        """
+        results: List[Optional[TransactionResult]] = [None] * len(transactions)
+        routable = []
+        for position, (account_id, amount, transaction_type) in enumerate(row[:3] for row in transactions):
+            try:
+                self.sharded_database.shard_for_account_id(account_id)
+            except ValueError as e:
+                results[position] = TransactionResult(account_id, amount, transaction_type, False, error=str(e))
+                continue
+            routable.append(position)
+        positions = self._partition(
+            routable, lambda position: self.sharded_database.shard_for_account_id(transactions[position][0]))
+        shard_results = self._map(lambda shard: self.shards[shard].apply_transactions(
+            [transactions[routable[position]] for position in positions[shard]]), positions)
+        for shard, rows in zip(positions, shard_results):
+            for position, result in zip(positions[shard], rows):
+                results[routable[position]] = result
+        return results
+
+    def apply_transfer(self, source_account_id: int, credits: Sequence[Tuple[int, float]]) -> Account:
+        """
+        Debit one account and credit one or many others in a single DB transaction.
+
+        All accounts of a transfer must live on the same shard, since SQLite cannot commit atomically across
+        separate WAL-mode database files.
+
+        :param source_account_id: The ID of the account to debit.
+        :param credits: (account_id, amount) for every credit; an account may appear more than once.
+        :return: The source account as stored after the transfer.
+        :raises ValueError: If the accounts live on different shards, or for any reason AccountRepository.apply_transfer
+                            rejects the transfer.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        shard = self.sharded_database.shard_for_account_id(source_account_id)
+        for account_id, _ in credits:
+            if self.sharded_database.shard_for_account_id(account_id) != shard:
+                raise ValueError("Cross-shard transfers are not supported.")
+        return self.shards[shard].apply_transfer(source_account_id, credits)
+
+    def find_account_by_id(self, account_id: int) -> Account:
+        """
+        Find an account by its ID on the shard owning it.
+
+        :param account_id: The ID of the account to search for.
+        :return: The found account.
+        :raises ValueError: If the account is not found for the given ID.
+        """
+        return self._shard(account_id).find_account_by_id(account_id)
+
+    def find_accounts_by_customer_id(self, customer_id: int) -> Union[None, Account]:
+        """
+        Find the account of a customer on the shard holding the customer.
+
+        :param customer_id: The ID of the customer.
+        :return: The found account or None if not found.
+        """
+        return self.shards[self.sharded_database.shard_for_customer_id(customer_id)].find_accounts_by_customer_id(
+            customer_id)
+
+    def find_customers_by_email(self, email: str) -> List[Customer]:
+        """
+        Find the customers registered with an email address on every shard.
+
+        :param email: The email address.
+        :return: The matching customers in customer_id order.
+        """
+        return self._find_customers(lambda shard: shard.find_customers_by_email(email))
+
+    def find_customers_by_phone(self, phone_number: str) -> List[Customer]:
+        """
+        Find the customers registered with a phone number on every shard.
+
+        :param phone_number: The phone number in any format.
+        :return: The matching customers in customer_id order.
+        """
+        return self._find_customers(lambda shard: shard.find_customers_by_phone(phone_number))
+
+    def search_customers_by_name(self, prefix: str, limit: int = 50,
+                                 after: Optional[Customer] = None) -> List[Customer]:
+        """
+        Find customers whose name starts with a prefix on every shard.
+
+        Each shard returns its own first `limit` matches, which are merged in normalized name, customer_id order.
+
+        :param prefix: The name prefix.
+        :param limit: Maximum number of customers returned.
+        :param after: The last customer of the previous page, or None for the first page.
+        :return: The matching customers.
+        :raises ValueError: If the limit is not positive.
+        """
+        customers = chain.from_iterable(self._map(
+            lambda shard: self.shards[shard].search_customers_by_name(prefix, limit, after), range(len(self.shards))))
+        return sorted(customers, key=lambda customer: (Customer.name_key(customer.name), customer.customer_id))[:limit]
+
+    def find_existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        """
+        Check which email addresses are already registered on any shard.
+
+        :param emails: The email addresses.
+        :return: The given addresses that belong to a customer.
+        """
+        emails = list(emails)
+        return set().union(*self._map(lambda shard: self.shards[shard].find_existing_emails(emails),
+                                      range(len(self.shards))))
+
+    def iter_account_batches(self, batch_size: int = 10000) -> Iterator[AccountBatch]:
+        """
+        Stream every account in account_id order as compact read-only batches.
+
+        Shards hold ascending account_id ranges and are read one after the other, so a batch never spans two
+        shards and the last batch of each shard may be shorter than `batch_size`.
+
+        :param batch_size: Number of accounts per batch.
+        :return: Iterator of AccountBatch objects.
+        """
+        return chain.from_iterable(shard.iter_account_batches(batch_size) for shard in self.shards)
+
+    def iter_transactions(self, account_id: int, *args, **kwargs) -> Iterator[tuple]:
+        """
+        Stream the ledger rows of an account from the shard owning it.
+
+        Takes the same arguments as AccountRepository.iter_transactions.
+
+        :param account_id: The ID of the account.
+        :return: Iterator of (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+        :raises ValueError: If the ID does not belong to any shard.
+        """
+        return self._shard(account_id).iter_transactions(account_id, *args, **kwargs)
+
+    def get_balance_at(self, account_id: int, moment: Union[str, datetime], archive=None) -> float:
+        """
+        Compute an account's balance as of a point in time on the shard owning it.
+
+        :param account_id: The ID of the account.
+        :param moment: Only transactions strictly before this time are counted.
+        :param archive: Optional TransactionArchive of the owning shard.
+        :return: The balance as of `moment`.
+        :raises ValueError: If the ID does not belong to any shard, or archived rows are needed and no archive
+                            is given.
+        """
+        return self._shard(account_id).get_balance_at(account_id, moment, archive)
+
+    def compact_balance_checkpoints(self, up_to_day: Union[str, date]) -> int:
+        """
+        Write daily closing balance checkpoints on every shard.
+
+        :param up_to_day: Last day to checkpoint.
+        :return: The number of checkpoints written.
+        """
+        return sum(self._map(lambda shard: self.shards[shard].compact_balance_checkpoints(up_to_day),
+                             range(len(self.shards))))
+
+    def get_daily_activity(self, start_day: Union[str, date], end_day: Union[str, date],
+                           account_id: Optional[int] = None) -> List[tuple]:
+        """
+        Read the daily activity totals of one account from its shard, or of the whole bank from every shard.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param account_id: The ID of the account, or None for bank-wide totals.
+        :return: (day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum) rows in day order.
+        :raises ValueError: If the ID does not belong to any shard.
+        """
+        if account_id is not None:
+            return self._shard(account_id).get_daily_activity(start_day, end_day, account_id)
+        totals: Dict[str, list] = {}
+        for rows in self._map(lambda shard: self.shards[shard].get_daily_activity(start_day, end_day),
+                              range(len(self.shards))):
+            for day, *values in rows:
+                if day in totals:
+                    totals[day] = [total + value for total, value in zip(totals[day], values)]
+                else:
+                    totals[day] = values
+        return [(day, *totals[day]) for day in sorted(totals)]
+
+    def get_top_accounts(self, start_day: Union[str, date], end_day: Union[str, date], metric: str = "net_flow",
+                         limit: int = 10) -> List[tuple]:
+        """
+        Rank accounts of every shard by their activity totals over a range of days.
+
+        Each shard returns its own top `limit` accounts, which are merged.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param metric: Name of the ranking expression in ACTIVITY_METRICS.
+        :param limit: Number of accounts returned.
+        :return: (account_id, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum, metric value) rows,
+                 highest value first.
+        :raises ValueError: If the metric is unknown.
+        """
+        rows = chain.from_iterable(self._map(
+            lambda shard: self.shards[shard].get_top_accounts(start_day, end_day, metric, limit),
+            range(len(self.shards))))
+        return sorted(rows, key=lambda row: (-row[-1], row[0]))[:limit]
+
+    @contextmanager
+    def snapshot(self) -> Iterator[None]:
+        """
+        Open a read-only, point-in-time view of every shard for reads on the current thread.
+
+        Each shard has its own snapshot, taken one after the other. Single-account reads run on the calling
+        thread and use them; lookups fanned out to the shard threads read outside the snapshots.
+
+        :return: None
+        """
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.snapshot())
+            yield
+
+    def backup(self, target_pattern: str) -> List[str]:
+        """
+        Copy every shard into a detached file, e.g. for reporting.
+
+        :param target_pattern: Path of the copies, with a `{shard}` placeholder for the shard index.
+        :return: The paths of the copies, in shard order.
+        :raises ValueError: If the pattern has no `{shard}` placeholder.
+        :raises RuntimeError: If a backup fails.
+        """
+        if "{shard}" not in target_pattern:
+            raise ValueError("target_pattern must contain a {shard} placeholder.")
+        paths = [target_pattern.format(shard=index) for index in range(len(self.shards))]
+        for shard, path in zip(self.shards, paths):
+            shard.backup(path)
+        return paths
+
+    def checkpoint(self) -> int:
+        """
+        Make every acknowledged write visible in the databases of all shards.
+
+        :return: The number of transactions written.
+        """
+        return sum(shard.checkpoint() for shard in self.shards)
+
+    def close(self) -> None:
+        """
+        Stop the shard threads and close the pooled connections of every shard.
+
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.sharded_database.close()
+
+    def _shard(self, account_id: int) -> AccountRepository:
+        """
+        Get the repository of the shard owning an account.
+
+        :param account_id: The ID of the account.
+        :return: The shard's repository.
+        :raises ValueError: If the ID does not belong to any shard.
+        """
+        return self.shards[self.sharded_database.shard_for_account_id(account_id)]
+
+    def _find_customers(self, find) -> List[Customer]:
+        """
+        Run a customer lookup on every shard and merge the results.
+
+        :param find: Function running the lookup on a shard repository.
+        :return: The customers of every shard in customer_id order.
+        """
+        customers = chain.from_iterable(self._map(lambda shard: find(self.shards[shard]), range(len(self.shards))))
+        return sorted(customers, key=lambda customer: customer.customer_id)
+
+    @staticmethod
+    def _partition(items: Sequence, shard_of) -> Dict[int, List[int]]:
+        """
+        Group the positions of items by shard, keeping their order.
+
+        :param items: The items to route.
+        :param shard_of: Function returning the shard of an item.
+        :return: Positions in `items` per shard, for the shards that received any.
+        """
+        positions: Dict[int, List[int]] = {}
+        for position, item in enumerate(items):
+            positions.setdefault(shard_of(item), []).append(position)
+        return positions
+
+    def _map(self, func, shards) -> list:
+        """
+        Run a function for each shard, on the shard threads when there is more than one.
+
+        :param func: Function receiving a shard number.
+        :param shards: The shard numbers.
+        :return: The results, in the order of `shards`.
+        """
+        shards = list(shards)
+        if self._executor is None or len(shards) <= 1:
+            return [func(shard) for shard in shards]
+        return list(self._executor.map(func, shards))
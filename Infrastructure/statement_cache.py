@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+
+class CachedStatement(NamedTuple):
+    """
+    A rendered JSON statement, up to the last ledger row it contains.
+
+    :param last_transaction_id: transaction_id of the last row rendered, or None if there was none.
+    :param count: Number of entries rendered.
+    :param body: The rendered entries without the closing bracket; empty when there are none.
+    """
+    last_transaction_id: Optional[int]
+    count: int
+    body: str
+
+
+class StatementCache:
+    def __init__(self, max_entries: int = 1000, directory: Optional[str] = None) -> None:
+        """
+        Initialize a StatementCache object.
+
+        The StatementCache is a bounded, thread-safe LRU cache of rendered account statements keyed by
+        account_id. Ledger rows are append-only and get increasing transaction_ids, so a cached statement
+        stays a valid prefix of the account's statement and only rows after its last transaction_id have to
+        be rendered and appended.
+
+        With a directory, entries are also kept on disk, one body and one metadata file per account, so they
+        survive restarts and LRU eviction. Bodies are appended to in place; the metadata file, replaced
+        atomically after the append, records how much of the body is valid.
+
+        :param max_entries: Maximum number of statements held in memory; the least recently used is evicted first.
+        :param directory: Optional directory for the on-disk store, created if missing.
+        :return: None
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive.")
+        self.max_entries = max_entries
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._entries: "OrderedDict[int, CachedStatement]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, account_id: int) -> Optional[CachedStatement]:
+        """
+        Get the cached statement of an account, from memory or else from disk.
+
+        :param account_id: The ID of the account.
+        :return: The cached statement, or None on a miss.
+        """
+        with self._lock:
+            statement = self._entries.get(account_id)
+            if statement is None and self.directory is not None:
+                statement = self._read(account_id)
+                if statement is not None:
+                    self._remember(account_id, statement)
+            if statement is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(account_id)
+            self.hits += 1
+            return statement
+
+    def put(self, account_id: int, statement: CachedStatement) -> None:
+        """
+        Cache the statement of an account, unless a statement covering more rows is already cached.
+
+        :param account_id: The ID of the account.
+        :param statement: The statement, extending the one cached before.
+        :return: None
+        """
+        with self._lock:
+            cached = self._entries.get(account_id)
+            if cached is not None and cached.count > statement.count:
+                return
+            self._remember(account_id, statement)
+            if self.directory is not None:
+                self._write(account_id, statement)
+
+    def invalidate(self, account_id: int) -> None:
+        """
+        Drop the cached statement of an account, e.g. after its ledger was rewritten.
+
+        :param account_id: The ID of the account.
+        :return: None
+        """
+        with self._lock:
+            self._entries.pop(account_id, None)
+            if self.directory is not None:
+                for path in self._paths(account_id):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def clear(self) -> None:
+        """
+        Drop every statement held in memory. Statistics and the on-disk store are kept.
+
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics.
+
+        :return: A dict with the hit, miss and eviction counters and the current in-memory size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+    def _remember(self, account_id: int, statement: CachedStatement) -> None:
+        """
+        Store a statement in memory, evicting the least recently used ones; the caller holds the lock.
+
+        :param account_id: The ID of the account.
+        :param statement: The statement.
+        :return: None
+        """
+        self._entries[account_id] = statement
+        self._entries.move_to_end(account_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _paths(self, account_id: int) -> tuple:
+        """
+        Get the on-disk body and metadata paths of an account.
+
+        :param account_id: The ID of the account.
+        :return: (body path, metadata path).
+        """
+        base = os.path.join(self.directory, f"statement_{account_id}")
+        return base + ".json", base + ".meta"
+
+    def _read_meta(self, account_id: int) -> Optional[tuple]:
+        """
+        Read the on-disk metadata of a statement; the caller holds the lock.
+
+        :param account_id: The ID of the account.
+        :return: (last_transaction_id, count, body length), or None if there is no statement on disk.
+        """
+        try:
+            with open(self._paths(account_id)[1]) as meta:
+                last_transaction_id, count, length = meta.read().split()
+        except (OSError, ValueError):
+            return None
+        return None if last_transaction_id == "-" else int(last_transaction_id), int(count), int(length)
+
+    def _read(self, account_id: int) -> Optional[CachedStatement]:
+        """
+        Read a statement from disk; the caller holds the lock.
+
+        :param account_id: The ID of the account.
+        :return: The statement, or None if there is none or its body is incomplete.
+        """
+        meta = self._read_meta(account_id)
+        if meta is None:
+            return None
+        try:
+            with open(self._paths(account_id)[0], "rb") as body:
+                data = body.read(meta[2])
+        except OSError:
+            return None
+        if len(data) != meta[2]:
+            return None
+        return CachedStatement(meta[0], meta[1], data.decode("ascii"))
+
+    def _write(self, account_id: int, statement: CachedStatement) -> None:
+        """
+        Write a statement to disk, appending to the body already there, which is a prefix of it; the caller
+        holds the lock.
+
+        :param account_id: The ID of the account.
+        :param statement: The statement.
+        :return: None
+        """
+        body_path, meta_path = self._paths(account_id)
+        meta = self._read_meta(account_id)
+        # Rendered JSON is ASCII, so string and byte lengths match.
+        offset = meta[2] if meta is not None and meta[2] <= len(statement.body) else 0
+        if offset and (not os.path.exists(body_path) or os.path.getsize(body_path) < offset):
+            offset = 0
+        with open(body_path, "r+b" if offset else "wb") as body:
+            body.seek(offset)
+            body.truncate()
+            body.write(statement.body[offset:].encode("ascii"))
+        last_transaction_id = "-" if statement.last_transaction_id is None else statement.last_transaction_id
+        with open(meta_path + ".tmp", "w") as meta_file:
+            meta_file.write(f"{last_transaction_id} {statement.count} {len(statement.body)}")
+        os.replace(meta_path + ".tmp", meta_path)
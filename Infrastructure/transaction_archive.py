@@ -0,0 +1,328 @@
+import heapq
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from datetime import date, datetime
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from db.db_client import DatabaseConnection
+from Infrastructure.account_repository import AccountRepository, SIGNED_AMOUNT_SQL
+
+# Segment layout: MAGIC, zlib-compressed column blocks, a JSON index, then a footer holding the index
+# offset and length followed by MAGIC. Rows are sorted by (account_id, transaction_id) and the index
+# lists the account_id range of every block, so reading one account decompresses only its blocks.
+SEGMENT_MAGIC = b"BKSEG1\n"
+SEGMENT_FOOTER = struct.Struct("<QQ")
+BLOCK_HEADER = struct.Struct("<I")
+BLOCK_ROWS = 4096
+
+TRANSACTION_TYPE_CODES = {"deposit": 0, "withdraw": 1}
+TRANSACTION_TYPES = {code: name for name, code in TRANSACTION_TYPE_CODES.items()}
+
+
+class TransactionArchive:
+    def __init__(self, db_connection=DatabaseConnection(), archive_dir: str = 'db/archive') -> None:
+        """
+        Initialize a TransactionArchive object.
+
+        The TransactionArchive moves old ledger rows out of the Transactions table into compressed,
+        immutable segment files, one or more per month, and reads them back for statements. A segment is
+        only part of the archive once it is registered in the ArchiveSegments table, in the same DB
+        transaction that deletes its rows from Transactions, so a crash never loses or duplicates rows.
+
+        :param db_connection: The database connection to use.
+        :param archive_dir: Directory holding the segment files.
+        :return: None
+        """
+        self.db_connection = db_connection
+        self.archive_dir = archive_dir
+        self._indexes: Dict[str, dict] = {}
+
+    def archive_before(self, cutoff: Union[str, date, datetime]) -> Tuple[int, int]:
+        """
+        Archive every ledger row older than the cutoff, one segment per month.
+
+        The newest ledger row is never archived, so SQLite keeps handing out increasing transaction IDs.
+        Each archived row's signed amount is added to ArchivedTotals, keeping balances reconcilable.
+
+        :param cutoff: Rows with a timestamp strictly before this time are archived.
+        :return: The number of segments written and the number of rows archived.
+        :raises RuntimeError: If an error occurs during the database operation or the rows changed meanwhile.
+        """
+        cutoff = AccountRepository.format_timestamp(cutoff)
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query("SELECT MAX(transaction_id) FROM Transactions", (),
+                                                            connection)
+            high_water = data_list[0][0]
+            if high_water is None:
+                return 0, 0
+            data_list, _ = self.db_connection.execute_query(
+                "SELECT DISTINCT substr(timestamp, 1, 7) FROM Transactions WHERE timestamp < ? AND transaction_id < ?",
+                (cutoff, high_water), connection)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        segments = rows = 0
+        for period, in sorted(data_list or ()):
+            year, month = int(period[:4]), int(period[5:7])
+            next_period = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01 00:00:00"
+            bounds = (f"{period}-01 00:00:00", min(next_period, cutoff), high_water)
+            written = self._archive_period(period, bounds)
+            segments += 1 if written else 0
+            rows += written
+        return segments, rows
+
+    def iter_transactions(self, account_id: int, start: Union[None, str, datetime] = None,
+                          end: Union[None, str, datetime] = None, after_transaction_id: Optional[int] = None,
+                          limit: Optional[int] = None) -> Iterator[tuple]:
+        """
+        Stream the archived ledger rows of an account in transaction_id order.
+
+        Only segments whose time range overlaps the requested one are opened.
+
+        :param account_id: The ID of the account.
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :param after_transaction_id: Only include transactions with a greater transaction_id (keyset pagination).
+        :param limit: Maximum number of rows to return.
+        :return: Iterator of (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        start = start if start is None else AccountRepository.format_timestamp(start)
+        end = end if end is None else AccountRepository.format_timestamp(end)
+        streams = [self._iter_segment(name, account_id) for name in self.segment_names(start, end)]
+        count = 0
+        for row in heapq.merge(*streams):
+            if after_transaction_id is not None and row[0] <= after_transaction_id:
+                continue
+            if (start is not None and row[4] < start) or (end is not None and row[4] >= end):
+                continue
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield row
+
+    def iter_account_range(self, low: int, high: int, start: Optional[str] = None,
+                           end: Optional[str] = None) -> Iterator[tuple]:
+        """
+        Stream the archived ledger rows of a contiguous account_id range in (account_id, transaction_id) order.
+
+        Every overlapping segment is read once, block by block, which suits bulk exports better than one
+        `iter_transactions` call per account.
+
+        :param low: Lowest account_id, inclusive.
+        :param high: Highest account_id, inclusive.
+        :param start: Only include transactions at or after this time (formatted timestamp).
+        :param end: Only include transactions strictly before this time (formatted timestamp).
+        :return: Iterator of (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        streams = [self._iter_segment_range(name, low, high) for name in self.segment_names(start, end)]
+        for row in heapq.merge(*streams, key=itemgetter(1, 0)):
+            if (start is None or row[4] >= start) and (end is None or row[4] < end):
+                yield row
+
+    def segment_names(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """
+        List the registered segments overlapping a time range.
+
+        :param start: Start of the range (formatted timestamp), or None.
+        :param end: End of the range, exclusive (formatted timestamp), or None.
+        :return: Segment file names, oldest period first.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        query = "SELECT name FROM ArchiveSegments WHERE 1 = 1"
+        query_data = []
+        if start is not None:
+            query += " AND max_timestamp >= ?"
+            query_data.append(start)
+        if end is not None:
+            query += " AND min_timestamp < ?"
+            query_data.append(end)
+        with self.db_connection.read_connection() as connection:
+            data_list, _ = self.db_connection.execute_query(query + " ORDER BY period, name", tuple(query_data),
+                                                            connection)
+        return [row[0] for row in data_list or ()]
+
+    def _archive_period(self, period: str, bounds: Tuple[str, str, int]) -> int:
+        """
+        Write the ledger rows of one month to a new segment, then register it and delete the rows.
+
+        :param period: The month, as YYYY-MM.
+        :param bounds: (lowest timestamp, timestamp bound, transaction_id bound) selecting the rows.
+        :return: The number of rows archived.
+        """
+        predicate = "timestamp >= ? AND timestamp < ? AND transaction_id < ?"
+        name = f"transactions_{period}_{bounds[2]}.seg"
+        path = os.path.join(self.archive_dir, name)
+        with self.db_connection.read_connection() as connection:
+            batches = self.db_connection.iter_query(
+                "SELECT transaction_id, account_id, amount, transaction_type, timestamp FROM Transactions "
+                f"WHERE {predicate} ORDER BY account_id, transaction_id", bounds, connection, 10000)
+            index = write_segment(path, period, chain.from_iterable(batches))
+        if not index['rows']:
+            os.remove(path)
+            return 0
+
+        with self.db_connection.connection(immediate=True) as connection:
+            self.db_connection.execute_query(
+                f"INSERT INTO ArchivedTotals (account_id, amount) SELECT account_id, SUM({SIGNED_AMOUNT_SQL}) "
+                f"FROM Transactions WHERE {predicate} GROUP BY account_id "
+                "ON CONFLICT (account_id) DO UPDATE SET amount = amount + excluded.amount", bounds, connection)
+            # Idempotency keys outlive their rows, so retries of archived transactions are still recognized.
+            self.db_connection.execute_query(
+                "INSERT INTO ArchivedIdempotencyKeys (idempotency_key, account_id, amount, transaction_type, "
+                "balance_after) SELECT idempotency_key, account_id, amount, transaction_type, balance_after "
+                f"FROM Transactions WHERE {predicate} AND idempotency_key IS NOT NULL", bounds, connection)
+            changes_before = connection.total_changes
+            self.db_connection.execute_query(f"DELETE FROM Transactions WHERE {predicate}", bounds, connection)
+            if connection.total_changes - changes_before != index['rows']:
+                raise RuntimeError(f"Ledger rows of {period} changed while they were archived.")
+            self.db_connection.execute_query(
+                "INSERT INTO ArchiveSegments (name, period, row_count, min_timestamp, max_timestamp) "
+                "VALUES (?,?,?,?,?)",
+                (name, period, index['rows'], index['min_timestamp'], index['max_timestamp']), connection)
+        return index['rows']
+
+    def _iter_segment_range(self, name: str, low: int, high: int) -> Iterator[tuple]:
+        """
+        Read the rows of an account_id range from a segment.
+
+        :param name: Segment file name.
+        :param low: Lowest account_id, inclusive.
+        :param high: Highest account_id, inclusive.
+        :return: Iterator of ledger rows in (account_id, transaction_id) order.
+        """
+        path = os.path.join(self.archive_dir, name)
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = read_segment_index(path)
+        blocks = index['blocks']
+        position = bisect_left([block[1] for block in blocks], low)
+        with open(path, "rb") as segment:
+            while position < len(blocks) and blocks[position][0] <= high:
+                _, _, offset, length = blocks[position]
+                segment.seek(offset)
+                for row in decode_block(segment.read(length)):
+                    if low <= row[1] <= high:
+                        yield row
+                position += 1
+
+    def _iter_segment(self, name: str, account_id: int) -> Iterator[tuple]:
+        """
+        Read the rows of one account from a segment.
+
+        :param name: Segment file name.
+        :param account_id: The ID of the account.
+        :return: Iterator of ledger rows in transaction_id order.
+        """
+        return self._iter_segment_range(name, account_id, account_id)
+
+
+def write_segment(path: str, period: str, rows: Iterable[tuple]) -> dict:
+    """
+    Write ledger rows sorted by (account_id, transaction_id) to an immutable segment file.
+
+    The file is written under a temporary name, synced and renamed, so a segment is either complete or absent.
+
+    :param path: Path of the segment file.
+    :param period: The period the rows belong to.
+    :param rows: (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+    :return: The segment index.
+    """
+    index = {'period': period, 'rows': 0, 'min_timestamp': None, 'max_timestamp': None, 'blocks': []}
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as segment:
+        segment.write(SEGMENT_MAGIC)
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == BLOCK_ROWS:
+                _write_block(segment, block, index)
+                block = []
+        if block:
+            _write_block(segment, block, index)
+        encoded = json.dumps(index).encode()
+        offset = segment.tell()
+        segment.write(encoded + SEGMENT_FOOTER.pack(offset, len(encoded)) + SEGMENT_MAGIC)
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(temporary, path)
+    os.chmod(path, 0o444)
+    directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return index
+
+
+def read_segment_index(path: str) -> dict:
+    """
+    Read the index of a segment file.
+
+    :param path: Path of the segment file.
+    :return: The segment index.
+    :raises ValueError: If the file is not a complete segment.
+    """
+    with open(path, "rb") as segment:
+        trailer_size = SEGMENT_FOOTER.size + len(SEGMENT_MAGIC)
+        segment.seek(-trailer_size, os.SEEK_END)
+        trailer = segment.read(trailer_size)
+        if trailer[SEGMENT_FOOTER.size:] != SEGMENT_MAGIC:
+            raise ValueError(f"Not a complete archive segment: {path}")
+        offset, length = SEGMENT_FOOTER.unpack(trailer[:SEGMENT_FOOTER.size])
+        segment.seek(offset)
+        return json.loads(segment.read(length))
+
+
+def decode_block(data: bytes) -> List[tuple]:
+    """
+    Decode a compressed column block into ledger rows.
+
+    :param data: The compressed block.
+    :return: (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+    """
+    data = zlib.decompress(data)
+    count, = BLOCK_HEADER.unpack_from(data)
+    offset = BLOCK_HEADER.size
+    columns = []
+    for typecode in ("q", "q", "d"):
+        column = array(typecode)
+        column.frombytes(data[offset:offset + 8 * count])
+        if sys.byteorder == "big":
+            column.byteswap()
+        columns.append(column)
+        offset += 8 * count
+    types = [TRANSACTION_TYPES[code] for code in data[offset:offset + count]]
+    timestamps = data[offset + count:].decode().split("\n")
+    return list(zip(columns[0], columns[1], columns[2], types, timestamps))
+
+
+def _write_block(segment, block: List[tuple], index: dict) -> None:
+    """
+    Encode rows as a compressed column block, append it to a segment and record it in the index.
+
+    :param segment: Segment file opened for writing.
+    :param block: Ledger rows.
+    :param index: The segment index being built.
+    :return: None
+    """
+    transaction_ids, account_ids, amounts, types, timestamps = zip(*block)
+    columns = [array("q", transaction_ids), array("q", account_ids), array("d", amounts)]
+    if sys.byteorder == "big":
+        for column in columns:
+            column.byteswap()
+    data = zlib.compress(b"".join([BLOCK_HEADER.pack(len(block))] + [column.tobytes() for column in columns] +
+                                  [bytes(TRANSACTION_TYPE_CODES[kind] for kind in types),
+                                   "\n".join(timestamps).encode()]))
+    index['blocks'].append((account_ids[0], account_ids[-1], segment.tell(), len(data)))
+    index['rows'] += len(block)
+    index['min_timestamp'] = min(filter(None, (index['min_timestamp'], min(timestamps))))
+    index['max_timestamp'] = max(filter(None, (index['max_timestamp'], max(timestamps))))
+    segment.write(data)
+
@@ -1,4 +1,13 @@
-from Service.create_account_user import AccountOpening
+from Service.create_account_user import AccountOpening, OnboardingReport
 from Service.account_transaction_use_case import AmountTransaction
 from Service.generate_account_statement import GenerateStatements
-from Service.utils import TransactionFailedException
\ No newline at end of file
+from Service.utils import TransactionFailedException
+from Service.export_statements import BulkStatementExport
+from Service.async_use_cases import DatabaseExecutor, AsyncAccountOpening, AsyncAmountTransaction, \
+    AsyncGenerateStatements
+from Service.group_commit import GroupCommitWriter
+from Service.balance_checkpoints import BalanceCheckpointJob
+from Service.transfer_use_case import FundsTransfer
+from Service.activity_reports import ActivityReports
+from Service.reconciliation import LedgerReconciliation, ReconciliationReport
+from Service.archival import TransactionArchival
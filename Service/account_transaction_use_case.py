@@ -1,6 +1,8 @@
 import logging
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
 from Infrastructure import AccountRepository
-from Domain import Account
+from Domain import Account, TransactionResult
 from Service.utils import TransactionFailedException
 
 
@@ -17,26 +19,26 @@ class AmountTransaction:
         """
         self.account_repository = account_repository
 
-    def make_transaction(self, account_id: int, amount: float, transaction_type: str) -> Account:
+    def make_transaction(self, account_id: int, amount: float, transaction_type: str,
+                         idempotency_key: Optional[str] = None) -> Account:
         """
         Perform a transaction on the specified account and update it in the database.
 
+        The balance change and the ledger row are written atomically with a single commit. A retry with the
+        same idempotency key is not applied twice and returns the balance recorded by the first attempt.
+
         :param account_id: The ID of the account on which the transaction is performed.
         :param amount: The amount of the transaction.
         :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param idempotency_key: Optional client key identifying the transaction across retries.
         :return: The updated account instance.
-        :raises ValueError: If an invalid transaction type is provided.
+        :raises TransactionFailedException: If the transaction type or amount is invalid, the account
+                                            does not exist, funds are insufficient or the idempotency key
+                                            was used for a different transaction.
         """
         try:
-            account = self.account_repository.find_account_by_id(account_id)
-            if transaction_type == "deposit":
-                account.deposit(amount)
-            elif transaction_type == "withdraw":
-                account.withdraw(amount)
-            else:
-                raise ValueError("Invalid transaction type")
-            account_ins = self.account_repository.save_account(account)
-            self.create_transaction(account_id, amount, transaction_type)
+            account_ins = self.account_repository.apply_transaction(account_id, amount, transaction_type,
+                                                                    idempotency_key)
             logging.info("Transaction completed successfully")
             return account_ins
         except (RuntimeError, ValueError) as e:
@@ -44,6 +46,37 @@ class AmountTransaction:
             raise TransactionFailedException(str(e))
             
 
+    def make_transactions(self, transactions: Iterable[Tuple[int, float, str]],
+                          chunk_size: int = 10000) -> List[TransactionResult]:
+        """
+        Perform a batch of transactions, committing once per chunk of rows.
+
+        Invalid rows (unknown account, bad type or amount, insufficient funds) are reported in the
+        results and do not stop the batch.
+
+        :param transactions: Iterable of (account_id, amount, transaction_type[, idempotency_key]) rows; it is
+                             consumed lazily. Rows whose key was already recorded are not applied again.
+        :param chunk_size: Number of rows written per DB transaction.
+        :return: One TransactionResult per input row, in input order.
+        :raises TransactionFailedException: If a chunk could not be written to the database. Chunks
+                                            committed before the failure stay applied.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive.")
+        results = []
+        iterator = iter(transactions)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            try:
+                results.extend(self.account_repository.apply_transactions(chunk))
+            except RuntimeError as e:
+                logging.debug(f"{str(e)}")
+                raise TransactionFailedException(str(e))
+        logging.info(f"Batch of {len(results)} transactions processed")
+        return results
+
     def create_transaction(self, account_id: int, amount: float, transaction_type: str):
         """
         Create a transaction record in the database.
@@ -53,10 +86,4 @@ class AmountTransaction:
         :param transaction_type: The type of the transaction ("deposit" or "withdraw").
         :return: None
         """
-        connection = self.account_repository.db_connection.create_db_connection()
-        self.account_repository.db_connection.execute_query(
-            "INSERT INTO Transactions (account_id, amount, transaction_type) VALUES (?,?,?)",
-            (account_id, amount, transaction_type),
-            connection)
-        connection.commit()
-        connection.close()
+        self.account_repository.record_transaction(account_id, amount, transaction_type)
@@ -0,0 +1,74 @@
+from datetime import date
+from typing import List, Optional, Union
+
+ACTIVITY_FIELDS = ("deposit_count", "deposit_sum", "withdrawal_count", "withdrawal_sum")
+
+
+class ActivityReports:
+    def __init__(self, account_repository):
+        """
+        Initialize an ActivityReports object.
+
+        The ActivityReports answers dashboard queries from the daily activity totals kept up to date with
+        every ledger insert, so their cost depends on the number of days and active accounts queried rather
+        than on the size of the ledger.
+
+        :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :return: None
+        """
+        self.account_repository = account_repository
+
+    def get_daily_totals(self, start_day: Union[str, date], end_day: Union[str, date],
+                         account_id: Optional[int] = None) -> List[dict]:
+        """
+        Get the deposit and withdrawal totals and net flow per day.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param account_id: The ID of the account, or None for bank-wide totals.
+        :return: One dict per day with activity, in day order.
+        """
+        rows = self.account_repository.get_daily_activity(start_day, end_day, account_id)
+        return [dict(self._activity(row[1:]), day=row[0]) for row in rows]
+
+    def get_period_totals(self, start_day: Union[str, date], end_day: Union[str, date],
+                          account_id: Optional[int] = None) -> dict:
+        """
+        Get the deposit and withdrawal totals and net flow over a range of days.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param account_id: The ID of the account, or None for bank-wide totals.
+        :return: The totals of the range.
+        """
+        rows = self.account_repository.get_daily_activity(start_day, end_day, account_id)
+        return self._activity([sum(row[index] for row in rows) for index in range(1, len(ACTIVITY_FIELDS) + 1)])
+
+    def get_top_accounts(self, start_day: Union[str, date], end_day: Union[str, date], metric: str = "net_flow",
+                         limit: int = 10) -> List[dict]:
+        """
+        Get the accounts with the highest activity over a range of days.
+
+        :param start_day: First day of the range.
+        :param end_day: Last day of the range (inclusive).
+        :param metric: "net_flow", "deposits", "withdrawals" or "transactions".
+        :param limit: Number of accounts returned.
+        :return: One dict per account, with its totals and the ranking value, highest value first.
+        :raises ValueError: If the metric is unknown or the limit is not positive.
+        """
+        if limit <= 0:
+            raise ValueError("limit must be positive.")
+        rows = self.account_repository.get_top_accounts(start_day, end_day, metric, limit)
+        return [dict(self._activity(row[1:5]), account_id=row[0], value=row[5]) for row in rows]
+
+    @staticmethod
+    def _activity(values) -> dict:
+        """
+        Convert activity totals into a dict with the net flow.
+
+        :param values: (deposit_count, deposit_sum, withdrawal_count, withdrawal_sum) values.
+        :return: The totals and the net flow.
+        """
+        activity = dict(zip(ACTIVITY_FIELDS, values))
+        activity['net_flow'] = activity['deposit_sum'] - activity['withdrawal_sum']
+        return activity
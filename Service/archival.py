@@ -0,0 +1,41 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Tuple, Union
+
+
+class TransactionArchival:
+    def __init__(self, account_repository, archive):
+        """
+        Initialize a TransactionArchival object.
+
+        The TransactionArchival moves ledger rows older than the retention period from the database into the
+        archive's compressed segment files, keeping the Transactions table small. It is meant to run
+        periodically, e.g. once a month. Statements generated with the archive still show the full history.
+
+        :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :param archive: The TransactionArchive receiving the rows.
+        :return: None
+        """
+        self.account_repository = account_repository
+        self.archive = archive
+
+    def run(self, cutoff: Union[None, str, date] = None, retention_days: int = 365) -> Tuple[int, int]:
+        """
+        Archive every transaction before the cutoff day.
+
+        Daily balance checkpoints are brought up to the day before the cutoff first, so period balances
+        keep being served from checkpoints once the rows they were computed from are archived.
+
+        :param cutoff: First day kept in the database (defaults to `retention_days` days ago in UTC).
+        :param retention_days: Number of days kept when no cutoff is given.
+        :return: The number of segments written and the number of transactions archived.
+        """
+        if cutoff is None:
+            cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+        elif not isinstance(cutoff, date):
+            cutoff = date.fromisoformat(cutoff[:10])
+        self.account_repository.checkpoint()
+        self.account_repository.compact_balance_checkpoints(cutoff - timedelta(days=1))
+        segments, archived = self.archive.archive_before(cutoff)
+        logging.info(f"Archived {archived} transactions before {cutoff} into {segments} segments")
+        return segments, archived
@@ -0,0 +1,183 @@
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple, Union
+from Domain import Account, TransactionResult
+from Service.create_account_user import AccountOpening
+from Service.account_transaction_use_case import AmountTransaction
+from Service.generate_account_statement import GenerateStatements
+
+
+class DatabaseExecutor:
+    def __init__(self, read_workers: int = 4, max_in_flight: int = 64) -> None:
+        """
+        Initialize a DatabaseExecutor object.
+
+        The DatabaseExecutor runs blocking database work off the event loop. Writes go to one dedicated
+        writer thread, since SQLite only allows one writer at a time, and reads go to a small thread pool.
+        At most `max_in_flight` calls are handed to the threads at once; further callers wait on a
+        semaphore in the event loop instead of piling up in the executors.
+
+        :param read_workers: Number of threads serving read-only calls.
+        :param max_in_flight: Maximum number of calls submitted to the threads at the same time.
+        :return: None
+        """
+        if read_workers <= 0 or max_in_flight <= 0:
+            raise ValueError("read_workers and max_in_flight must be positive.")
+        self.max_in_flight = max_in_flight
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def run(self, func: Callable, *args, write: bool = False, **kwargs):
+        """
+        Run a blocking function on the writer thread or the reader pool and await its result.
+
+        :param func: The blocking function.
+        :param args: Positional arguments for the function.
+        :param write: Run on the writer thread instead of the reader pool.
+        :param kwargs: Keyword arguments for the function.
+        :return: The function's return value.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        async with semaphore:
+            executor = self._writer if write else self._readers
+            return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the executor threads.
+
+        :param wait: Wait for calls already submitted to finish.
+        :return: None
+        """
+        self._writer.shutdown(wait=wait)
+        self._readers.shutdown(wait=wait)
+
+
+class AsyncAccountOpening:
+    def __init__(self, account_repository, executor: DatabaseExecutor):
+        """
+        Initialize an AsyncAccountOpening object.
+
+        Awaitable counterpart of AccountOpening; the work runs on the executor's writer thread.
+
+        :param account_repository: The repository for interacting with accounts in the database.
+        :param executor: The executor running the blocking database calls.
+        :return: None
+        """
+        self.executor = executor
+        self.account_opening = AccountOpening(account_repository)
+
+    async def create_account(self, customer_id: int, name: str, email: str, phone_number: str) -> Account:
+        """
+        Create a new account for a customer and save it to the database.
+
+        :param customer_id: The ID of the customer for whom the account is created.
+        :param name: The name of the customer.
+        :param email: The email of the customer.
+        :param phone_number: The phone number of the customer.
+        :return: The newly created account.
+        """
+        return await self.executor.run(self.account_opening.create_account, customer_id, name, email,
+                                       phone_number, write=True)
+
+
+class AsyncAmountTransaction:
+    def __init__(self, account_repository, executor: DatabaseExecutor):
+        """
+        Initialize an AsyncAmountTransaction object.
+
+        Awaitable counterpart of AmountTransaction; the work runs on the executor's writer thread.
+
+        :param account_repository: The repository for interacting with accounts in the database.
+        :param executor: The executor running the blocking database calls.
+        :return: None
+        """
+        self.executor = executor
+        self.amount_transaction = AmountTransaction(account_repository)
+
+    async def make_transaction(self, account_id: int, amount: float, transaction_type: str,
+                               idempotency_key: Optional[str] = None) -> Account:
+        """
+        Perform a transaction on the specified account and update it in the database.
+
+        :param account_id: The ID of the account on which the transaction is performed.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param idempotency_key: Optional client key identifying the transaction across retries.
+        :return: The updated account instance.
+        :raises TransactionFailedException: If the transaction could not be applied.
+        """
+        return await self.executor.run(self.amount_transaction.make_transaction, account_id, amount,
+                                       transaction_type, idempotency_key, write=True)
+
+    async def make_transactions(self, transactions: Iterable[Tuple[int, float, str]],
+                                chunk_size: int = 10000) -> List[TransactionResult]:
+        """
+        Perform a batch of transactions, committing once per chunk of rows.
+
+        :param transactions: Iterable of (account_id, amount, transaction_type[, idempotency_key]) rows.
+        :param chunk_size: Number of rows written per DB transaction.
+        :return: One TransactionResult per input row, in input order.
+        """
+        return await self.executor.run(self.amount_transaction.make_transactions, transactions,
+                                       chunk_size=chunk_size, write=True)
+
+
+class AsyncGenerateStatements:
+    def __init__(self, account_repository, executor: DatabaseExecutor, archive=None, cache=None):
+        """
+        Initialize an AsyncGenerateStatements object.
+
+        Awaitable counterpart of GenerateStatements; the work runs on the executor's reader pool.
+
+        :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :param executor: The executor running the blocking database calls.
+        :param archive: Optional TransactionArchive holding ledger rows moved out of the database.
+        :param cache: Optional StatementCache of rendered statements.
+        :return: None
+        """
+        self.executor = executor
+        self.generate_statements = GenerateStatements(account_repository, archive, cache)
+
+    async def generate_account_statement(self, account_id: int) -> str:
+        """
+        Generate an account statement in JSON format based on transaction records.
+
+        :param account_id: The ID of the account for which the statement is generated.
+        :return: A JSON-formatted string representing the account statement.
+        """
+        return await self.executor.run(self.generate_statements.generate_account_statement, account_id)
+
+    async def iter_account_statement(self, account_id: int, start: Union[None, str, datetime] = None,
+                                     end: Union[None, str, datetime] = None,
+                                     page_size: int = 1000) -> AsyncIterator[dict]:
+        """
+        Stream the statement entries of an account as an async iterator.
+
+        Entries are fetched one keyset page at a time, so no database cursor is held across awaits
+        and each page may be served by a different reader thread.
+
+        :param account_id: The ID of the account for which the statement is generated.
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :param page_size: Number of entries fetched per database call.
+        :return: Async iterator of statement entries.
+        """
+        after_transaction_id = None
+        while True:
+            page = await self.executor.run(self.generate_statements.get_statement_page, account_id,
+                                           after_transaction_id=after_transaction_id, limit=page_size,
+                                           start=start, end=end)
+            for entry in page['transactions']:
+                del entry['transaction_id']
+                yield entry
+            after_transaction_id = page['next_after_transaction_id']
+            if after_transaction_id is None:
+                return
@@ -0,0 +1,30 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Union
+
+
+class BalanceCheckpointJob:
+    def __init__(self, account_repository):
+        """
+        Initialize a BalanceCheckpointJob object.
+
+        The BalanceCheckpointJob maintains the daily closing balance checkpoints used by
+        GenerateStatements.get_period_balances. It is meant to run periodically, e.g. once a day.
+
+        :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :return: None
+        """
+        self.account_repository = account_repository
+
+    def run(self, up_to_day: Union[None, str, date] = None) -> int:
+        """
+        Checkpoint every completed day since the previous run.
+
+        :param up_to_day: Last day to checkpoint (defaults to yesterday in UTC, the last completed day).
+        :return: The number of checkpoints written.
+        """
+        if up_to_day is None:
+            up_to_day = datetime.now(timezone.utc).date() - timedelta(days=1)
+        written = self.account_repository.compact_balance_checkpoints(up_to_day)
+        logging.info(f"Wrote {written} balance checkpoints up to {up_to_day}")
+        return written
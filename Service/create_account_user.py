@@ -1,9 +1,31 @@
-from datetime import datetime
+import csv
+import json
+import logging
+import threading
+from itertools import islice
+from typing import Iterator, List, NamedTuple, TextIO, Tuple, Union
 from Domain.account import Account
 from Domain.customer import Customer
 
+ONBOARDING_FORMATS = ("csv", "ndjson")
+ONBOARDING_FIELDS = ("customer_id", "name", "email", "phone_number")
+
+
+class OnboardingReport(NamedTuple):
+    """
+    Outcome of a bulk onboarding run.
+
+    :param created: Number of customers onboarded with a new account.
+    :param rejected: (record number, reason) for every rejected record; records are numbered from 1.
+    """
+    created: int
+    rejected: List[Tuple[int, str]]
+
 
 class AccountOpening:
+    # Account numbers reserved from the database sequence at a time by create_account.
+    ACCOUNT_NUMBER_BLOCK = 100
+
     def __init__(self, account_repository):
         """
         Initialize an AccountOpening object.
@@ -14,6 +36,8 @@ class AccountOpening:
         :return: None
         """
         self.account_repository = account_repository
+        self._account_numbers = iter(())
+        self._account_numbers_lock = threading.Lock()
 
     def create_account(self, customer_id: int, name: str, email: str, phone_number: str) -> Account:
         """
@@ -26,7 +50,7 @@ class AccountOpening:
         :return: The newly created account.
         """
         try:
-            customer = Customer(customer_id, name, email, phone_number)
+            customer = Customer(customer_id=customer_id, name=name, phone_number=phone_number, email=email)
             account_number = self.__generate_account_number()
             account = Account(None, customer_id, account_number)
             account = self.account_repository.save_account(account, customer)
@@ -34,12 +58,93 @@ class AccountOpening:
         except RuntimeError as e:
             raise RuntimeError(f"Account creation got failed. Error details : {e}")
 
+    def create_accounts(self, source: Union[str, TextIO], fmt: str = "csv",
+                        chunk_size: int = 5000) -> OnboardingReport:
+        """
+        Onboard customers in bulk from a CSV or NDJSON file, each with a new account.
+
+        Records are read lazily and written in chunks of `chunk_size`, one DB transaction per chunk. CSV files
+        need a header with the customer_id, name, email and phone_number columns; NDJSON lines are objects
+        with the same keys. Invalid records and customers that already exist are reported, not raised.
+
+        :param source: Path of the file, or an open text file-like object.
+        :param fmt: "csv" or "ndjson".
+        :param chunk_size: Number of customers written per DB transaction.
+        :return: The number of customers created and the rejected records.
+        :raises ValueError: If the format is not supported.
+        :raises RuntimeError: If a chunk could not be written; earlier chunks stay committed.
+        """
+        if fmt not in ONBOARDING_FORMATS:
+            raise ValueError(f"Unsupported onboarding format: {fmt}")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive.")
+        if isinstance(source, str):
+            with open(source, newline="") as file:
+                return self.create_accounts(file, fmt=fmt, chunk_size=chunk_size)
+
+        created = 0
+        rejected = []
+        records = self._parse_records(source, fmt, rejected)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            try:
+                chunk_rejected = self.account_repository.save_new_customers([customer for _, customer in chunk])
+            except RuntimeError as e:
+                raise RuntimeError(f"Account creation got failed. Error details : {e}")
+            rejected.extend((chunk[position][0], reason) for position, reason in chunk_rejected)
+            created += len(chunk) - len(chunk_rejected)
+        rejected.sort()
+        logging.info(f"Onboarded {created} customers, rejected {len(rejected)} records")
+        return OnboardingReport(created, rejected)
+
     @staticmethod
-    def __generate_account_number() -> int:
+    def _parse_records(source: TextIO, fmt: str, rejected: List[Tuple[int, str]]) -> Iterator[Tuple[int, Customer]]:
+        """
+        Parse onboarding records into customers, reporting invalid ones in `rejected`.
+
+        :param source: Open text file-like object.
+        :param fmt: "csv" or "ndjson".
+        :param rejected: List the (record number, reason) of invalid records is appended to.
+        :return: Iterator of (record number, customer) for valid records.
+        """
+        if fmt == "csv":
+            records = csv.DictReader(source)
+        else:
+            records = (line for line in source if line.strip())
+        for number, record in enumerate(records, start=1):
+            try:
+                if fmt == "ndjson":
+                    record = json.loads(record)
+                    if not isinstance(record, dict):
+                        raise ValueError("Record is not an object")
+                values = {}
+                for field in ONBOARDING_FIELDS:
+                    value = record.get(field)
+                    value = value.strip() if isinstance(value, str) else value
+                    if value is None or value == "":
+                        raise ValueError(f"Missing field: {field}")
+                    values[field] = value
+                try:
+                    customer_id = int(values["customer_id"])
+                except (TypeError, ValueError):
+                    raise ValueError("Invalid customer_id")
+                yield number, Customer(customer_id=customer_id, name=str(values["name"]),
+                                       phone_number=str(values["phone_number"]), email=str(values["email"]))
+            except ValueError as e:
+                rejected.append((number, str(e)))
+
+    def __generate_account_number(self) -> int:
         """
-        Generate a unique account number based on the current timestamp.
+        Take the next account number from a block reserved in the database sequence.
 
         :return: The generated account number.
         """
-        account_id = str(datetime.timestamp(datetime.now())).replace(".", "")
-        return int(account_id)
+        with self._account_numbers_lock:
+            account_number = next(self._account_numbers, None)
+            if account_number is None:
+                self._account_numbers = iter(self.account_repository.allocate_account_numbers(
+                    self.ACCOUNT_NUMBER_BLOCK))
+                account_number = next(self._account_numbers)
+            return account_number
@@ -0,0 +1,177 @@
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import List, Optional, Tuple, Union
+from db.db_client import DatabaseConnection
+from Infrastructure.transaction_archive import TransactionArchive
+from Service.generate_account_statement import GenerateStatements, STATEMENT_FORMATS, _skip_duplicates
+
+EXPORT_LAYOUTS = ("per_account", "partitioned")
+
+
+class BulkStatementExport:
+    def __init__(self, account_repository, workers: int = 4, partitions: Optional[int] = None,
+                 fetch_size: int = 5000, archive=None):
+        """
+        Initialize a BulkStatementExport object.
+
+        The BulkStatementExport writes the statements of every account in one pass over the Transactions
+        table. Accounts are split into contiguous account_id ranges and each range is exported by a worker
+        process that streams its slice of the ledger in account order and writes output as it goes. With an
+        archive, the archived rows of the range are merged into the stream, like statements generated with one.
+
+        :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :param workers: Number of worker processes; 1 exports in the calling process.
+        :param partitions: Number of account_id ranges per database (defaults to the number of workers).
+        :param fetch_size: Number of ledger rows fetched from the cursor at a time.
+        :param archive: Optional TransactionArchive holding ledger rows moved out of the database.
+        :return: None
+        """
+        if workers <= 0:
+            raise ValueError("workers must be positive.")
+        self.account_repository = account_repository
+        self.workers = workers
+        self.partitions = partitions or workers
+        self.fetch_size = fetch_size
+        self.archive = archive
+
+    def export_all(self, output_dir: str, fmt: str = "json", layout: str = "per_account",
+                   start: Union[None, str, datetime] = None, end: Union[None, str, datetime] = None) -> dict:
+        """
+        Export the statements of all accounts.
+
+        With the "per_account" layout one `statement_<account_id>.<fmt>` file is written per account,
+        including accounts without transactions. With the "partitioned" layout one
+        `statements_part_<n>.ndjson` file is written per account_id range.
+
+        :param output_dir: Directory the statement files are written to; it is created if missing.
+        :param fmt: Statement format for the "per_account" layout ("json", "ndjson" or "csv").
+        :param layout: "per_account" or "partitioned".
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :return: A summary with the number of accounts exported, with or without transactions, and of the
+                 transactions and files written.
+        :raises ValueError: If the format or layout is not supported.
+        """
+        if layout not in EXPORT_LAYOUTS:
+            raise ValueError(f"Unsupported export layout: {layout}")
+        if fmt not in STATEMENT_FORMATS:
+            raise ValueError(f"Unsupported statement format: {fmt}")
+        if layout == "partitioned":
+            fmt = "ndjson"
+        os.makedirs(output_dir, exist_ok=True)
+
+        repository = self.account_repository
+        repository.checkpoint()
+        start = start if start is None else repository.format_timestamp(start)
+        end = end if end is None else repository.format_timestamp(end)
+        archive_dir = None if self.archive is None else self.archive.archive_dir
+        tasks = []
+        connections = []
+        # A sharded repository is exported shard by shard; each shard's ranges are read from its own file.
+        for shard in getattr(repository, "shards", [repository]):
+            for low, high in self._account_ranges(shard):
+                tasks.append((shard.db_connection.connection_string, low, high, len(tasks), output_dir, fmt, layout,
+                              start, end, self.fetch_size, archive_dir))
+                connections.append(shard.db_connection)
+
+        if self.workers == 1 or len(tasks) <= 1:
+            # In this process the shard's own DatabaseConnection is used, so its metrics cover the export.
+            results = [_export_partition(*task, db_connection=connection)
+                       for task, connection in zip(tasks, connections)]
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as executor:
+                results = list(executor.map(_export_partition, *zip(*tasks)))
+
+        summary = {'accounts': 0, 'transactions': 0, 'files': 0}
+        for result in results:
+            for key in summary:
+                summary[key] += result[key]
+        return summary
+
+    def _account_ranges(self, repository) -> List[Tuple[int, int]]:
+        """
+        Split the existing account IDs into contiguous ranges holding about the same number of accounts.
+
+        :param repository: The (shard) repository whose database is split.
+        :return: Inclusive (low, high) account_id ranges.
+        """
+        with repository.db_connection.read_connection() as connection:
+            data_list, _ = repository.db_connection.execute_query(
+                "SELECT account_id FROM Accounts ORDER BY account_id", (), connection)
+        account_ids = [row[0] for row in data_list or ()]
+        if not account_ids:
+            return []
+        size = -(-len(account_ids) // self.partitions)
+        return [(account_ids[index], account_ids[min(index + size, len(account_ids)) - 1])
+                for index in range(0, len(account_ids), size)]
+
+
+def _export_partition(connection_string: str, low: int, high: int, index: int, output_dir: str, fmt: str,
+                      layout: str, start: Optional[str], end: Optional[str], fetch_size: int,
+                      archive_dir: Optional[str] = None, db_connection: Optional[DatabaseConnection] = None) -> dict:
+    """
+    Export the statements of the accounts in one account_id range.
+
+    Runs in a worker process, so it only takes picklable arguments and opens its own connection. With an
+    archive directory, the archived rows registered in the database are merged into the ledger stream.
+    A caller in the same process may pass its DatabaseConnection, whose metrics then record the queries.
+
+    :return: The number of accounts, transactions and files written for the range.
+    """
+    query = ("SELECT transaction_id, account_id, amount, transaction_type, timestamp FROM Transactions "
+             "WHERE account_id BETWEEN ? AND ?")
+    query_data = [low, high]
+    if start is not None:
+        query += " AND timestamp >= ?"
+        query_data.append(start)
+    if end is not None:
+        query += " AND timestamp < ?"
+        query_data.append(end)
+    query += " ORDER BY account_id, transaction_id"
+
+    summary = {'accounts': 0, 'transactions': 0, 'files': 0}
+    db_connection = db_connection or DatabaseConnection(connection_string)
+    with db_connection.read_connection() as connection:
+        data_list, _ = db_connection.execute_query(
+            "SELECT account_id FROM Accounts WHERE account_id BETWEEN ? AND ? ORDER BY account_id", (low, high),
+            connection)
+        account_ids = [row[0] for row in data_list or ()]
+        rows = chain.from_iterable(db_connection.iter_query(query, tuple(query_data), connection, fetch_size))
+        if archive_dir is not None:
+            archive = TransactionArchive(db_connection, archive_dir)
+            rows = _skip_duplicates(heapq.merge(archive.iter_account_range(low, high, start, end), rows,
+                                                key=itemgetter(1, 0)))
+        groups = groupby(rows, key=itemgetter(1))
+
+        if layout == "partitioned":
+            path = os.path.join(output_dir, f"statements_part_{index:05d}.ndjson")
+            with open(path, "w") as output:
+                for _, group in groups:
+                    summary['transactions'] += GenerateStatements.write_entries(
+                        map(GenerateStatements.statement_entry, group), output, "ndjson")
+            # Like the per-account layout, count every account in the range, with or without activity.
+            summary['accounts'] = len(account_ids)
+            summary['files'] = 1
+            return summary
+
+        # Merge the account list with the ledger stream so accounts without activity still get a statement.
+        pending = next(groups, None)
+        for account_id in account_ids:
+            while pending is not None and pending[0] < account_id:
+                # Ledger rows without an Accounts row have no statement to go into.
+                pending = next(groups, None)
+            matched = pending is not None and pending[0] == account_id
+            entries = map(GenerateStatements.statement_entry, pending[1]) if matched else ()
+            path = os.path.join(output_dir, f"statement_{account_id}.{fmt}")
+            with open(path, "w", newline="" if fmt == "csv" else None) as output:
+                summary['transactions'] += GenerateStatements.write_entries(entries, output, fmt)
+            if matched:
+                pending = next(groups, None)
+            summary['accounts'] += 1
+            summary['files'] += 1
+    return summary
+
@@ -1,37 +1,271 @@
+import csv
+import heapq
+import io
 import json
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, Optional, TextIO, Union
+from Infrastructure.statement_cache import CachedStatement, StatementCache
+
+STATEMENT_FORMATS = ("json", "ndjson", "csv")
+STATEMENT_FIELDS = ("account_id", "amount", "type", "time")
 
 
 class GenerateStatements:
-    def __init__(self, account_repository):
+    def __init__(self, account_repository, archive=None, cache: Optional[StatementCache] = None):
         """
         Initialize a GenerateStatements object.
 
         The GenerateStatements class is responsible for generating account statements based on transaction records.
+        With an archive, statements merge the archived ledger rows with the ones still in the database.
 
         :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :param archive: Optional TransactionArchive holding ledger rows moved out of the database.
+        :param cache: Optional StatementCache of rendered statements, extended with the newer rows on every
+                      request. Statements cached without an archive keep the rows archived afterwards.
         :return: None
         """
         self.account_repository = account_repository
+        self.archive = archive
+        self.cache = cache
 
     def generate_account_statement(self, account_id: int) -> json.dumps:
         """
         Generate an account statement in JSON format based on transaction records.
 
+        With a cache, only the rows after the last cached transaction are read, with one indexed query, and
+        appended to the cached statement.
+
         :param account_id: The ID of the account for which the statement is generated.
         :return: A JSON-formatted string representing the account statement.
         """
-        statement_list = []
-        connection = self.account_repository.db_connection.create_db_connection()
-        data_rows, _ = self.account_repository.db_connection.execute_query(
-            'SELECT * FROM transactions WHERE account_id=?;',
-            (account_id,), connection)
-        if data_rows:
-            for row in data_rows:
-                statement_list.append({
-                    'account_id': row[1],
-                    'amount': row[2],
-                    'type': row[3],
-                    'time': row[4],
-                })
-            return json.dumps(statement_list, indent=2)
-        return json.dumps([], indent=2)
+        if self.cache is None:
+            output = io.StringIO()
+            self.write_account_statement(account_id, output)
+            return output.getvalue()
+        cached = self.cache.get(account_id)
+        statement = cached or CachedStatement(None, 0, "")
+        output = io.StringIO()
+        output.write(statement.body)
+        count, last_transaction_id = statement.count, statement.last_transaction_id
+        with self.account_repository.snapshot():
+            for row in self._iter_rows(account_id, after_transaction_id=last_transaction_id):
+                self._write_json_entry(self.statement_entry(row), output, count == 0)
+                count, last_transaction_id = count + 1, row[0]
+        if cached is None or count != cached.count:
+            statement = CachedStatement(last_transaction_id, count, output.getvalue())
+            self.cache.put(account_id, statement)
+        return statement.body + "\n]" if count else "[]"
+
+    def iter_account_statement(self, account_id: int, start: Union[None, str, datetime] = None,
+                               end: Union[None, str, datetime] = None) -> Iterator[dict]:
+        """
+        Stream the statement entries of an account without loading its whole history.
+
+        :param account_id: The ID of the account for which the statement is generated.
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :return: Iterator of statement entries.
+        """
+        for row in self._iter_rows(account_id, start=start, end=end):
+            yield self.statement_entry(row)
+
+    def write_account_statement(self, account_id: int, output: TextIO, fmt: str = "json",
+                                start: Union[None, str, datetime] = None,
+                                end: Union[None, str, datetime] = None) -> int:
+        """
+        Write an account statement to a file-like object, one entry at a time, from one read-only snapshot
+        of the database.
+
+        The "json" format produces the same document as `generate_account_statement`, "ndjson" writes one
+        JSON object per line and "csv" writes a header row followed by one row per transaction.
+
+        :param account_id: The ID of the account for which the statement is generated.
+        :param output: Writable text file-like object.
+        :param fmt: One of "json", "ndjson" or "csv".
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :return: The number of entries written.
+        :raises ValueError: If the format is not supported.
+        """
+        with self.account_repository.snapshot():
+            return self.write_entries(self.iter_account_statement(account_id, start=start, end=end), output, fmt)
+
+    @classmethod
+    def write_entries(cls, entries: Iterable[dict], output: TextIO, fmt: str = "json") -> int:
+        """
+        Write already built statement entries to a file-like object in the given format.
+
+        :param entries: Statement entries.
+        :param output: Writable text file-like object.
+        :param fmt: One of "json", "ndjson" or "csv".
+        :return: The number of entries written.
+        :raises ValueError: If the format is not supported.
+        """
+        if fmt not in STATEMENT_FORMATS:
+            raise ValueError(f"Unsupported statement format: {fmt}")
+        if fmt == "ndjson":
+            return cls._write_ndjson(entries, output)
+        if fmt == "csv":
+            return cls._write_csv(entries, output)
+        return cls._write_json(entries, output)
+
+    def get_statement_page(self, account_id: int, after_transaction_id: Optional[int] = None, limit: int = 100,
+                           start: Union[None, str, datetime] = None,
+                           end: Union[None, str, datetime] = None) -> dict:
+        """
+        Get one page of an account statement using keyset pagination.
+
+        Pass the returned `next_after_transaction_id` back as `after_transaction_id` to get the next page;
+        it is None once the last page has been returned.
+
+        :param account_id: The ID of the account for which the statement is generated.
+        :param after_transaction_id: Return transactions after this transaction_id (None for the first page).
+        :param limit: Maximum number of entries in the page.
+        :param start: Only include transactions at or after this time.
+        :param end: Only include transactions strictly before this time.
+        :return: A dict with the page `transactions` and the `next_after_transaction_id` cursor.
+        :raises ValueError: If the limit is not positive.
+        """
+        if limit <= 0:
+            raise ValueError("limit must be positive.")
+        with self.account_repository.snapshot():
+            rows = list(self._iter_rows(
+                account_id, start=start, end=end, after_transaction_id=after_transaction_id, limit=limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'transactions': [dict(self.statement_entry(row), transaction_id=row[0]) for row in rows],
+            'next_after_transaction_id': rows[-1][0] if has_more else None,
+        }
+
+    def get_period_balances(self, account_id: int, start: Union[str, datetime],
+                            end: Union[str, datetime]) -> dict:
+        """
+        Get the opening and closing balance of an account for a statement period.
+
+        Both balances start from the nearest daily balance checkpoint, so only the ledger rows since that
+        checkpoint are read rather than the whole account history, together with the archived rows in that
+        range. They are read from one snapshot, so a transaction committed in between cannot make them disagree.
+
+        :param account_id: The ID of the account for which the statement is generated.
+        :param start: Start of the period; the opening balance includes transactions before this time.
+        :param end: End of the period; the closing balance includes transactions before this time.
+        :return: A dict with the account ID, the period bounds and the opening and closing balances.
+        :raises ValueError: If a balance needs archived rows and there is no archive.
+        """
+        repository = self.account_repository
+        with repository.snapshot():
+            return {
+                'account_id': account_id,
+                'start': repository.format_timestamp(start),
+                'end': repository.format_timestamp(end),
+                'opening_balance': repository.get_balance_at(account_id, start, self.archive),
+                'closing_balance': repository.get_balance_at(account_id, end, self.archive),
+            }
+
+    def _iter_rows(self, account_id: int, **criteria) -> Iterator[tuple]:
+        """
+        Stream the ledger rows of an account in transaction_id order, from the database and the archive.
+
+        A row found in both, which happens only between the archive writing a segment and deleting the
+        archived rows, is returned once.
+
+        :param account_id: The ID of the account.
+        :param criteria: start, end, after_transaction_id and limit, as taken by iter_transactions.
+        :return: Iterator of (transaction_id, account_id, amount, transaction_type, timestamp) rows.
+        """
+        rows = self.account_repository.iter_transactions(account_id, **criteria)
+        if self.archive is None:
+            return rows
+        merged = heapq.merge(self.archive.iter_transactions(account_id, **criteria), rows)
+        return islice(_skip_duplicates(merged), criteria.get('limit'))
+
+    @staticmethod
+    def statement_entry(row: tuple) -> dict:
+        """
+        Convert a ledger row into a statement entry.
+
+        :param row: (transaction_id, account_id, amount, transaction_type, timestamp) row.
+        :return: The statement entry.
+        """
+        return {
+            'account_id': row[1],
+            'amount': row[2],
+            'type': row[3],
+            'time': row[4],
+        }
+
+    @staticmethod
+    def _write_json(entries: Iterable[dict], output: TextIO) -> int:
+        """
+        Write entries as an indented JSON array, matching `json.dumps(entries, indent=2)`.
+
+        :param entries: Statement entries.
+        :param output: Writable text file-like object.
+        :return: The number of entries written.
+        """
+        count = 0
+        for entry in entries:
+            GenerateStatements._write_json_entry(entry, output, count == 0)
+            count += 1
+        output.write("\n]" if count else "[]")
+        return count
+
+    @staticmethod
+    def _write_json_entry(entry: dict, output: TextIO, first: bool) -> None:
+        """
+        Write one entry of an indented JSON array, without the closing bracket.
+
+        :param entry: Statement entry.
+        :param output: Writable text file-like object.
+        :param first: The entry opens the array.
+        :return: None
+        """
+        output.write(("[\n  " if first else ",\n  ") + json.dumps(entry, indent=2).replace("\n", "\n  "))
+
+    @staticmethod
+    def _write_ndjson(entries: Iterable[dict], output: TextIO) -> int:
+        """
+        Write entries as newline-delimited JSON.
+
+        :param entries: Statement entries.
+        :param output: Writable text file-like object.
+        :return: The number of entries written.
+        """
+        count = 0
+        for entry in entries:
+            output.write(json.dumps(entry) + "\n")
+            count += 1
+        return count
+
+    @staticmethod
+    def _write_csv(entries: Iterable[dict], output: TextIO) -> int:
+        """
+        Write entries as CSV with a header row.
+
+        :param entries: Statement entries.
+        :param output: Writable text file-like object.
+        :return: The number of entries written.
+        """
+        writer = csv.DictWriter(output, fieldnames=STATEMENT_FIELDS)
+        writer.writeheader()
+        count = 0
+        for entry in entries:
+            writer.writerow(entry)
+            count += 1
+        return count
+
+
+def _skip_duplicates(rows: Iterable[tuple]) -> Iterator[tuple]:
+    """
+    Drop consecutive ledger rows with the same transaction_id.
+
+    :param rows: Ledger rows in transaction_id order.
+    :return: Iterator of unique rows.
+    """
+    last_transaction_id = None
+    for row in rows:
+        if row[0] != last_transaction_id:
+            last_transaction_id = row[0]
+            yield row
@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional
+from Service.utils import TransactionFailedException
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, account_repository, max_batch_size: int = 500, max_delay: float = 0.002):
+        """
+        Initialize a GroupCommitWriter object.
+
+        The GroupCommitWriter serializes writes through one background thread. Transactions submitted by
+        any number of callers are collected for up to `max_delay` seconds or `max_batch_size` rows and
+        applied with a single AccountRepository.apply_transactions call, i.e. one SQL transaction and one
+        commit per group. Rows are applied in submission order, so every caller gets the same result it
+        would get from make_transaction.
+
+        :param account_repository: The repository for interacting with accounts in the database.
+        :param max_batch_size: Maximum number of transactions committed together.
+        :param max_delay: Maximum time in seconds the first transaction of a group waits for others.
+        :return: None
+        """
+        if max_batch_size <= 0 or max_delay < 0:
+            raise ValueError("max_batch_size must be positive and max_delay must not be negative.")
+        self.account_repository = account_repository
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> "GroupCommitWriter":
+        """
+        Start the background writer thread if it is not running yet.
+
+        :return: The writer itself.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, account_id: int, amount: float, transaction_type: str,
+               idempotency_key: Optional[str] = None) -> Future:
+        """
+        Queue a transaction for the next group commit.
+
+        :param account_id: The ID of the account on which the transaction is performed.
+        :param amount: The amount of the transaction.
+        :param transaction_type: The type of the transaction ("deposit" or "withdraw").
+        :param idempotency_key: Optional client key identifying the transaction across retries.
+        :return: A future resolving to the row's TransactionResult once it is committed, or failing with
+                 TransactionFailedException if the row was rejected or the group could not be written.
+        :raises RuntimeError: If the writer is not running.
+        """
+        if self._thread is None:
+            raise RuntimeError("GroupCommitWriter is not started.")
+        future = Future()
+        self._queue.put(((account_id, amount, transaction_type, idempotency_key), future))
+        return future
+
+    def close(self) -> None:
+        """
+        Commit everything already submitted and stop the writer thread.
+
+        :return: None
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+        # Fail anything that raced in behind the stop marker instead of leaving its caller waiting.
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                item[1].set_exception(TransactionFailedException("GroupCommitWriter is closed."))
+
+    def __enter__(self) -> "GroupCommitWriter":
+        """
+        Start the writer when entering a `with` block.
+
+        :return: The writer itself.
+        """
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """
+        Flush and stop the writer when leaving a `with` block.
+
+        :return: None
+        """
+        self.close()
+
+    def _run(self) -> None:
+        """
+        Collect queued transactions into groups and commit them until close() is called.
+
+        :return: None
+        """
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            group = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(group) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                group.append(item)
+            self._commit(group)
+
+    def _commit(self, group: list) -> None:
+        """
+        Apply one group in a single DB transaction and resolve each caller's future.
+
+        :param group: List of (row, future) pairs.
+        :return: None
+        """
+        try:
+            results = self.account_repository.apply_transactions([row for row, _ in group])
+        except Exception as e:
+            logging.debug(f"{str(e)}")
+            for _, future in group:
+                future.set_exception(TransactionFailedException(str(e)))
+            return
+        for (_, future), result in zip(group, results):
+            if result.success:
+                future.set_result(result)
+            else:
+                future.set_exception(TransactionFailedException(result.error))
@@ -0,0 +1,116 @@
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed by the reconciliation job.
+    np = None
+
+
+class ReconciliationReport(NamedTuple):
+    """
+    Outcome of a reconciliation run.
+
+    :param accounts: Number of accounts checked.
+    :param transactions: Number of ledger rows read.
+    :param mismatches: (account_id, stored balance, ledger balance) for every account whose stored balance
+                       differs from its ledger; the stored balance is None for ledger rows without an account.
+    """
+    accounts: int
+    transactions: int
+    mismatches: List[Tuple[int, Optional[float], float]]
+
+
+class LedgerReconciliation:
+    def __init__(self, account_repository, chunk_size: int = 1000000, tolerance: float = 0.005):
+        """
+        Initialize a LedgerReconciliation object.
+
+        The LedgerReconciliation compares every stored balance with the sum of the account's ledger. Balances
+        are loaded into sorted arrays, then the ledger is read in chunks of `chunk_size` rows, whose amounts
+        are added to their accounts with searchsorted and bincount. Memory is bounded by the number of
+        accounts plus one chunk, whatever the size of the ledger.
+
+        :param account_repository: The repository for interacting with accounts and transactions in the database.
+        :param chunk_size: Number of ledger rows loaded at a time.
+        :param tolerance: Absolute difference ignored as floating-point rounding.
+        :return: None
+        :raises RuntimeError: If NumPy is not installed.
+        """
+        if np is None:
+            raise RuntimeError("Ledger reconciliation requires NumPy; install it with `pip install numpy`.")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive.")
+        self.account_repository = account_repository
+        self.chunk_size = chunk_size
+        self.tolerance = tolerance
+        self._row_dtype = np.dtype([("account_id", np.int64), ("value", np.float64)])
+
+    def run(self) -> ReconciliationReport:
+        """
+        Reconcile every account.
+
+        A sharded repository is reconciled shard by shard.
+
+        :return: The reconciliation report.
+        :raises RuntimeError: If an error occurs during the database operation.
+        """
+        accounts = transactions = 0
+        mismatches = []
+        for repository in getattr(self.account_repository, "shards", [self.account_repository]):
+            report = self._reconcile(repository)
+            accounts += report.accounts
+            transactions += report.transactions
+            mismatches.extend(report.mismatches)
+        mismatches.sort(key=lambda mismatch: mismatch[0])
+        if mismatches:
+            logging.warning(f"Reconciliation found {len(mismatches)} mismatched accounts")
+        return ReconciliationReport(accounts, transactions, mismatches)
+
+    def _reconcile(self, repository) -> ReconciliationReport:
+        """
+        Reconcile the accounts of one database.
+
+        :param repository: The (shard) repository to reconcile.
+        :return: The reconciliation report of the database.
+        """
+        account_chunks = []
+        account_ids = balances = ledger = None
+        orphans = []
+        transactions = 0
+        for kind, rows in repository.iter_reconciliation_chunks(self.chunk_size):
+            chunk = np.fromiter(rows, dtype=self._row_dtype, count=len(rows))
+            if kind == "accounts":
+                account_chunks.append(chunk)
+                continue
+            if ledger is None:
+                account_ids, balances, ledger = self._accounts(account_chunks)
+            transactions += len(chunk)
+            positions = np.searchsorted(account_ids, chunk["account_id"])
+            known = positions < len(account_ids)
+            known[known] = account_ids[positions[known]] == chunk["account_id"][known]
+            ledger += np.bincount(positions[known], weights=chunk["value"][known], minlength=len(account_ids))
+            if not known.all():
+                orphans.append(chunk[~known])
+        if ledger is None:
+            account_ids, balances, ledger = self._accounts(account_chunks)
+
+        differs = ~np.isclose(balances, ledger, rtol=0, atol=self.tolerance)
+        mismatches = list(zip(account_ids[differs].tolist(), balances[differs].tolist(), ledger[differs].tolist()))
+        if orphans:
+            orphans = np.concatenate(orphans)
+            orphan_ids, inverse = np.unique(orphans["account_id"], return_inverse=True)
+            orphan_sums = np.bincount(inverse, weights=orphans["value"], minlength=len(orphan_ids))
+            mismatches.extend((account_id, None, total)
+                              for account_id, total in zip(orphan_ids.tolist(), orphan_sums.tolist()))
+        return ReconciliationReport(len(account_ids), transactions, mismatches)
+
+    def _accounts(self, chunks: list) -> tuple:
+        """
+        Build the sorted account arrays and the zeroed ledger sums.
+
+        :param chunks: Account chunks in account_id order.
+        :return: (account_ids, balances, ledger sums) arrays.
+        """
+        accounts = np.concatenate(chunks) if chunks else np.empty(0, dtype=self._row_dtype)
+        return accounts["account_id"], accounts["value"], np.zeros(len(accounts), dtype=np.float64)
@@ -0,0 +1,37 @@
+import logging
+from typing import Iterable, Tuple
+from Domain import Account
+from Service.utils import TransactionFailedException
+
+
+class FundsTransfer:
+    def __init__(self, account_repository):
+        """
+        Initialize a FundsTransfer object.
+
+        The FundsTransfer moves money from one account to one or many accounts atomically, e.g. for payroll runs.
+
+        :param account_repository: The repository for interacting with accounts in the database.
+        :return: None
+        """
+        self.account_repository = account_repository
+
+    def transfer(self, source_account_id: int, credits: Iterable[Tuple[int, float]]) -> Account:
+        """
+        Debit the source account and credit every target account in one DB transaction.
+
+        Either every credit is applied together with the debit, or nothing is.
+
+        :param source_account_id: The ID of the account to debit.
+        :param credits: (account_id, amount) for every account to credit.
+        :return: The updated source account.
+        :raises TransactionFailedException: If an amount is invalid, an account does not exist, the source is
+                                            also a target or the source has insufficient funds.
+        """
+        try:
+            account = self.account_repository.apply_transfer(source_account_id, list(credits))
+            logging.info("Transfer completed successfully")
+            return account
+        except (RuntimeError, ValueError, TypeError) as e:
+            logging.debug(f"{str(e)}")
+            raise TransactionFailedException(str(e))
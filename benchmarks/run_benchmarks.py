@@ -0,0 +1,250 @@
+"""
+Reproducible benchmarks for the account, transaction and statement paths.
+
+Each scale generates a seeded synthetic dataset in a throwaway SQLite file, then times the public use cases
+and repository lookups one call at a time. Results are written as JSON so runs can be compared across commits:
+
+    python -m benchmarks.run_benchmarks --scales small,medium --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from db.db_client import DatabaseConnection
+from db.local_db_initialization import DatabaseInitializer
+from Domain import Customer
+from Infrastructure.account_repository import AccountRepository
+from Service import AccountOpening, AmountTransaction, GenerateStatements, TransactionFailedException
+
+# (customers, transactions) per named scale.
+SCALES: Dict[str, Tuple[int, int]] = {
+    'tiny': (100, 1000),
+    'small': (1000, 20000),
+    'medium': (10000, 200000),
+    'large': (100000, 2000000),
+}
+
+# Zipf exponent of the per-account activity distribution: a few accounts get most transactions.
+SKEW = 1.1
+
+
+def generate_dataset(db_connection: DatabaseConnection, customers: int, transactions: int,
+                     seed: int) -> List[int]:
+    """
+    Fill an initialized database with seeded synthetic customers, accounts and transactions.
+
+    Accounts receive transactions with a Zipf-like skew. Withdrawals never exceed the running balance, and
+    the stored balances match the generated ledger.
+
+    :param db_connection: The database to fill.
+    :param customers: Number of customers, each with one account.
+    :param transactions: Number of ledger rows.
+    :param seed: Random seed.
+    :return: Account IDs ordered from the most to the least active.
+    """
+    rng = random.Random(seed)
+    with db_connection.connection() as connection:
+        connection.executemany(
+            "INSERT INTO Customers (customer_id, name, phone_number, email, email_key, phone_key, name_key) "
+            "VALUES (?,?,?,?,?,?,?)",
+            ((customer.customer_id, customer.name, customer.phone_number, customer.email) + customer.lookup_keys()
+             for customer in (Customer(customer_id, f"Customer {customer_id}", f"555-{customer_id:07d}",
+                                       f"customer{customer_id}@example.com")
+                              for customer_id in range(1, customers + 1))))
+        connection.executemany(
+            "INSERT INTO Accounts (account_id, customer_id, account_number, balance) VALUES (?,?,?,0)",
+            ((customer_id, customer_id, str(10 ** 12 + customer_id)) for customer_id in range(1, customers + 1)))
+
+    weights = [1 / rank ** SKEW for rank in range(1, customers + 1)]
+    ranked_ids = list(range(1, customers + 1))
+    rng.shuffle(ranked_ids)
+    balances = dict.fromkeys(ranked_ids, 0.0)
+    rows = []
+    for account_id in rng.choices(ranked_ids, weights=weights, k=transactions):
+        amount = round(rng.uniform(1, 500), 2)
+        if balances[account_id] >= amount and rng.random() < 0.4:
+            balances[account_id] -= amount
+            rows.append((account_id, amount, "withdraw"))
+        else:
+            balances[account_id] += amount
+            rows.append((account_id, amount, "deposit"))
+
+    with db_connection.connection() as connection:
+        connection.executemany("INSERT INTO Transactions (account_id, amount, transaction_type) VALUES (?,?,?)",
+                               rows)
+        connection.executemany("UPDATE Accounts SET balance = ? WHERE account_id = ?",
+                               ((balance, account_id) for account_id, balance in balances.items()))
+    return ranked_ids
+
+
+def measure(operation: Callable[[int], object], ops: int) -> dict:
+    """
+    Time `ops` calls of an operation.
+
+    :param operation: Callable receiving the iteration number.
+    :param ops: Number of calls.
+    :return: Throughput and latency percentiles.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for iteration in range(ops):
+        call_started = time.perf_counter()
+        operation(iteration)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'ops': ops,
+        'ops_per_sec': round(ops / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 4),
+    }
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of already sorted values.
+
+    :param sorted_values: Sorted sample.
+    :param pct: Percentile between 0 and 100.
+    :return: The percentile value.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def run_scale(scale: str, ops: int, seed: int, pooled: bool) -> List[dict]:
+    """
+    Generate the dataset of one scale and run every benchmark against it.
+
+    :param scale: Name of the scale in SCALES.
+    :param ops: Number of timed calls per benchmark.
+    :param seed: Random seed for the dataset and the workload.
+    :param pooled: Use pooled connections.
+    :return: One result per benchmark.
+    """
+    customers, transactions = SCALES[scale]
+    with tempfile.TemporaryDirectory() as directory:
+        db_connection = DatabaseConnection(os.path.join(directory, 'bench.db'), pooled=pooled)
+        try:
+            DatabaseInitializer(db_connection).initialize_db()
+            setup_started = time.perf_counter()
+            ranked_ids = generate_dataset(db_connection, customers, transactions, seed)
+            setup_seconds = time.perf_counter() - setup_started
+
+            rng = random.Random(seed + 1)
+            hot_ids = ranked_ids[:max(1, len(ranked_ids) // 100)]
+            workload = [rng.choice(hot_ids if rng.random() < 0.8 else ranked_ids) for _ in range(ops)]
+            repository = AccountRepository(db_connection)
+            opening = AccountOpening(repository)
+            amount_transaction = AmountTransaction(repository)
+            statements = GenerateStatements(repository)
+
+            def transact(iteration):
+                try:
+                    amount_transaction.make_transaction(workload[iteration], 10,
+                                                        "deposit" if iteration % 3 else "withdraw")
+                except TransactionFailedException:
+                    pass
+
+            benchmarks = {
+                'AccountOpening.create_account': lambda iteration: opening.create_account(
+                    customers + 1 + iteration, "Bench", "bench@example.com", "555-0000"),
+                'AmountTransaction.make_transaction': transact,
+                'GenerateStatements.generate_account_statement': lambda iteration:
+                    statements.generate_account_statement(workload[iteration]),
+                'AccountRepository.find_account_by_id': lambda iteration:
+                    repository.find_account_by_id(workload[iteration]),
+                'AccountRepository.find_accounts_by_customer_id': lambda iteration:
+                    repository.find_accounts_by_customer_id(workload[iteration]),
+                'AccountRepository.find_customers_by_email': lambda iteration:
+                    repository.find_customers_by_email(f"Customer{workload[iteration]}@Example.com"),
+                'AccountRepository.search_customers_by_name': lambda iteration:
+                    repository.search_customers_by_name(f"customer {workload[iteration]}", limit=20),
+            }
+            results = []
+            for name, operation in benchmarks.items():
+                result = {'scale': scale, 'customers': customers, 'transactions': transactions,
+                          'benchmark': name, 'setup_seconds': round(setup_seconds, 3)}
+                result.update(measure(operation, ops))
+                results.append(result)
+            return results
+        finally:
+            db_connection.close()
+
+
+def environment() -> dict:
+    """
+    Describe the environment a run was made in.
+
+    :return: Python, SQLite, platform and git commit information.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'commit': commit,
+    }
+
+
+def run(scales: Sequence[str], ops: int = 1000, seed: int = 42, pooled: bool = False) -> dict:
+    """
+    Run the benchmarks for several scales.
+
+    :param scales: Names of the scales in SCALES.
+    :param ops: Number of timed calls per benchmark.
+    :param seed: Random seed.
+    :param pooled: Use pooled connections.
+    :return: The report with the environment, the parameters and every result.
+    """
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        raise ValueError(f"Unknown scales: {', '.join(unknown)}")
+    report = {'environment': environment(), 'seed': seed, 'ops': ops, 'pooled': pooled, 'results': []}
+    for scale in scales:
+        report['results'].extend(run_scale(scale, ops, seed, pooled))
+    return report
+
+
+def main(argv=None) -> None:
+    """
+    Command line entry point.
+
+    :param argv: Command line arguments (defaults to sys.argv).
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', default='small', help=f"comma-separated scales: {', '.join(SCALES)}")
+    parser.add_argument('--ops', type=int, default=1000, help="timed calls per benchmark")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--pooled', action='store_true', help="use pooled connections")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.scales.split(','), ops=args.ops, seed=args.seed, pooled=args.pooled)
+    rendered = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(rendered + "\n")
+    else:
+        print(rendered)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,445 @@
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
 from sqlite3 import connect
-from typing import Tuple, Optional
+from typing import Callable, Iterable, Iterator, Tuple, Optional
+from db.metrics import QueryMetrics
 
 
 class DatabaseConnection:
-    def __init__(self, connection_string='db/local_sqldb.db'):
+    def __init__(self, connection_string='db/local_sqldb.db', pooled: bool = False, journal_mode: str = 'WAL',
+                 synchronous: str = 'NORMAL', cache_size: int = -64000, mmap_size: int = 268435456,
+                 metrics: Optional[QueryMetrics] = None, busy_retries: int = 0, busy_retry_delay: float = 0.01):
         """
         Initialize a DatabaseConnection object.
 
+        In pooled mode every thread keeps one long-lived connection which is reused by all
+        `connection()` blocks running on that thread, and the configured pragmas are applied once
+        when that connection is opened. Without pooling a fresh connection is opened and closed
+        for every outermost `connection()` block.
+
         :param connection_string: The SQLite database connection string.
+        :param pooled: Reuse one long-lived connection per thread instead of opening one per block.
+        :param journal_mode: Journal mode applied to pooled connections (WAL by default); DatabaseInitializer
+                             also stores it in the database file, so it applies to every connection.
+        :param synchronous: Value of the `synchronous` pragma applied to pooled connections.
+        :param cache_size: Value of the `cache_size` pragma applied to pooled connections
+                           (negative values are KiB, positive values are pages).
+        :param mmap_size: Value of the `mmap_size` pragma applied to pooled connections, in bytes.
+        :param metrics: Optional registry recording query latency, rows, errors, busy retries and opened connections.
+        :param busy_retries: Number of times a statement failing with "database is locked/busy" is retried, when it
+                             started its own transaction; busy errors inside an open transaction are raised.
+        :param busy_retry_delay: Delay in seconds before the first retry; it doubles with every retry.
         """
         self.connection_string = connection_string
+        self.pooled = pooled
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.metrics = metrics
+        self.busy_retries = busy_retries
+        self.busy_retry_delay = busy_retry_delay
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._pooled_connections = []
 
     def create_db_connection(self) -> connect:
         """
         Create and return a connection to the SQLite database.
 
+        The caller owns the returned connection and is responsible for closing it.
+
         :return: SQLite database connection object.
         """
         conn = sqlite3.connect(self.connection_string)
+        if self.metrics is not None:
+            self.metrics.record_connection_opened()
         return conn
 
-    @staticmethod
-    def execute_query(query: str, query_data: tuple, connection: connect) -> Tuple[Optional[list], int]:
+    @contextmanager
+    def connection(self, immediate: bool = False, durable: bool = False) -> Iterator[connect]:
+        """
+        Provide a connection for the duration of a `with` block.
+
+        The outermost block on a thread commits when it exits normally and rolls back when it exits
+        with an exception. Blocks nested inside it on the same thread reuse the same connection and
+        leave commit/rollback to the outermost block, so a repository call made inside a service
+        level block joins that block's transaction.
+
+        :param immediate: Take the database write lock up front (BEGIN IMMEDIATE) in the outermost
+                          block, for read-then-write work that must not race other writers.
+        :param durable: Commit with `synchronous=FULL`, so the commit is on stable storage once the block
+                        exits, whatever `synchronous` level the connection runs with otherwise.
+        :return: SQLite database connection object.
+        :raises RuntimeError: If a durable block is nested in another block, whose commit it cannot control.
+        """
+        active = getattr(self._local, 'active', None)
+        if active is not None:
+            if durable:
+                raise RuntimeError("A durable block cannot be nested in another connection block.")
+            yield active
+            return
+
+        conn = self._acquire_connection()
+        self._local.active = conn
+        self._local.commit_callbacks = []
+        try:
+            if durable:
+                # The safety level cannot change inside a transaction, so it is raised before the block starts.
+                conn.execute("PRAGMA synchronous=FULL")
+            if immediate and not conn.in_transaction:
+                self._begin_immediate(conn)
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            for callback in self._local.commit_callbacks:
+                callback()
+        finally:
+            self._local.active = None
+            self._local.commit_callbacks = []
+            if not self.pooled:
+                conn.close()
+            elif durable and self.synchronous:
+                conn.execute(f"PRAGMA synchronous={self.synchronous}")
+
+    def _begin_immediate(self, conn: connect) -> None:
+        """
+        Start a write transaction, retrying while the database is busy; nothing is held yet, so retries are safe.
+
+        :param conn: SQLite database connection object without an open transaction.
+        :return: None
+        :raises RuntimeError: If the write lock cannot be taken; the sqlite3 error is chained.
+        """
+        def run():
+            conn.execute("BEGIN IMMEDIATE")
+            return [], 0
+
+        self._execute("BEGIN IMMEDIATE", run, conn)
+
+    def in_transaction(self) -> bool:
+        """
+        Tell whether a `connection()` block is active on the current thread.
+
+        :return: True inside a block, whose outermost level decides on commit or rollback.
+        """
+        return getattr(self._local, 'active', None) is not None
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """
+        Run a callback once the current thread's outermost `connection()` block has committed.
+
+        Callbacks registered outside of a block run immediately; those of a block that rolls back are
+        dropped.
+
+        :param callback: Function called without arguments.
+        :return: None
+        """
+        if getattr(self._local, 'active', None) is None:
+            callback()
+        else:
+            self._local.commit_callbacks.append(callback)
+
+    def create_read_only_connection(self) -> connect:
+        """
+        Create and return a read-only connection to the SQLite database (`mode=ro` URI).
+
+        The caller owns the returned connection and is responsible for closing it.
+
+        :return: SQLite database connection object.
+        """
+        conn = sqlite3.connect(f"{Path(self.connection_string).resolve().as_uri()}?mode=ro", uri=True)
+        if self.metrics is not None:
+            self.metrics.record_connection_opened()
+        return conn
+
+    @contextmanager
+    def snapshot(self) -> Iterator[connect]:
+        """
+        Provide a read-only connection holding one point-in-time view of the database for a `with` block.
+
+        Every query of the block, including those made through `connection()` and `read_connection()` on the
+        same thread, runs on that connection and sees the database as of the block's first read, however
+        many queries it takes. Writes inside the block fail. In WAL mode the snapshot neither waits for
+        writers nor blocks them; DatabaseInitializer stores the configured journal mode in the database file,
+        so this holds for non-pooled connections too. In rollback-journal mode the snapshot holds a shared
+        lock and writers wait until it ends. A block nested in a `connection()` or `snapshot()` block reuses its
+        connection.
+
+        :return: SQLite database connection object.
+        """
+        active = getattr(self._local, 'active', None)
+        if active is not None:
+            yield active
+            return
+
+        conn = self.create_read_only_connection()
+        self._local.active = conn
+        self._local.commit_callbacks = []
+        self._local.snapshot = True
+        try:
+            conn.execute("BEGIN")
+            # The read transaction, and with it the snapshot, starts with the first read.
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            yield conn
+        finally:
+            self._local.active = None
+            self._local.commit_callbacks = []
+            self._local.snapshot = False
+            conn.rollback()
+            conn.close()
+
+    def in_snapshot(self) -> bool:
+        """
+        Tell whether a `snapshot()` block is active on the current thread.
+
+        :return: True inside a snapshot block.
+        """
+        return getattr(self._local, 'snapshot', False)
+
+    def backup(self, target_path: str) -> None:
+        """
+        Copy the database into a detached file with the SQLite online backup API, e.g. for reporting.
+
+        The copy is made in a single step from a read-only connection. A step-by-step backup restarts
+        whenever another connection writes, so it may never finish while the database is busy; the single
+        step reads one consistent snapshot instead, and in WAL mode it does not block writers. Queries against
+        the copy do not touch this database at all.
+
+        :param target_path: Path of the copy; an existing file is overwritten.
+        :return: None
+        :raises RuntimeError: If the backup fails.
+        """
+        source = self.create_read_only_connection()
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        except sqlite3.Error as e:
+            raise RuntimeError(f"Could not back up the database: {e}") from e
+        finally:
+            target.close()
+            source.close()
+
+    @contextmanager
+    def read_connection(self) -> Iterator[connect]:
+        """
+        Provide a connection for a read that may stay open while suspended, e.g. inside a generator.
+
+        Inside an active `connection()` block on the same thread that block's connection is reused,
+        so uncommitted writes stay visible. Otherwise a dedicated read-only (`mode=ro`) connection is
+        opened and closed when the block exits, and it is never handed to other blocks on the thread.
+
+        :return: SQLite database connection object.
+        """
+        active = getattr(self._local, 'active', None)
+        if active is not None:
+            yield active
+            return
+
+        conn = self.create_read_only_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        """
+        Close every pooled connection opened by this object, on any thread.
+
+        :return: None
+        """
+        with self._pool_lock:
+            connections, self._pooled_connections = self._pooled_connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def _acquire_connection(self) -> connect:
+        """
+        Return the calling thread's pooled connection, opening it if needed, or a fresh
+        connection when pooling is disabled.
+
+        :return: SQLite database connection object.
+        """
+        if not self.pooled:
+            return self.create_db_connection()
+
+        conn = getattr(self._local, 'pooled', None)
+        if conn is None:
+            # Pooled connections are only ever used by the thread that opened them, but close()
+            # may run on another thread, hence check_same_thread=False.
+            conn = sqlite3.connect(self.connection_string, check_same_thread=False)
+            if self.metrics is not None:
+                self.metrics.record_connection_opened()
+            self._apply_pragmas(conn)
+            self._local.pooled = conn
+            with self._pool_lock:
+                self._pooled_connections.append(conn)
+        return conn
+
+    def _apply_pragmas(self, conn: connect) -> None:
+        """
+        Apply the configured pragmas to a newly opened pooled connection.
+
+        :param conn: SQLite database connection object.
+        :return: None
+        """
+        if self.journal_mode:
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        if self.synchronous:
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        if self.cache_size is not None:
+            conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        if self.mmap_size is not None:
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+
+    def execute_query(self, query: str, query_data: tuple, connection: connect,
+                      row_factory: Optional[Callable] = None) -> Tuple[Optional[list], int]:
         """
         Execute an SQL query with provided data on the given connection.
 
         :param query: SQL query string.
         :param query_data: Data to be used in the query.
         :param connection: SQLite database connection object.
+        :param row_factory: Optional sqlite3 row factory mapping each result row, e.g. into a domain object.
         :return: A tuple containing the result rows and the last inserted row ID.
                  Returns (None, last_row_id) if no result rows.
-        :raises RuntimeError: If an error occurs during query execution.
+        :raises RuntimeError: If an error occurs during query execution; the sqlite3 error is chained.
         """
-        try:
+        def run():
             cursor = connection.cursor()
+            if row_factory is not None:
+                cursor.row_factory = row_factory
             cursor.execute(query, query_data)
-            last_row_id = cursor.lastrowid
-            rows = cursor.fetchall()
-            if rows:
-                return rows, last_row_id
-            return None, last_row_id
+            return cursor.fetchall(), cursor.lastrowid
+
+        rows, last_row_id = self._execute(query, run, connection)
+        if rows:
+            return rows, last_row_id
+        return None, last_row_id
+
+    def execute_many(self, query: str, query_data: Iterable[tuple], connection: connect) -> int:
+        """
+        Execute an SQL statement once for every parameter tuple on the given connection.
+
+        :param query: SQL query string.
+        :param query_data: Iterable of parameter tuples. Busy retries need to replay it, so pass a sequence
+                           rather than a one-shot iterator when `busy_retries` is set.
+        :param connection: SQLite database connection object.
+        :return: The number of rows modified.
+        :raises RuntimeError: If an error occurs during query execution; the sqlite3 error is chained.
+        """
+        def run():
+            cursor = connection.cursor()
+            cursor.executemany(query, query_data)
+            return [], cursor.rowcount
+
+        _, row_count = self._execute(query, run, connection)
+        return row_count
+
+    def iter_query(self, query: str, query_data: tuple, connection: connect,
+                   fetch_size: int = 1000) -> Iterator[list]:
+        """
+        Execute an SQL query on the given connection and stream its result rows in batches.
+
+        The statement is recorded in the metrics registry once the stream ends, fails or is closed, with the
+        time spent in SQLite, not counting the caller's work between batches, and the rows fetched. Rows
+        already handed out cannot be taken back, so busy errors are raised rather than retried.
+
+        :param query: SQL query string.
+        :param query_data: Data to be used in the query.
+        :param connection: SQLite database connection object.
+        :param fetch_size: Number of rows fetched from the cursor at a time.
+        :return: Iterator of row lists holding up to `fetch_size` rows each.
+        :raises RuntimeError: If an error occurs during query execution; the sqlite3 error is chained.
+        """
+        seconds = 0.0
+        rows = 0
+        error = None
+        started = time.perf_counter()
+        try:
+            cursor = connection.execute(query, query_data)
+            batch = cursor.fetchmany(fetch_size)
+            while batch:
+                seconds += time.perf_counter() - started
+                started = None
+                rows += len(batch)
+                yield batch
+                started = time.perf_counter()
+                batch = cursor.fetchmany(fetch_size)
+        except sqlite3.Error as e:
+            error = str(e)
+            raise RuntimeError(f"Could not execute query: {e}") from e
+        finally:
+            if started is not None:
+                seconds += time.perf_counter() - started
+            if self.metrics is not None:
+                self.metrics.record_query(query, seconds, rows, error)
+
+    def _execute(self, query: str, run: Callable[[], Tuple[list, int]], connection: connect) -> Tuple[list, int]:
+        """
+        Run a statement, retrying while the database is busy and recording it in the metrics registry.
+
+        Only a statement that starts its own transaction is retried, after rolling that transaction back.
+        Inside a transaction opened before it, a busy error (a lock upgrade or a stale WAL snapshot) only
+        clears once the whole transaction is rolled back, so it is raised for the outermost block to handle.
+
+        :param query: SQL query string, used as the metrics key.
+        :param run: Function executing the statement and returning (rows, last_row_id or row count).
+        :param connection: The connection `run` executes on.
+        :return: The value returned by `run`.
+        :raises RuntimeError: If the statement fails.
+        """
+        started = time.perf_counter()
+        error = None
+        rows = []
+        attempt = 0
+        in_transaction = connection.in_transaction
+        try:
+            while True:
+                try:
+                    rows, value = run()
+                    return rows, value
+                except sqlite3.OperationalError as e:
+                    if attempt >= self.busy_retries or in_transaction or not self._is_busy_error(e):
+                        raise
+                    if connection.in_transaction:
+                        connection.rollback()
+                    self._wait_before_retry(attempt)
+                    attempt += 1
         except sqlite3.IntegrityError as e:
-            raise RuntimeError("Could not execute query due to IntegrityError")
+            error = str(e)
+            raise RuntimeError(f"Could not execute query due to IntegrityError: {e}") from e
         except sqlite3.Error as e:
-            raise RuntimeError("Could not execute query")
-        
+            error = str(e)
+            raise RuntimeError(f"Could not execute query: {e}") from e
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_query(query, time.perf_counter() - started, len(rows), error)
+
+    def _wait_before_retry(self, attempt: int) -> None:
+        """
+        Record a busy retry and sleep with exponential backoff.
+
+        :param attempt: Number of retries made so far.
+        :return: None
+        """
+        if self.metrics is not None:
+            self.metrics.record_busy_retry()
+        time.sleep(self.busy_retry_delay * 2 ** attempt)
+
+    @staticmethod
+    def _is_busy_error(error: sqlite3.OperationalError) -> bool:
+        """
+        Tell whether an operational error means another connection holds a conflicting lock.
+
+        :param error: The sqlite3 error.
+        :return: True for "database is locked" and "database is busy" errors.
+        """
+        message = str(error).lower()
+        return "locked" in message or "busy" in message
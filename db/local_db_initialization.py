@@ -1,55 +1,92 @@
+import logging
+from typing import Optional
 from db.db_client import DatabaseConnection
+from db.migrations import MIGRATIONS, LATEST_VERSION, split_statements
+from db.sharding import ShardedDatabase, SHARD_ID_SPAN, SHARD_ACCOUNT_NUMBER_SPAN, FIRST_ACCOUNT_NUMBER
 
 
 class DatabaseInitializer:
-    def __init__(self) -> None:
+    def __init__(self, db_connection: Optional[DatabaseConnection] = None) -> None:
         """
         Initialize a DatabaseInitializer object.
         The DatabaseInitializer is responsible for initializing the database schema.
+        :param db_connection: The database to initialize (defaults to the local SQLite database).
         :return: None
         """
-        self.db_connection = DatabaseConnection()
+        self.db_connection = db_connection or DatabaseConnection()
 
     def initialize_db(self) -> None:
         """
         Initialize the database schema.
-        This method creates tables in the database if they do not already exist.
+        This method applies every migration newer than the schema version recorded in
+        PRAGMA user_version, each one in its own transaction together with its version bump.
+        When the schema is already current it only reads the version and returns.
+        The connection's journal mode is stored in the database file first, so that WAL mode, which lets
+        snapshots and writers run side by side, applies to every connection and not only to pooled ones.
         :return: None
         """
-        connection = self.db_connection.create_db_connection()
-
-        # Create a cursor object to execute SQL queries
-        cursor = connection.cursor()
-
-        # Define the table schema
-        create_table_query = '''
-        CREATE TABLE IF NOT EXISTS Customers (
-            customer_id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            email TEXT NOT NULL,
-            phone_number TEXT NOT NULL
-        );
-
-        CREATE TABLE IF NOT EXISTS Accounts (
-            account_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            customer_id INTEGER NOT NULL,
-            account_number TEXT NOT NULL,
-            balance REAL DEFAULT 0,
-            FOREIGN KEY (customer_id) REFERENCES Customers(customer_id)
-        );
-
-        CREATE TABLE IF NOT EXISTS Transactions (
-            transaction_id INTEGER PRIMARY KEY,
-            account_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            transaction_type TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (account_id) REFERENCES Accounts(account_id)
-        );
-        '''
-
-        # Execute the query to create tables
-        cursor.executescript(create_table_query)
-        # Commit the changes and close the connection
-        connection.commit()
-        connection.close()
+        if self.db_connection.journal_mode:
+            with self.db_connection.connection() as connection:
+                connection.execute(f"PRAGMA journal_mode={self.db_connection.journal_mode}")
+        if self.get_schema_version() >= LATEST_VERSION:
+            return
+
+        for version, description, step in MIGRATIONS:
+            with self.db_connection.connection(immediate=True) as connection:
+                # Re-check under the write lock in case another process migrated concurrently.
+                if self._read_version(connection) >= version:
+                    continue
+                if callable(step):
+                    step(connection)
+                else:
+                    for statement in split_statements(step):
+                        connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {int(version)}")
+            logging.info(f"Applied migration {version}: {description}")
+
+    def get_schema_version(self) -> int:
+        """
+        Get the schema version recorded in the database.
+        :return: The current PRAGMA user_version value.
+        """
+        with self.db_connection.connection() as connection:
+            return self._read_version(connection)
+
+    @staticmethod
+    def _read_version(connection) -> int:
+        """
+        Read PRAGMA user_version on the given connection.
+        :param connection: SQLite database connection object.
+        :return: The current schema version.
+        """
+        return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+class ShardedDatabaseInitializer:
+    def __init__(self, sharded_database: ShardedDatabase) -> None:
+        """
+        Initialize a ShardedDatabaseInitializer object.
+        The ShardedDatabaseInitializer creates and migrates every shard of a sharded database.
+        :param sharded_database: The sharded database to initialize.
+        :return: None
+        """
+        self.sharded_database = sharded_database
+
+    def initialize_db(self) -> None:
+        """
+        Initialize the schema of every shard.
+        Each shard is migrated like a single database, then its account ID and account number
+        sequences are moved into the shard's own range unless they are already past its start.
+        :return: None
+        """
+        for shard, db_connection in enumerate(self.sharded_database.shards):
+            DatabaseInitializer(db_connection).initialize_db()
+            with db_connection.connection(immediate=True) as connection:
+                first_id = shard * SHARD_ID_SPAN
+                connection.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'Accounts', ? WHERE NOT EXISTS "
+                                   "(SELECT 1 FROM sqlite_sequence WHERE name = 'Accounts')", (first_id,))
+                connection.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'Accounts' AND seq < ?",
+                                   (first_id, first_id))
+                first_number = FIRST_ACCOUNT_NUMBER + shard * SHARD_ACCOUNT_NUMBER_SPAN
+                connection.execute("UPDATE AccountNumberSequence SET next_value = ? WHERE id = 1 AND next_value < ?",
+                                   (first_number, first_number))
@@ -0,0 +1,189 @@
+import bisect
+import json
+import logging
+import re
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds, in seconds, of the statement latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\?(\s*,\s*\?)+")
+
+
+def normalize_statement(query: str) -> str:
+    """
+    Reduce an SQL statement to the key its metrics are recorded under.
+
+    Whitespace is collapsed and placeholder lists such as "IN (?,?,?)" are folded, so statements that
+    only differ in the number of bound IDs share one series.
+
+    :param query: SQL query string.
+    :return: The normalized statement.
+    """
+    return _PLACEHOLDER_LIST.sub("?, ...", _WHITESPACE.sub(" ", query).strip())
+
+
+class QueryMetrics:
+    def __init__(self, slow_query_threshold: Optional[float] = 0.1, slow_query_log_size: int = 100) -> None:
+        """
+        Initialize a QueryMetrics object.
+
+        The QueryMetrics registry collects what DatabaseConnection observes: per-statement latency
+        histograms, rows returned, errors, busy retries and opened connections. Statements slower than
+        the threshold are logged and kept in a bounded slow-query log. Hooks registered with `add_hook`
+        receive every query event, e.g. to forward it to another metrics system.
+
+        :param slow_query_threshold: Duration in seconds above which a statement counts as slow (None disables it).
+        :param slow_query_log_size: Number of most recent slow queries kept.
+        :return: None
+        """
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_queries = deque(maxlen=slow_query_log_size)
+        self.slow_query_count = 0
+        self.busy_retries = 0
+        self.connections_opened = 0
+        self._statements: Dict[str, dict] = {}
+        self._hooks: List[Callable[[dict], None]] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        """
+        Register a function called with every query event.
+
+        Events are dicts with the `statement`, `duration`, `rows` and `error` keys.
+
+        :param hook: Function receiving the event.
+        :return: None
+        """
+        self._hooks.append(hook)
+
+    def record_query(self, query: str, duration: float, rows: int = 0, error: Optional[str] = None) -> None:
+        """
+        Record one executed statement.
+
+        :param query: SQL query string.
+        :param duration: Execution time in seconds, including lock waits and retries.
+        :param rows: Number of rows returned.
+        :param error: Error message if the statement failed.
+        :return: None
+        """
+        statement = normalize_statement(query)
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                stats = self._statements[statement] = {
+                    'count': 0, 'errors': 0, 'rows': 0, 'seconds': 0.0,
+                    'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            stats['count'] += 1
+            stats['rows'] += rows
+            stats['seconds'] += duration
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+            if error is not None:
+                stats['errors'] += 1
+            slow = self.slow_query_threshold is not None and duration >= self.slow_query_threshold
+            if slow:
+                self.slow_query_count += 1
+                self.slow_queries.append({'statement': statement, 'duration': duration, 'rows': rows})
+        if slow:
+            logging.warning(f"Slow query ({duration * 1000:.1f} ms): {statement}")
+        event = {'statement': statement, 'duration': duration, 'rows': rows, 'error': error}
+        for hook in self._hooks:
+            hook(event)
+
+    def record_busy_retry(self) -> None:
+        """
+        Record a statement retried because the database was locked or busy.
+
+        :return: None
+        """
+        with self._lock:
+            self.busy_retries += 1
+
+    def record_connection_opened(self) -> None:
+        """
+        Record a newly opened database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self.connections_opened += 1
+
+    def to_dict(self) -> dict:
+        """
+        Snapshot every metric as plain data.
+
+        :return: A dict with per-statement statistics, counters and the slow-query log.
+        """
+        with self._lock:
+            statements = {}
+            for statement, stats in self._statements.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), stats['buckets']):
+                    cumulative += count
+                    buckets["+Inf" if bound == float("inf") else repr(bound)] = cumulative
+                statements[statement] = {
+                    'count': stats['count'], 'errors': stats['errors'], 'rows': stats['rows'],
+                    'seconds': stats['seconds'], 'buckets': buckets,
+                }
+            return {
+                'statements': statements,
+                'busy_retries': self.busy_retries,
+                'connections_opened': self.connections_opened,
+                'slow_query_count': self.slow_query_count,
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def to_json(self) -> str:
+        """
+        Export every metric as JSON.
+
+        :return: JSON document of `to_dict`.
+        """
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix: str = "banking_db") -> str:
+        """
+        Export every metric in the Prometheus text exposition format.
+
+        :param prefix: Prefix of the metric names.
+        :return: The exposition text.
+        """
+        snapshot = self.to_dict()
+        lines = [
+            f"# HELP {prefix}_query_duration_seconds SQL statement execution time.",
+            f"# TYPE {prefix}_query_duration_seconds histogram",
+        ]
+        for statement, stats in snapshot['statements'].items():
+            label = f'statement="{_escape_label(statement)}"'
+            for bound, count in stats['buckets'].items():
+                lines.append(f'{prefix}_query_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"{prefix}_query_duration_seconds_sum{{{label}}} {stats['seconds']}")
+            lines.append(f"{prefix}_query_duration_seconds_count{{{label}}} {stats['count']}")
+        for name, key, help_text in (("query_rows_total", 'rows', "Rows returned by SQL statements."),
+                                     ("query_errors_total", 'errors', "SQL statements that failed.")):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for statement, stats in snapshot['statements'].items():
+                lines.append(f'{prefix}_{name}{{statement="{_escape_label(statement)}"}} {stats[key]}')
+        for name, value, help_text in (
+                ("busy_retries_total", snapshot['busy_retries'], "Statements retried because the database was busy."),
+                ("connections_opened_total", snapshot['connections_opened'], "Database connections opened."),
+                ("slow_queries_total", snapshot['slow_query_count'], "SQL statements slower than the threshold.")):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.append(f"{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    """
+    Escape a Prometheus label value.
+
+    :param value: Raw label value.
+    :return: The escaped value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
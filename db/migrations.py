@@ -0,0 +1,236 @@
+import re
+from sqlite3 import complete_statement, connect
+from typing import Callable, Iterator, List, Tuple, Union
+
+# A migration step is either an SQL script or a callable receiving the open connection.
+MigrationStep = Union[str, Callable[[connect], None]]
+
+
+def _customer_lookup_keys(name: str, phone_number: str, email: str) -> Tuple[str, str, str]:
+    """
+    Compute the lookup keys of a customer as Customer.lookup_keys() did when migration 10 was released.
+
+    Kept here rather than imported so the migration does not change if the domain normalization does.
+
+    :param name: Name of the customer.
+    :param phone_number: Phone number of the customer.
+    :param email: Email address of the customer.
+    :return: (email_key, phone_key, name_key).
+    """
+    return (str(email).strip().casefold(), re.sub(r"[^0-9]", "", str(phone_number)),
+            " ".join(str(name).split()).casefold())
+
+
+def add_customer_lookup_keys(connection: connect) -> None:
+    """
+    Add the normalized email, phone and name keys of customers, fill them in and index them.
+
+    The keys are computed in Python, like on every insert, so existing and new rows are normalized alike.
+
+    :param connection: SQLite database connection object.
+    :return: None
+    """
+    for column in ("email_key", "phone_key", "name_key"):
+        connection.execute(f"ALTER TABLE Customers ADD COLUMN {column} TEXT")
+    # Paged by customer_id rather than streamed, since the rows are updated while being read.
+    query = "SELECT customer_id, name, phone_number, email FROM Customers {} ORDER BY customer_id LIMIT 10000"
+    rows = connection.execute(query.format("")).fetchall()
+    while rows:
+        connection.executemany(
+            "UPDATE Customers SET email_key = ?, phone_key = ?, name_key = ? WHERE customer_id = ?",
+            [_customer_lookup_keys(*row[1:]) + (row[0],) for row in rows])
+        rows = connection.execute(query.format("WHERE customer_id > ?"), (rows[-1][0],)).fetchall()
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_customers_email_key ON Customers(email_key)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_customers_phone_key ON Customers(phone_key)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_customers_name_key ON Customers(name_key, customer_id)")
+
+
+# Ordered schema migrations as (version, description, step). Versions are stored in
+# PRAGMA user_version; append new migrations with the next version and never edit released ones.
+MIGRATIONS: List[Tuple[int, str, MigrationStep]] = [
+    (1, "Create Customers, Accounts and Transactions tables", '''
+        CREATE TABLE IF NOT EXISTS Customers (
+            customer_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            phone_number TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS Accounts (
+            account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            account_number TEXT NOT NULL,
+            balance REAL DEFAULT 0,
+            FOREIGN KEY (customer_id) REFERENCES Customers(customer_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS Transactions (
+            transaction_id INTEGER PRIMARY KEY,
+            account_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            transaction_type TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (account_id) REFERENCES Accounts(account_id)
+        );
+    '''),
+    (2, "Index account lookups by customer and statements by account and time", '''
+        CREATE INDEX IF NOT EXISTS idx_accounts_customer_id ON Accounts(customer_id);
+        CREATE INDEX IF NOT EXISTS idx_transactions_account_timestamp ON Transactions(account_id, timestamp);
+    '''),
+    (3, "Index transactions by account in transaction_id order for keyset pagination", '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_account_id ON Transactions(account_id);
+    '''),
+    (4, "Add per-account daily closing balance checkpoints", '''
+        CREATE TABLE IF NOT EXISTS BalanceCheckpoints (
+            account_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (account_id, day),
+            FOREIGN KEY (account_id) REFERENCES Accounts(account_id)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON Transactions(timestamp);
+    '''),
+    (5, "Add the account number sequence", '''
+        CREATE TABLE IF NOT EXISTS AccountNumberSequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_value INTEGER NOT NULL
+        );
+
+        -- Starts above the timestamp based numbers issued before the sequence existed.
+        INSERT OR IGNORE INTO AccountNumberSequence (id, next_value) VALUES (1, 100000000000000000);
+    '''),
+    (6, "Track the last ledger WAL sequence checkpointed by the in-memory ledger engine", '''
+        CREATE TABLE IF NOT EXISTS LedgerCheckpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_sequence INTEGER NOT NULL
+        );
+
+        INSERT OR IGNORE INTO LedgerCheckpoint (id, last_sequence) VALUES (1, 0);
+    '''),
+    (7, "Maintain per-account and bank-wide daily activity totals", '''
+        CREATE TABLE IF NOT EXISTS DailyAccountActivity (
+            account_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            deposit_count INTEGER NOT NULL DEFAULT 0,
+            deposit_sum REAL NOT NULL DEFAULT 0,
+            withdrawal_count INTEGER NOT NULL DEFAULT 0,
+            withdrawal_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, day),
+            FOREIGN KEY (account_id) REFERENCES Accounts(account_id)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_daily_account_activity_day ON DailyAccountActivity(day);
+
+        CREATE TABLE IF NOT EXISTS DailyActivity (
+            day DATE PRIMARY KEY,
+            deposit_count INTEGER NOT NULL DEFAULT 0,
+            deposit_sum REAL NOT NULL DEFAULT 0,
+            withdrawal_count INTEGER NOT NULL DEFAULT 0,
+            withdrawal_sum REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+
+        -- Catch up with the existing ledger; the trigger below keeps the totals current afterwards.
+        INSERT OR REPLACE INTO DailyAccountActivity
+            (account_id, day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum)
+        SELECT account_id, date(timestamp),
+               SUM(transaction_type = 'deposit'), TOTAL(CASE WHEN transaction_type = 'deposit' THEN amount END),
+               SUM(transaction_type <> 'deposit'), TOTAL(CASE WHEN transaction_type <> 'deposit' THEN amount END)
+        FROM Transactions GROUP BY account_id, date(timestamp);
+
+        INSERT OR REPLACE INTO DailyActivity (day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum)
+        SELECT day, SUM(deposit_count), SUM(deposit_sum), SUM(withdrawal_count), SUM(withdrawal_sum)
+        FROM DailyAccountActivity GROUP BY day;
+
+        -- Runs inside the statement inserting the ledger row, so the totals commit or roll back with it.
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_daily_activity AFTER INSERT ON Transactions
+        BEGIN
+            INSERT INTO DailyAccountActivity
+                (account_id, day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum)
+            VALUES (NEW.account_id, date(NEW.timestamp),
+                    NEW.transaction_type = 'deposit',
+                    CASE WHEN NEW.transaction_type = 'deposit' THEN NEW.amount ELSE 0 END,
+                    NEW.transaction_type <> 'deposit',
+                    CASE WHEN NEW.transaction_type <> 'deposit' THEN NEW.amount ELSE 0 END)
+            ON CONFLICT (account_id, day) DO UPDATE SET
+                deposit_count = deposit_count + excluded.deposit_count,
+                deposit_sum = deposit_sum + excluded.deposit_sum,
+                withdrawal_count = withdrawal_count + excluded.withdrawal_count,
+                withdrawal_sum = withdrawal_sum + excluded.withdrawal_sum;
+
+            INSERT INTO DailyActivity (day, deposit_count, deposit_sum, withdrawal_count, withdrawal_sum)
+            VALUES (date(NEW.timestamp),
+                    NEW.transaction_type = 'deposit',
+                    CASE WHEN NEW.transaction_type = 'deposit' THEN NEW.amount ELSE 0 END,
+                    NEW.transaction_type <> 'deposit',
+                    CASE WHEN NEW.transaction_type <> 'deposit' THEN NEW.amount ELSE 0 END)
+            ON CONFLICT (day) DO UPDATE SET
+                deposit_count = deposit_count + excluded.deposit_count,
+                deposit_sum = deposit_sum + excluded.deposit_sum,
+                withdrawal_count = withdrawal_count + excluded.withdrawal_count,
+                withdrawal_sum = withdrawal_sum + excluded.withdrawal_sum;
+        END;
+    '''),
+    (8, "Register archived transaction segments and the per-account totals they hold", '''
+        CREATE TABLE IF NOT EXISTS ArchiveSegments (
+            name TEXT PRIMARY KEY,
+            period TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            min_timestamp DATETIME NOT NULL,
+            max_timestamp DATETIME NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS ArchivedTotals (
+            account_id INTEGER PRIMARY KEY,
+            amount REAL NOT NULL
+        );
+    '''),
+    (9, "Record idempotency keys and resulting balances of client transactions", '''
+        ALTER TABLE Transactions ADD COLUMN idempotency_key TEXT;
+        ALTER TABLE Transactions ADD COLUMN balance_after REAL;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_idempotency_key
+            ON Transactions(idempotency_key) WHERE idempotency_key IS NOT NULL;
+    '''),
+    (10, "Index customers by normalized email, phone and name", add_customer_lookup_keys),
+    (11, "Keep the idempotency keys of archived transactions", '''
+        CREATE TABLE IF NOT EXISTS ArchivedIdempotencyKeys (
+            idempotency_key TEXT PRIMARY KEY,
+            account_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            transaction_type TEXT NOT NULL,
+            balance_after REAL
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_archived_idempotency_key
+        BEFORE INSERT ON Transactions
+        WHEN NEW.idempotency_key IS NOT NULL
+            AND EXISTS (SELECT 1 FROM ArchivedIdempotencyKeys WHERE idempotency_key = NEW.idempotency_key)
+        BEGIN
+            SELECT RAISE(ABORT, 'UNIQUE constraint failed: Transactions.idempotency_key');
+        END;
+    '''),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def split_statements(script: str) -> Iterator[str]:
+    """
+    Split an SQL script into complete statements.
+
+    Unlike `executescript`, running the statements one by one does not commit the surrounding
+    transaction, so a migration and its version bump are applied atomically.
+
+    :param script: SQL script containing one or more statements.
+    :return: Iterator over the complete statements of the script.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if complete_statement(statement):
+            yield statement.strip()
+            statement = ""
+    if statement.strip():
+        yield statement.strip()
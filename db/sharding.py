@@ -0,0 +1,82 @@
+from typing import List, Sequence
+from db.db_client import DatabaseConnection
+
+# Shard N hands out account IDs from N * SHARD_ID_SPAN + 1 upwards, so the owning shard of any
+# account can be computed from its ID. Shard 0 keeps the IDs of an existing single-file database.
+SHARD_ID_SPAN = 2 ** 40
+# Shard N hands out account numbers from its own block of the account number sequence.
+SHARD_ACCOUNT_NUMBER_SPAN = 10 ** 15
+FIRST_ACCOUNT_NUMBER = 100000000000000000
+
+
+class ShardedDatabase:
+    def __init__(self, connection_strings: Sequence[str], **connection_options) -> None:
+        """
+        Initialize a ShardedDatabase object.
+
+        The ShardedDatabase spreads the data over several SQLite files, each with its own writer lock.
+        Customers, and their accounts, are hash-partitioned by customer_id, while each shard allocates
+        account IDs from its own range, so both kinds of lookup route to a single shard.
+
+        :param connection_strings: One SQLite connection string per shard; the order defines the shard numbers.
+        :param connection_options: Keyword arguments passed to every shard's DatabaseConnection.
+        :return: None
+        """
+        if not connection_strings:
+            raise ValueError("A sharded database needs at least one shard.")
+        if len(connection_strings) * SHARD_ACCOUNT_NUMBER_SPAN > 10 ** 18 - FIRST_ACCOUNT_NUMBER:
+            raise ValueError("Too many shards.")
+        self.shards: List[DatabaseConnection] = [
+            DatabaseConnection(connection_string, **connection_options) for connection_string in connection_strings]
+
+    @classmethod
+    def from_pattern(cls, pattern: str = 'db/local_sqldb_{shard}.db', shard_count: int = 4,
+                     **connection_options) -> "ShardedDatabase":
+        """
+        Create a sharded database whose files are named after a pattern.
+
+        :param pattern: Connection string pattern with a `{shard}` placeholder.
+        :param shard_count: Number of shards.
+        :param connection_options: Keyword arguments passed to every shard's DatabaseConnection.
+        :return: The sharded database.
+        """
+        return cls([pattern.format(shard=shard) for shard in range(shard_count)], **connection_options)
+
+    def __len__(self) -> int:
+        """
+        Get the number of shards.
+
+        :return: The number of shards.
+        """
+        return len(self.shards)
+
+    def shard_for_account_id(self, account_id: int) -> int:
+        """
+        Get the shard owning an account.
+
+        :param account_id: The ID of the account.
+        :return: The shard number.
+        :raises ValueError: If the ID does not belong to any shard.
+        """
+        shard = account_id // SHARD_ID_SPAN if isinstance(account_id, int) else -1
+        if not 0 <= shard < len(self.shards):
+            raise ValueError("Account not found for given account id.")
+        return shard
+
+    def shard_for_customer_id(self, customer_id: int) -> int:
+        """
+        Get the shard holding a customer and the accounts opened for them.
+
+        :param customer_id: The ID of the customer.
+        :return: The shard number.
+        """
+        return customer_id % len(self.shards)
+
+    def close(self) -> None:
+        """
+        Close the pooled connections of every shard.
+
+        :return: None
+        """
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,48 @@
+"""
+Reconcile stored account balances against the ledger.
+
+Sums the signed ledger amounts of every account with vectorized NumPy grouping, chunk by chunk, and reports
+the accounts whose stored balance differs. Exits with status 1 when any account does not reconcile:
+
+    python reconcile_ledger.py --db db/local_sqldb.db --output reconciliation.json
+"""
+import argparse
+import json
+import sys
+from db.db_client import DatabaseConnection
+from Infrastructure.account_repository import AccountRepository
+from Service import LedgerReconciliation
+
+
+def main(argv=None) -> int:
+    """
+    Command line entry point.
+
+    :param argv: Command line arguments (defaults to sys.argv).
+    :return: The exit status: 0 if every account reconciles, 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--db', default='db/local_sqldb.db', help="SQLite database to reconcile")
+    parser.add_argument('--chunk-size', type=int, default=1000000, help="ledger rows loaded at a time")
+    parser.add_argument('--tolerance', type=float, default=0.005, help="absolute difference ignored")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    repository = AccountRepository(DatabaseConnection(args.db))
+    report = LedgerReconciliation(repository, chunk_size=args.chunk_size, tolerance=args.tolerance).run()
+    rendered = json.dumps({
+        'accounts': report.accounts,
+        'transactions': report.transactions,
+        'mismatches': [{'account_id': account_id, 'stored_balance': stored, 'ledger_balance': ledger}
+                       for account_id, stored, ledger in report.mismatches],
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(rendered + "\n")
+    else:
+        print(rendered)
+    return 1 if report.mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,46 @@
+import asyncio
+import csv
+import io
 import os
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 import json
 from unittest.mock import Mock, patch
 from datetime import datetime
 from db.db_client import DatabaseConnection
-from Domain.account import Account
+from db.local_db_initialization import DatabaseInitializer, ShardedDatabaseInitializer
+from db.migrations import LATEST_VERSION, MIGRATIONS
+from db.metrics import QueryMetrics, normalize_statement
+from db.sharding import ShardedDatabase
+from Domain.account import Account, AccountBatch
 from Domain.customer import Customer
-from Infrastructure.account_repository import AccountRepository
-from Service import AmountTransaction, AccountOpening, GenerateStatements, TransactionFailedException
+from Infrastructure.account_repository import AccountRepository, ACCOUNT_COLUMNS
+from Infrastructure.account_cache import AccountCache
+from Infrastructure.idempotency import IdempotencyKeyFilter
+from Infrastructure.statement_cache import StatementCache
+from Infrastructure.ledger_engine import InMemoryLedgerRepository
+from Infrastructure.sharded_repository import ShardedAccountRepository
+from Infrastructure.transaction_archive import TransactionArchive
+from Service import AmountTransaction, AccountOpening, GenerateStatements, TransactionFailedException, \
+    BulkStatementExport, DatabaseExecutor, AsyncAccountOpening, AsyncAmountTransaction, AsyncGenerateStatements, \
+    GroupCommitWriter, BalanceCheckpointJob, FundsTransfer, ActivityReports, LedgerReconciliation, \
+    TransactionArchival
+from Service.reconciliation import np as numpy
 
 class TestAccountRepository(unittest.TestCase):
+    pooled = False
+
     def setUp(self):
         self.db_filename = 'test.db'
         # Create necessary tables
         
-        self.db_connection = DatabaseConnection(self.db_filename)
+        self.db_connection = DatabaseConnection(self.db_filename, pooled=self.pooled)
         self.create_tables()
 
-        self.account_repository = AccountRepository(self.db_connection)
+        self.account_repository = self.create_repository()
         self.account_client = AccountOpening(self.account_repository)
         self.account_ins = self.account_client.create_account(35, 'test_cl_id', 'lazy@gmail.com', '123456789')
         self.amount_transaction = AmountTransaction(self.account_repository)
@@ -26,40 +49,19 @@ class TestAccountRepository(unittest.TestCase):
 
     def tearDown(self):
         # Delete the test database after the test run
-        if os.path.exists(self.db_filename):
-            os.remove(self.db_filename)
+        self.db_connection.close()
+        for filename in (self.db_filename, self.db_filename + '-wal', self.db_filename + '-shm'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def create_cache(self):
+        return None
+
+    def create_repository(self):
+        return AccountRepository(self.db_connection, cache=self.create_cache())
 
     def create_tables(self):
-        connection = self.db_connection.create_db_connection()
-        cursor = connection.cursor()
-
-        cursor.executescript('''
-            CREATE TABLE IF NOT EXISTS Customers (
-                customer_id INTEGER PRIMARY KEY,
-                name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                phone_number TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS Accounts (
-                account_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_id INTEGER NOT NULL,
-                account_number TEXT NOT NULL,
-                balance REAL DEFAULT 0,
-                FOREIGN KEY (customer_id) REFERENCES Customers(customer_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS Transactions (
-                transaction_id INTEGER PRIMARY KEY,
-                account_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                transaction_type TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (account_id) REFERENCES Accounts(account_id)
-            );
-        ''')
-        connection.commit()
-        connection.close()
+        DatabaseInitializer(self.db_connection).initialize_db()
 
     def test_save_account(self):
         customer = Customer(1, "John Doe", "john@example.com", "123-456-7890")
@@ -162,5 +164,1103 @@ class TestAccountRepository(unittest.TestCase):
                 self.assertEqual(data['amount'], withdrawal_acount)
         self.assertEqual(len(data_list), 2)
 
+    def test_failed_withdrawal_records_nothing(self):
+        self.amount_transaction.make_transaction(self.account_ins.account_id, 100, "deposit")
+        with self.assertRaises(TransactionFailedException):
+            self.amount_transaction.make_transaction(self.account_ins.account_id, 150, "withdraw")
+        account = self.account_repository.find_account_by_id(self.account_ins.account_id)
+        self.assertEqual(account.balance, 100)
+        statement = json.loads(self.generate_statements.generate_account_statement(self.account_ins.account_id))
+        self.assertEqual(len(statement), 1)
+
+    def test_make_transaction_unknown_account(self):
+        with self.assertRaises(TransactionFailedException):
+            self.amount_transaction.make_transaction(987654, 10, "deposit")
+
+    def test_concurrent_deposits_are_not_lost(self):
+        def worker():
+            for _ in range(10):
+                self.amount_transaction.make_transaction(self.account_ins.account_id, 1, "deposit")
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        account = self.account_repository.find_account_by_id(self.account_ins.account_id)
+        self.assertEqual(account.balance, 40)
+
+    def test_make_transactions_batch(self):
+        other = self.account_client.create_account(36, 'other', 'other@gmail.com', '987654321')
+        account_id = self.account_ins.account_id
+        results = self.amount_transaction.make_transactions([
+            (account_id, 100, "deposit"),
+            (account_id, 30, "withdraw"),
+            (account_id, 500, "withdraw"),
+            (other.account_id, 20, "deposit"),
+            (987654, 10, "deposit"),
+            (account_id, -5, "deposit"),
+            (account_id, 10, "refund"),
+        ], chunk_size=3)
+
+        self.assertEqual([result.success for result in results],
+                         [True, True, False, True, False, False, False])
+        self.assertEqual(results[1].balance, 70)
+        self.assertEqual(results[2].error, "Insufficient funds")
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 70)
+        self.assertEqual(self.account_repository.find_account_by_id(other.account_id).balance, 20)
+        statement = json.loads(self.generate_statements.generate_account_statement(account_id))
+        self.assertEqual(len(statement), 2)
+
+    def test_schema_is_migrated_to_latest_version(self):
+        initializer = DatabaseInitializer(self.db_connection)
+        self.assertEqual(initializer.get_schema_version(), LATEST_VERSION)
+        initializer.initialize_db()
+        self.assertEqual(initializer.get_schema_version(), LATEST_VERSION)
+
+    def test_hot_path_queries_use_indexes(self):
+        with self.db_connection.connection() as connection:
+            account_plan = connection.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM Accounts WHERE customer_id = ?", (1,)).fetchall()
+            statement_plan = connection.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM Transactions WHERE account_id = ? ORDER BY timestamp",
+                (1,)).fetchall()
+        self.assertIn('idx_accounts_customer_id', str(account_plan))
+        self.assertIn('idx_transactions_account_timestamp', str(statement_plan))
+
+    def _deposit_many(self, count):
+        self.amount_transaction.make_transactions(
+            [(self.account_ins.account_id, amount, "deposit") for amount in range(1, count + 1)])
+
+    def test_streamed_statement_formats(self):
+        self._deposit_many(3)
+        account_id = self.account_ins.account_id
+        statement = self.generate_statements.generate_account_statement(account_id)
+        entries = json.loads(statement)
+        self.assertEqual(statement, json.dumps(entries, indent=2))
+        self.assertEqual([entry['amount'] for entry in entries], [1, 2, 3])
+
+        output = io.StringIO()
+        self.assertEqual(self.generate_statements.write_account_statement(account_id, output, fmt="ndjson"), 3)
+        self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()], entries)
+
+        output = io.StringIO()
+        self.generate_statements.write_account_statement(account_id, output, fmt="csv")
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual([float(row['amount']) for row in rows], [1, 2, 3])
+
+        with self.assertRaises(ValueError):
+            self.generate_statements.write_account_statement(account_id, io.StringIO(), fmt="xml")
+
+    def test_statement_date_range(self):
+        self._deposit_many(2)
+        account_id = self.account_ins.account_id
+        future = list(self.generate_statements.iter_account_statement(account_id, start=datetime(2999, 1, 1)))
+        past = list(self.generate_statements.iter_account_statement(account_id, end=datetime(2000, 1, 1)))
+        everything = list(self.generate_statements.iter_account_statement(
+            account_id, start=datetime(2000, 1, 1), end="2999-01-01 00:00:00"))
+        self.assertEqual((len(future), len(past), len(everything)), (0, 0, 2))
+
+    def test_statement_pagination(self):
+        self._deposit_many(5)
+        account_id = self.account_ins.account_id
+        amounts = []
+        cursor = None
+        pages = 0
+        while True:
+            page = self.generate_statements.get_statement_page(account_id, after_transaction_id=cursor, limit=2)
+            amounts.extend(entry['amount'] for entry in page['transactions'])
+            pages += 1
+            cursor = page['next_after_transaction_id']
+            if cursor is None:
+                break
+        self.assertEqual(amounts, [1, 2, 3, 4, 5])
+        self.assertEqual(pages, 3)
+
+    def test_bulk_statement_export(self):
+        other = self.account_client.create_account(36, 'other', 'other@gmail.com', '987654321')
+        idle = self.account_client.create_account(37, 'idle', 'idle@gmail.com', '555555555')
+        self._deposit_many(3)
+        self.amount_transaction.make_transaction(other.account_id, 7, "deposit")
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = BulkStatementExport(self.account_repository, workers=1, partitions=2).export_all(output_dir)
+            self.assertEqual(summary, {'accounts': 3, 'transactions': 4, 'files': 3})
+            with open(os.path.join(output_dir, f"statement_{self.account_ins.account_id}.json")) as output:
+                self.assertEqual(output.read(),
+                                 self.generate_statements.generate_account_statement(self.account_ins.account_id))
+            with open(os.path.join(output_dir, f"statement_{idle.account_id}.json")) as output:
+                self.assertEqual(json.loads(output.read()), [])
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = BulkStatementExport(self.account_repository, workers=2).export_all(
+                output_dir, layout="partitioned")
+            self.assertEqual(summary, {'accounts': 3, 'transactions': 4, 'files': 2})
+            self.assertEqual(sorted(os.listdir(output_dir)),
+                             ['statements_part_00000.ndjson', 'statements_part_00001.ndjson'])
+
+    def test_async_use_cases(self):
+        executor = DatabaseExecutor(read_workers=2, max_in_flight=4)
+        opening = AsyncAccountOpening(self.account_repository, executor)
+        transactions = AsyncAmountTransaction(self.account_repository, executor)
+        statements = AsyncGenerateStatements(self.account_repository, executor)
+
+        async def scenario():
+            account = await opening.create_account(40, 'async', 'async@gmail.com', '1111')
+            await asyncio.gather(*(transactions.make_transaction(account.account_id, 1, "deposit")
+                                   for _ in range(20)))
+            with self.assertRaises(TransactionFailedException):
+                await transactions.make_transaction(account.account_id, 500, "withdraw")
+            entries = [entry async for entry in statements.iter_account_statement(account.account_id, page_size=6)]
+            statement = await statements.generate_account_statement(account.account_id)
+            return account, entries, statement
+
+        try:
+            account, entries, statement = asyncio.run(scenario())
+        finally:
+            executor.shutdown()
+        self.assertEqual(self.account_repository.find_account_by_id(account.account_id).balance, 20)
+        self.assertEqual(entries, json.loads(statement))
+        self.assertEqual(len(entries), 20)
+
+    def test_group_commit_writer(self):
+        account_id = self.account_ins.account_id
+        futures = []
+        with GroupCommitWriter(self.account_repository, max_batch_size=8, max_delay=0.05) as writer:
+            def worker():
+                for _ in range(10):
+                    futures.append(writer.submit(account_id, 1, "deposit"))
+
+            threads = [threading.Thread(target=worker) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            overdraft = writer.submit(account_id, 1000, "withdraw")
+        self.assertTrue(all(future.result().success for future in futures))
+        with self.assertRaises(TransactionFailedException):
+            overdraft.result()
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 40)
+        with self.assertRaises(RuntimeError):
+            writer.submit(account_id, 1, "deposit")
+
+    def _insert_ledger_rows(self, rows):
+        with self.db_connection.connection() as connection:
+            connection.executemany(
+                "INSERT INTO Transactions (account_id, amount, transaction_type, timestamp) VALUES (?,?,?,?)",
+                [(self.account_ins.account_id, amount, transaction_type, timestamp)
+                 for amount, transaction_type, timestamp in rows])
+
+    def test_period_balances_use_checkpoints(self):
+        self._insert_ledger_rows([
+            (100, "deposit", "2024-01-01 10:00:00"),
+            (30, "withdraw", "2024-01-01 18:00:00"),
+            (50, "deposit", "2024-01-03 09:00:00"),
+            (20, "withdraw", "2024-01-05 12:00:00"),
+        ])
+        account_id = self.account_ins.account_id
+        expected = self.generate_statements.get_period_balances(account_id, "2024-01-02 00:00:00",
+                                                                datetime(2024, 1, 5, 23, 0, 0))
+        self.assertEqual((expected['opening_balance'], expected['closing_balance']), (70, 100))
+
+        job = BalanceCheckpointJob(self.account_repository)
+        self.assertEqual(job.run("2024-01-03"), 2)
+        self.assertEqual(job.run("2024-01-04"), 0)
+        self.assertEqual(job.run("2024-01-05"), 1)
+        with self.db_connection.connection() as connection:
+            checkpoints = connection.execute(
+                "SELECT day, balance FROM BalanceCheckpoints WHERE account_id = ? ORDER BY day",
+                (account_id,)).fetchall()
+        self.assertEqual(checkpoints, [("2024-01-01", 70), ("2024-01-03", 120), ("2024-01-05", 100)])
+
+        self.assertEqual(self.generate_statements.get_period_balances(
+            account_id, "2024-01-02 00:00:00", datetime(2024, 1, 5, 23, 0, 0)), expected)
+        self.assertEqual(self.account_repository.get_balance_at(account_id, "2024-01-05 11:00:00"), 120)
+        self.assertEqual(self.account_repository.get_balance_at(account_id, "2024-01-01 12:00:00"), 100)
+
+    def test_account_numbers_are_unique(self):
+        numbers = {self.account_client.create_account(customer_id, 'n', 'e@x.y', '1').account_number
+                   for customer_id in range(100, 350)}
+        self.assertEqual(len(numbers), 250)
+        self.assertNotIn(self.account_ins.account_number, numbers)
+
+    def test_bulk_onboarding_from_csv(self):
+        source = io.StringIO(
+            "customer_id,name,email,phone_number\n"
+            "100,Alice,alice@example.com,555-0100\n"
+            "101,Bob,bob@example.com,555-0101\n"
+            "35,Existing,existing@example.com,555-0035\n"
+            "abc,Broken,broken@example.com,555-0000\n"
+            "102,Carol,,555-0102\n"
+            "100,Alice again,alice2@example.com,555-0100\n"
+            "103,Dave,dave@example.com,555-0103\n")
+        report = self.account_client.create_accounts(source, chunk_size=2)
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.rejected, [(3, "Customer already exists"), (4, "Invalid customer_id"),
+                                           (5, "Missing field: email"), (6, "Customer already exists")])
+        accounts = [self.account_repository.find_accounts_by_customer_id(customer_id)
+                    for customer_id in (100, 101, 103)]
+        self.assertEqual(len({account.account_number for account in accounts}), 3)
+        self.assertTrue(all(account.balance == 0 for account in accounts))
+
+    def test_bulk_onboarding_from_ndjson_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'customers.ndjson')
+            with open(path, 'w') as output:
+                output.write(json.dumps({'customer_id': 200, 'name': 'Eve', 'email': 'eve@example.com',
+                                         'phone_number': '555-0200'}) + "\n")
+                output.write("not json\n")
+            report = self.account_client.create_accounts(path, fmt="ndjson")
+        self.assertEqual(report.created, 1)
+        self.assertEqual(len(report.rejected), 1)
+        self.assertIsNotNone(self.account_repository.find_accounts_by_customer_id(200))
+
+    def test_account_batches(self):
+        for customer_id in range(100, 105):
+            self.account_client.create_account(customer_id, 'n', 'e@x.y', '1')
+        self.amount_transaction.make_transaction(self.account_ins.account_id, 25, "deposit")
+        batches = list(self.account_repository.iter_account_batches(batch_size=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 2])
+        self.assertEqual(sum(batch.total_balance() for batch in batches), 25)
+        first = batches[0][0]
+        self.assertEqual((first.account_id, first.balance), (self.account_ins.account_id, 25))
+        self.assertEqual(list(batches[0].account_ids), [account.account_id for account in batches[0]])
+        with self.assertRaises(TypeError):
+            batches[0].balances[0] = 1.0
+
+    def test_domain_objects_are_slotted(self):
+        with self.assertRaises(AttributeError):
+            self.account_ins.nickname = "main"
+        self.assertFalse(hasattr(Customer(1, "n", "p", "e"), "__dict__"))
+
+    def test_transfer_to_many_accounts(self):
+        employees = [self.account_client.create_account(customer_id, 'n', 'e@x.y', '1')
+                     for customer_id in range(100, 103)]
+        source_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(source_id, 100, "deposit")
+        transfer = FundsTransfer(self.account_repository)
+
+        source = transfer.transfer(source_id, [(employee.account_id, 20) for employee in employees]
+                                   + [(employees[0].account_id, 5)])
+        self.assertEqual(source.balance, 35)
+        balances = [self.account_repository.find_account_by_id(employee.account_id).balance
+                    for employee in employees]
+        self.assertEqual(balances, [25, 20, 20])
+        statement = json.loads(self.generate_statements.generate_account_statement(source_id))
+        self.assertEqual([(entry['type'], entry['amount']) for entry in statement],
+                         [("deposit", 100), ("withdraw", 65)])
+
+    def test_failed_transfer_changes_nothing(self):
+        employee = self.account_client.create_account(100, 'n', 'e@x.y', '1')
+        source_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(source_id, 50, "deposit")
+        transfer = FundsTransfer(self.account_repository)
+        for credits in ([(employee.account_id, 40), (employee.account_id, 20)],
+                        [(employee.account_id, 10), (987654, 10)],
+                        [(employee.account_id, -10)],
+                        [(source_id, 10)],
+                        []):
+            with self.assertRaises(TransactionFailedException):
+                transfer.transfer(source_id, credits)
+        self.assertEqual(self.account_repository.find_account_by_id(source_id).balance, 50)
+        self.assertEqual(self.account_repository.find_account_by_id(employee.account_id).balance, 0)
+
+    def test_daily_activity_totals(self):
+        other = self.account_client.create_account(36, 'other', 'other@gmail.com', '987654321')
+        account_id = self.account_ins.account_id
+        self._insert_ledger_rows([
+            (100, "deposit", "2024-01-01 10:00:00"),
+            (30, "withdraw", "2024-01-01 18:00:00"),
+            (50, "deposit", "2024-01-03 09:00:00"),
+        ])
+        self.amount_transaction.make_transactions([(other.account_id, 70, "deposit")])
+        reports = ActivityReports(self.account_repository)
+
+        daily = reports.get_daily_totals("2024-01-01", datetime(2024, 1, 3), account_id)
+        self.assertEqual([(day['day'], day['deposit_count'], day['withdrawal_sum'], day['net_flow'])
+                          for day in daily], [("2024-01-01", 1, 30, 70), ("2024-01-03", 1, 0, 50)])
+        self.assertEqual(reports.get_period_totals("2024-01-02", "2024-01-03")['deposit_sum'], 50)
+        self.assertEqual(reports.get_period_totals("2000-01-01", "2100-01-01")['deposit_count'], 3)
+
+        top = reports.get_top_accounts("2000-01-01", "2100-01-01", metric="net_flow", limit=1)
+        self.assertEqual([(row['account_id'], row['value']) for row in top], [(account_id, 120)])
+        top = reports.get_top_accounts("2000-01-01", "2100-01-01", metric="deposits")
+        self.assertEqual([row['account_id'] for row in top], [account_id, other.account_id])
+        with self.assertRaises(ValueError):
+            reports.get_top_accounts("2024-01-01", "2024-01-03", metric="balance")
+
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_ledger_reconciliation(self):
+        other = self.account_client.create_account(36, 'other', 'other@gmail.com', '987654321')
+        self._deposit_many(5)
+        self.amount_transaction.make_transaction(other.account_id, 7, "deposit")
+        reconciliation = LedgerReconciliation(self.account_repository, chunk_size=2)
+        self.assertEqual(reconciliation.run(), (2, 6, []))
+
+        with self.db_connection.connection() as connection:
+            connection.execute("UPDATE Accounts SET balance = 99 WHERE account_id = ?", (other.account_id,))
+            connection.executemany("INSERT INTO Transactions (account_id, amount, transaction_type) VALUES (?,?,?)",
+                                   [(10 ** 9, 4, "deposit"), (10 ** 9, 1, "withdraw")])
+        report = reconciliation.run()
+        self.assertEqual(report.transactions, 8)
+        self.assertEqual(report.mismatches, [(other.account_id, 99, 7), (10 ** 9, None, 3)])
+
+    def test_archived_transactions_stay_in_statements(self):
+        account_id = self.account_ins.account_id
+        self._insert_ledger_rows([
+            (100, "deposit", "2024-01-01 10:00:00"),
+            (30, "withdraw", "2024-01-20 18:00:00"),
+            (50, "deposit", "2024-02-03 09:00:00"),
+            (5, "deposit", "2024-03-02 09:00:00"),
+        ])
+        self.amount_transaction.make_transaction(account_id, 1, "deposit")
+        full_statement = self.generate_statements.generate_account_statement(account_id)
+        opening = self.generate_statements.get_period_balances(account_id, "2024-02-01", "2024-03-01")
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive = TransactionArchive(self.db_connection, archive_dir)
+            self.assertEqual(TransactionArchival(self.account_repository, archive).run(cutoff="2024-03-01"), (2, 3))
+            self.assertEqual(TransactionArchival(self.account_repository, archive).run(cutoff="2024-03-01"), (0, 0))
+            self.assertEqual(len(list(self.account_repository.iter_transactions(account_id))), 2)
+
+            statements = GenerateStatements(self.account_repository, archive)
+            self.assertEqual(statements.generate_account_statement(account_id), full_statement)
+            self.assertEqual(statements.get_period_balances(account_id, "2024-02-01", "2024-03-01"), opening)
+            entries = list(statements.iter_account_statement(account_id, start="2024-01-15", end="2024-03-01"))
+            self.assertEqual([entry['amount'] for entry in entries], [30, 50])
+            page = statements.get_statement_page(account_id, limit=2)
+            page = statements.get_statement_page(account_id, after_transaction_id=page['next_after_transaction_id'],
+                                                 limit=2)
+            self.assertEqual([entry['amount'] for entry in page['transactions']], [50, 5])
+
+            # A segment that was written but never registered is not part of the archive.
+            with open(os.path.join(archive_dir, "transactions_2023-12_1.seg"), "wb") as orphan:
+                orphan.write(b"partial")
+            self.assertEqual(statements.generate_account_statement(account_id), full_statement)
+
+    def test_bulk_export_includes_archived_periods(self):
+        account_id = self.account_ins.account_id
+        other = self.account_client.create_account(36, 'other', 'other@gmail.com', '987654321')
+        self._insert_ledger_rows([
+            (100, "deposit", "2024-01-01 10:00:00"),
+            (30, "withdraw", "2024-02-03 09:00:00"),
+        ])
+        self.amount_transaction.make_transaction(account_id, 1, "deposit")
+        self.amount_transaction.make_transaction(other.account_id, 7, "deposit")
+        with tempfile.TemporaryDirectory() as archive_dir, tempfile.TemporaryDirectory() as output_dir:
+            archive = TransactionArchive(self.db_connection, archive_dir)
+            TransactionArchival(self.account_repository, archive).run(cutoff="2024-03-01")
+            export = BulkStatementExport(self.account_repository, workers=1, archive=archive)
+            self.assertEqual(export.export_all(output_dir), {'accounts': 2, 'transactions': 4, 'files': 2})
+            with open(os.path.join(output_dir, f"statement_{account_id}.json")) as output:
+                self.assertEqual(output.read(),
+                                 GenerateStatements(self.account_repository, archive).generate_account_statement(
+                                     account_id))
+            summary = export.export_all(output_dir, layout="partitioned", start="2024-01-15", end="2024-03-01")
+            self.assertEqual(summary['transactions'], 1)
+
+    def test_balances_within_an_archived_day(self):
+        account_id = self.account_ins.account_id
+        self._insert_ledger_rows([
+            (100, "deposit", "2020-01-05 09:00:00"),
+            (100, "deposit", "2020-01-05 15:00:00"),
+            (100, "deposit", "2020-01-06 09:00:00"),
+        ])
+        self.amount_transaction.make_transaction(account_id, 1, "deposit")
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive = TransactionArchive(self.db_connection, archive_dir)
+            TransactionArchival(self.account_repository, archive).run(cutoff="2020-01-06")
+
+            balances = GenerateStatements(self.account_repository, archive).get_period_balances(
+                account_id, "2020-01-05 12:00:00", "2020-01-06 12:00:00")
+            self.assertEqual((balances['opening_balance'], balances['closing_balance']), (100, 300))
+            self.assertEqual(self.account_repository.get_balance_at(account_id, "2020-01-06 00:00:00"), 200)
+            with self.assertRaises(ValueError):
+                self.account_repository.get_balance_at(account_id, "2020-01-05 12:00:00")
+
+    def test_archived_idempotency_keys_are_kept(self):
+        account_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1")
+        self.account_repository.checkpoint()
+        with self.db_connection.connection() as connection:
+            connection.execute("UPDATE Transactions SET timestamp = '2024-01-01 10:00:00'")
+        self.amount_transaction.make_transaction(account_id, 1, "deposit")
+        with tempfile.TemporaryDirectory() as archive_dir:
+            archive = TransactionArchive(self.db_connection, archive_dir)
+            self.assertEqual(TransactionArchival(self.account_repository, archive).run(cutoff="2024-03-01"), (1, 1))
+
+        for repository in (self.account_repository, AccountRepository(self.db_connection)):
+            self.assertEqual(repository.apply_transaction(account_id, 100, "deposit", "key-1").balance, 100)
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 101)
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db_connection.connection() as connection:
+                connection.execute("INSERT INTO Transactions (account_id, amount, transaction_type, idempotency_key) "
+                                   "VALUES (?, 100, 'deposit', 'key-1')", (account_id,))
+
+    def test_idempotent_transactions(self):
+        account_id = self.account_ins.account_id
+        self.assertEqual(self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1").balance, 100)
+        retried = self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1")
+        self.assertEqual(retried.balance, 100)
+        self.assertEqual(retried.customer_id, self.account_ins.customer_id)
+        with self.assertRaises(TransactionFailedException):
+            self.amount_transaction.make_transaction(account_id, 50, "deposit", "key-1")
+
+        results = self.amount_transaction.make_transactions([
+            (account_id, 10, "deposit", "key-2"),
+            (account_id, 10, "deposit", "key-2"),
+            (account_id, 5, "withdraw"),
+            (account_id, 100, "deposit", "key-1"),
+            (account_id, 1, "withdraw", "key-1"),
+        ])
+        self.assertEqual([result.success for result in results], [True, True, True, True, False])
+        self.assertEqual([result.balance for result in results[:4]], [110, 110, 105, 100])
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 105)
+
+    def test_idempotency_key_recorded_by_another_repository(self):
+        account_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1")
+        # A key recorded after another repository loaded its filter is still caught by the unique index.
+        other = AccountRepository(self.db_connection)
+        other.apply_transaction(account_id, 1, "deposit", "key-3")
+        self.amount_transaction.make_transaction(account_id, 7, "deposit", "key-4")
+        self.assertEqual(other.apply_transaction(account_id, 7, "deposit", "key-4").balance, 108)
+        self.assertEqual(other.apply_transactions([(account_id, 7, "deposit", "key-4")])[0].balance, 108)
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 108)
+        self.assertEqual(len(list(self.account_repository.iter_transactions(account_id))), 3)
+
+    def test_idempotency_key_filter(self):
+        key_filter = IdempotencyKeyFilter(capacity=1000, recent_size=2)
+        key_filter.add_all(f"key-{index}" for index in range(1000))
+        self.assertTrue(all(key_filter.might_contain(f"key-{index}") for index in range(1000)))
+        self.assertLess(sum(key_filter.might_contain(f"new-{index}") for index in range(1000)), 50)
+        for index in range(3):
+            key_filter.add(f"key-{index}", (1, index, "deposit", index))
+        self.assertIsNone(key_filter.get_recent("key-0"))
+        self.assertEqual(key_filter.get_recent("key-2"), (1, 2, "deposit", 2))
+
+    def test_customer_lookup(self):
+        self.account_client.create_account(36, 'John  Smith', 'John.Smith@Example.com', '+1 (555) 010-0036')
+        self.account_client.create_account(37, 'johnny walker', 'johnny@example.com', '555 0100 37')
+        self.account_client.create_account(38, 'Jane Doe', 'jane@example.com', '555-0100-38')
+        self.account_repository.save_new_customers([Customer(39, 'John Adams', '555.0100.39',
+                                                             'JOHN.smith@example.com')])
+
+        self.assertEqual(self.account_repository.find_customers_by_email('lazy@gmail.com')[0].phone_number, '123456789')
+        self.assertEqual([customer.customer_id for customer in
+                          self.account_repository.find_customers_by_email(' john.smith@example.COM ')], [36, 39])
+        self.assertEqual([customer.customer_id for customer in
+                          self.account_repository.find_customers_by_phone('15550100036')], [36])
+        self.assertEqual(self.account_repository.find_customers_by_phone('000'), [])
+
+        first_page = self.account_repository.search_customers_by_name('JOHN', limit=2)
+        self.assertEqual([customer.customer_id for customer in first_page], [39, 36])
+        second_page = self.account_repository.search_customers_by_name('john', limit=2, after=first_page[-1])
+        self.assertEqual([customer.customer_id for customer in second_page], [37])
+        self.assertEqual([customer.customer_id for customer in
+                          self.account_repository.search_customers_by_name('john s')], [36])
+        with self.assertRaises(ValueError):
+            self.account_repository.search_customers_by_name('john', limit=0)
+
+        self.assertEqual(self.account_repository.find_existing_emails(
+            ['Jane@example.com', 'new@example.com', 'lazy@gmail.com', 'jane@example.com']),
+            {'Jane@example.com', 'lazy@gmail.com', 'jane@example.com'})
+
+    def test_customer_name_prefix_edge_cases(self):
+        self.account_client.create_account(36, 'x\ud7ff y', 'x@example.com', '1')
+        self.account_client.create_account(37, 'z\U0010ffff', 'z@example.com', '2')
+        self.assertEqual([customer.customer_id for customer in
+                          self.account_repository.search_customers_by_name('x\ud7ff')], [36])
+        self.assertEqual([customer.customer_id for customer in
+                          self.account_repository.search_customers_by_name('z\U0010ffff')], [37])
+        self.assertEqual(self.account_repository.search_customers_by_name('\U0010ffff'), [])
+        self.assertEqual(len(self.account_repository.search_customers_by_name('')), 3)
+
+    def test_customer_lookup_keys_are_backfilled(self):
+        db_connection = DatabaseConnection('test_backfill.db')
+        try:
+            with patch('db.local_db_initialization.MIGRATIONS', MIGRATIONS[:9]), \
+                    patch('db.local_db_initialization.LATEST_VERSION', 9):
+                DatabaseInitializer(db_connection).initialize_db()
+            with db_connection.connection() as connection:
+                connection.execute("INSERT INTO Customers (customer_id, name, email, phone_number) "
+                                   "VALUES (1, 'Ada Lovelace', 'Ada@Example.com', '555-0001')")
+            DatabaseInitializer(db_connection).initialize_db()
+            repository = AccountRepository(db_connection)
+            self.assertEqual(repository.find_customers_by_email('ada@example.com')[0].customer_id, 1)
+            self.assertEqual(len(repository.search_customers_by_name('ada l')), 1)
+        finally:
+            db_connection.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(f'test_backfill.db{suffix}'):
+                    os.remove(f'test_backfill.db{suffix}')
+
+    def test_statement_cache(self):
+        account_id = self.account_ins.account_id
+        other = self.account_client.create_account(36, 'other', 'other@example.com', '1')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = StatementCache(max_entries=1, directory=cache_dir)
+            statements = GenerateStatements(self.account_repository, cache=cache)
+            self.assertEqual(statements.generate_account_statement(account_id), "[]")
+            self._deposit_many(3)
+            self.assertEqual(statements.generate_account_statement(account_id),
+                             self.generate_statements.generate_account_statement(account_id))
+            last_transaction_id = cache.get(account_id).last_transaction_id
+
+            self.amount_transaction.make_transaction(account_id, 1, "withdraw")
+            with patch.object(self.account_repository, 'iter_transactions',
+                              wraps=self.account_repository.iter_transactions) as iter_transactions:
+                statement = statements.generate_account_statement(account_id)
+            iter_transactions.assert_called_once_with(account_id, after_transaction_id=last_transaction_id)
+            self.assertEqual(statement, self.generate_statements.generate_account_statement(account_id))
+            self.assertEqual(len(json.loads(statement)), 4)
+
+            # Evicted from memory by the other account, then read back from disk by a new cache.
+            self.amount_transaction.make_transaction(other.account_id, 5, "deposit")
+            self.assertEqual(len(json.loads(statements.generate_account_statement(other.account_id))), 1)
+            self.assertEqual(cache.stats()['evictions'], 1)
+            self.amount_transaction.make_transaction(account_id, 2, "deposit")
+            restarted = GenerateStatements(self.account_repository, cache=StatementCache(directory=cache_dir))
+            self.assertEqual(restarted.generate_account_statement(account_id),
+                             self.generate_statements.generate_account_statement(account_id))
+            self.assertEqual(restarted.cache.stats()['hits'], 1)
+            self.assertEqual(StatementCache(directory=cache_dir).get(account_id).count, 5)
+
+    def test_snapshot_and_backup(self):
+        account_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(account_id, 25, "deposit")
+        with self.account_repository.snapshot():
+            self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 25)
+            statement = self.generate_statements.generate_account_statement(account_id)
+        self.assertEqual(len(json.loads(statement)), 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.db')
+            self.account_repository.backup(path)
+            self.amount_transaction.make_transaction(account_id, 5, "deposit")
+            copy = DatabaseConnection(path)
+            self.assertEqual(AccountRepository(copy).find_account_by_id(account_id).balance, 25)
+            copy.close()
+
+    def test_reads_are_read_only_and_snapshots_do_not_block_writers(self):
+        account_id = self.account_ins.account_id
+        with self.db_connection.read_connection() as connection:
+            with self.assertRaises(sqlite3.OperationalError):
+                connection.execute("DELETE FROM Transactions")
+        writer = DatabaseConnection(self.db_connection.connection_string)
+        with self.account_repository.snapshot() as snapshot:
+            self.assertEqual(snapshot.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            with writer.connection() as connection:
+                connection.execute("INSERT INTO Transactions (account_id, amount, transaction_type) "
+                                   "VALUES (?, 1, 'deposit')", (account_id,))
+            self.assertEqual(snapshot.execute("SELECT COUNT(*) FROM Transactions").fetchone()[0], 0)
+        writer.close()
+
+
+class TestPooledAccountRepository(TestAccountRepository):
+    pooled = True
+
+    def test_backup_completes_while_writing(self):
+        account_id = self.account_ins.account_id
+        stop = threading.Event()
+
+        def writer():
+            while not stop.is_set():
+                self.amount_transaction.make_transaction(account_id, 1, "deposit")
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for index in range(3):
+                    path = os.path.join(directory, f'report_{index}.db')
+                    self.db_connection.backup(path)
+                    copy = DatabaseConnection(path)
+                    balance = AccountRepository(copy).find_account_by_id(account_id).balance
+                    self.assertEqual(len(list(AccountRepository(copy).iter_transactions(account_id))), balance)
+                    copy.close()
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_snapshot_is_isolated_from_writers(self):
+        account_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(account_id, 10, "deposit")
+        with self.account_repository.snapshot():
+            worker = threading.Thread(
+                target=self.amount_transaction.make_transaction, args=(account_id, 15, "deposit"))
+            worker.start()
+            worker.join()
+            self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 10)
+            self.assertEqual(len(list(self.account_repository.iter_transactions(account_id))), 1)
+            with self.assertRaises(RuntimeError):
+                self.account_repository.apply_transaction(account_id, 1, "deposit")
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 25)
+
+    def test_connection_is_reused_within_thread(self):
+        with self.db_connection.connection() as first:
+            pass
+        with self.db_connection.connection() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_nested_blocks_share_connection(self):
+        with self.db_connection.connection() as outer:
+            with self.db_connection.connection() as inner:
+                self.assertIs(outer, inner)
+
+    def test_threads_get_their_own_connection(self):
+        with self.db_connection.connection() as main_connection:
+            pass
+        seen = []
+
+        def worker():
+            with self.db_connection.connection() as connection:
+                seen.append(connection)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(seen), 1)
+        self.assertIsNot(seen[0], main_connection)
+
+    def test_pragmas_are_applied(self):
+        with self.db_connection.connection() as connection:
+            journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+            synchronous = connection.execute("PRAGMA synchronous").fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+        self.assertEqual(synchronous, 1)
+
+    def test_durable_block_commits_with_full_sync(self):
+        with self.db_connection.connection(durable=True) as connection:
+            self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 2)
+            with self.assertRaises(RuntimeError):
+                with self.db_connection.connection(durable=True):
+                    pass
+        with self.db_connection.connection() as connection:
+            self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 1)
+
+    def test_failed_block_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.db_connection.connection() as connection:
+                self.db_connection.execute_query(
+                    "INSERT INTO Transactions (account_id, amount, transaction_type) VALUES (?,?,?)",
+                    (self.account_ins.account_id, 10, 'deposit'), connection)
+                raise RuntimeError("boom")
+        statement = self.generate_statements.generate_account_statement(self.account_ins.account_id)
+        self.assertEqual(json.loads(statement), [])
+
+class TestCachedAccountRepository(TestAccountRepository):
+    def create_cache(self):
+        return AccountCache(max_entries=2)
+
+    def test_lookups_are_served_from_cache(self):
+        account_id = self.account_ins.account_id
+        self.account_repository.find_account_by_id(account_id)
+        self.account_repository.find_account_by_id(account_id)
+        self.account_repository.find_accounts_by_customer_id(self.account_ins.customer_id)
+        stats = self.account_repository.cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 1)
+
+    def test_writes_invalidate_cache(self):
+        account_id = self.account_ins.account_id
+        self.account_repository.find_account_by_id(account_id)
+        self.amount_transaction.make_transaction(account_id, 40, "deposit")
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 40)
+        self.amount_transaction.make_transactions([(account_id, 15, "withdraw")])
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 25)
+
+    def test_read_overtaken_by_write_is_not_cached(self):
+        account_id = self.account_ins.account_id
+        execute_query = self.db_connection.execute_query
+        writes = []
+
+        def read_then_write(query, *args, **kwargs):
+            result = execute_query(query, *args, **kwargs)
+            # Commit a deposit from another thread after the old row was read but before it is cached.
+            if query.startswith("SELECT") and not writes:
+                writes.append(threading.Thread(
+                    target=self.amount_transaction.make_transaction, args=(account_id, 30, "deposit")))
+                writes[0].start()
+                writes[0].join()
+            return result
+
+        with patch.object(self.db_connection, 'execute_query', side_effect=read_then_write):
+            self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 0)
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 30)
+
+        cache = AccountCache()
+        generation = cache.generation()
+        cache.invalidate(customer_id=10)
+        cache.put(Account(1, 10, 123, 0), generation)
+        self.assertIsNone(cache.get_by_id(1))
+        cache.put(Account(1, 10, 123, 0), cache.generation())
+        self.assertIsNotNone(cache.get_by_id(1))
+
+    def test_cached_accounts_are_copies(self):
+        account_id = self.account_ins.account_id
+        self.account_repository.find_account_by_id(account_id).balance = 1000
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 0)
+
+    def test_eviction_and_ttl(self):
+        cache = AccountCache(max_entries=2, ttl=60)
+        for account_id in (1, 2, 3):
+            cache.put(Account(account_id, account_id * 10, 123, 0))
+        self.assertIsNone(cache.get_by_id(1))
+        self.assertIsNotNone(cache.get_by_customer_id(30))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        expired = AccountCache(ttl=0)
+        expired.put(Account(1, 10, 123, 0))
+        self.assertIsNone(expired.get_by_id(1))
+
+
+class TestInMemoryLedgerRepository(TestAccountRepository):
+    wal_filename = 'test_ledger.wal'
+
+    def create_repository(self):
+        return InMemoryLedgerRepository(self.db_connection, wal_path=self.wal_filename, sync_interval=None)
+
+    def tearDown(self):
+        self.account_repository.close()
+        if os.path.exists(self.wal_filename):
+            os.remove(self.wal_filename)
+        super().tearDown()
+
+    def _crash(self):
+        # Drop the engine without checkpointing, as if the process died, and recover a new one.
+        os.close(self.account_repository._wal_fd)
+        self.account_repository._wal_fd = None
+        self.account_repository = self.create_repository()
+        self.amount_transaction = AmountTransaction(self.account_repository)
+
+    def _stored_balance(self, account_id):
+        with self.db_connection.connection() as connection:
+            return connection.execute("SELECT balance FROM Accounts WHERE account_id = ?", (account_id,)).fetchone()[0]
+
+    def test_checkpoint_writes_ledger_and_truncates_wal(self):
+        account_id = self.account_ins.account_id
+        self._deposit_many(3)
+        self.assertEqual(self._stored_balance(account_id), 0)
+        self.assertGreater(os.path.getsize(self.wal_filename), 0)
+
+        self.assertEqual(self.account_repository.checkpoint(), 3)
+        self.assertEqual(self._stored_balance(account_id), 6)
+        self.assertEqual(os.path.getsize(self.wal_filename), 0)
+        self.assertEqual(len(list(self.account_repository.iter_transactions(account_id))), 3)
+
+    def test_idempotency_key_recorded_by_another_repository(self):
+        # The engine is the only writer while it runs: its keys stay in the WAL until a checkpoint writes them.
+        account_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1")
+        self.assertEqual(self._stored_balance(account_id), 0)
+
+        self._crash()
+        self.assertEqual(self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1").balance, 100)
+        with self.assertRaises(TransactionFailedException):
+            self.amount_transaction.make_transaction(account_id, 50, "deposit", "key-1")
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 100)
+
+        self.assertEqual(self.account_repository.checkpoint(), 1)
+        with self.db_connection.connection() as connection:
+            keys = connection.execute("SELECT idempotency_key, balance_after FROM Transactions").fetchall()
+        self.assertEqual(keys, [("key-1", 100)])
+        self.assertEqual(self.amount_transaction.make_transaction(account_id, 100, "deposit", "key-1").balance, 100)
+        other = AccountRepository(self.db_connection)
+        self.assertEqual(other.apply_transactions([(account_id, 100, "deposit", "key-1")])[0].balance, 100)
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 100)
+
+    def test_recorded_transaction_follows_pending_ones(self):
+        account_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(account_id, 5, "deposit")
+        self.amount_transaction.create_transaction(account_id, 1, "deposit")
+        self.assertEqual(self._stored_balance(account_id), 5)
+        self.assertEqual([row[2] for row in self.account_repository.iter_transactions(account_id)], [5, 1])
+        self._crash()
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 5)
+
+    def test_wal_is_replayed_after_crash(self):
+        account_id = self.account_ins.account_id
+        self._deposit_many(2)
+        self.account_repository.checkpoint()
+        self.amount_transaction.make_transaction(account_id, 10, "deposit")
+        self.amount_transaction.make_transaction(account_id, 4, "withdraw")
+        self._crash()
+
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 9)
+        self.account_repository.checkpoint()
+        self.assertEqual(self._stored_balance(account_id), 9)
+        self.assertEqual(len(list(self.account_repository.iter_transactions(account_id))), 4)
+
+    def test_torn_wal_group_is_discarded(self):
+        other = self.account_client.create_account(36, 'other', 'other@gmail.com', '987654321')
+        source_id = self.account_ins.account_id
+        self.amount_transaction.make_transaction(source_id, 10, "deposit")
+        FundsTransfer(self.account_repository).transfer(source_id, [(other.account_id, 3), (other.account_id, 2)])
+        os.truncate(self.wal_filename, os.path.getsize(self.wal_filename) - 1)
+        self._crash()
+
+        self.assertEqual(self.account_repository.find_account_by_id(source_id).balance, 10)
+        self.assertEqual(self.account_repository.find_account_by_id(other.account_id).balance, 0)
+        self.amount_transaction.make_transaction(source_id, 1, "deposit")
+        self._crash()
+        self.assertEqual(self.account_repository.find_account_by_id(source_id).balance, 11)
+
+    def test_group_commit_acknowledges_only_synced_transactions(self):
+        account_id = self.account_ins.account_id
+        repository = self.account_repository
+        append, fsync = repository._append, os.fsync
+        local, fsyncs, unsynced = threading.local(), [], []
+
+        def tracked_append(rows):
+            local.sequence = append(rows)
+            return local.sequence
+
+        def slow_fsync(fd):
+            fsyncs.append(fd)
+            time.sleep(0.005)
+            fsync(fd)
+
+        def deposit():
+            for _ in range(5):
+                self.amount_transaction.make_transaction(account_id, 1, "deposit")
+                if repository._synced_sequence < local.sequence:
+                    unsynced.append(local.sequence)
+
+        with patch.object(repository, '_append', side_effect=tracked_append), \
+                patch('Infrastructure.ledger_engine.os.fsync', side_effect=slow_fsync):
+            threads = [threading.Thread(target=deposit) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(unsynced, [])
+        self.assertLess(len(fsyncs), 40)
+        self.assertEqual(repository.find_account_by_id(account_id).balance, 40)
+
+        # Acknowledging before the fsync is an explicit opt-in.
+        repository.close()
+        self.account_repository = InMemoryLedgerRepository(self.db_connection, wal_path=self.wal_filename,
+                                                           group_commit=False, sync_interval=None)
+        with patch('Infrastructure.ledger_engine.os.fsync') as fsync_mock:
+            self.assertEqual(self.account_repository.apply_transaction(account_id, 1, "deposit").balance, 41)
+        fsync_mock.assert_not_called()
+
+
+class TestShardedAccountRepository(unittest.TestCase):
+    def setUp(self):
+        self.sharded_database = ShardedDatabase.from_pattern('test_shard_{shard}.db', shard_count=3)
+        ShardedDatabaseInitializer(self.sharded_database).initialize_db()
+        self.account_repository = ShardedAccountRepository(self.sharded_database)
+        self.account_client = AccountOpening(self.account_repository)
+        self.accounts = [self.account_client.create_account(customer_id, 'n', 'e@x.y', '1')
+                         for customer_id in range(6)]
+
+    def tearDown(self):
+        self.account_repository.close()
+        for shard in range(3):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(f'test_shard_{shard}.db{suffix}'):
+                    os.remove(f'test_shard_{shard}.db{suffix}')
+
+    def test_accounts_are_routed_to_shards(self):
+        for account in self.accounts:
+            shard = self.sharded_database.shard_for_account_id(account.account_id)
+            self.assertEqual(shard, self.sharded_database.shard_for_customer_id(account.customer_id))
+            self.assertEqual(self.account_repository.find_account_by_id(account.account_id).customer_id,
+                             account.customer_id)
+            self.assertEqual(self.account_repository.find_accounts_by_customer_id(account.customer_id).account_id,
+                             account.account_id)
+        self.assertEqual(len({account.account_number for account in self.accounts}), 6)
+        self.assertEqual(len({account.account_id for account in self.accounts}), 6)
+        ids = [account_id for batch in self.account_repository.iter_account_batches()
+               for account_id in batch.account_ids]
+        self.assertEqual(ids, sorted(account.account_id for account in self.accounts))
+
+        customers = self.account_repository.find_customers_by_email('E@x.y')
+        self.assertEqual([customer.customer_id for customer in customers], list(range(6)))
+        page = self.account_repository.search_customers_by_name('N', limit=4)
+        self.assertEqual([customer.customer_id for customer in page], [0, 1, 2, 3])
+        page = self.account_repository.search_customers_by_name('N', limit=4, after=page[-1])
+        self.assertEqual([customer.customer_id for customer in page], [4, 5])
+        self.assertEqual(self.account_repository.find_existing_emails(['e@x.y', 'f@x.y']), {'e@x.y'})
+
+        # Re-initializing keeps the ranges already in use.
+        ShardedDatabaseInitializer(self.sharded_database).initialize_db()
+        account = self.account_client.create_account(7, 'n', 'e@x.y', '1')
+        self.assertEqual(self.sharded_database.shard_for_account_id(account.account_id), 1)
+
+    def test_batches_are_split_per_shard(self):
+        first, second = self.accounts[0].account_id, self.accounts[1].account_id
+        results = AmountTransaction(self.account_repository).make_transactions([
+            (first, 10, "deposit"), (second, 5, "deposit"), (first, 20, "withdraw"), (10 ** 15, 1, "deposit"),
+            (first, 4, "withdraw")])
+        self.assertEqual([result.success for result in results], [True, True, False, False, True])
+        self.assertEqual([result.balance for result in results if result.success], [10, 5, 6])
+        self.assertEqual(self.account_repository.find_account_by_id(first).balance, 6)
+
+        reports = ActivityReports(self.account_repository)
+        self.assertEqual(reports.get_period_totals("2000-01-01", "2100-01-01")['net_flow'], 11)
+        self.assertEqual([row['account_id'] for row in reports.get_top_accounts("2000-01-01", "2100-01-01")],
+                         [first, second])
+
+        statement = json.loads(GenerateStatements(self.account_repository).generate_account_statement(first))
+        self.assertEqual([entry['amount'] for entry in statement], [10, 4])
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = BulkStatementExport(self.account_repository, workers=1).export_all(output_dir)
+        self.assertEqual(summary, {'accounts': 6, 'transactions': 3, 'files': 6})
+
+        retried = AmountTransaction(self.account_repository).make_transactions([
+            (second, 5, "deposit", "key-1"), (10 ** 15, 1, "deposit", "key-2"), (second, 5, "deposit", "key-1")])
+        self.assertEqual([result.success for result in retried], [True, False, True])
+        self.assertEqual(self.account_repository.find_account_by_id(second).balance, 10)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_reconciliation_covers_every_shard(self):
+        for account in self.accounts:
+            self.account_repository.apply_transaction(account.account_id, 5, "deposit")
+        with self.sharded_database.shards[2].connection() as connection:
+            connection.execute("UPDATE Accounts SET balance = 1 WHERE account_id = ?", (self.accounts[2].account_id,))
+        report = LedgerReconciliation(self.account_repository).run()
+        self.assertEqual(report, (6, 6, [(self.accounts[2].account_id, 1, 5)]))
+
+    def test_transfers_stay_within_a_shard(self):
+        source, same_shard, other_shard = self.accounts[0], self.accounts[3], self.accounts[1]
+        self.account_repository.apply_transaction(source.account_id, 10, "deposit")
+        with self.assertRaises(TransactionFailedException):
+            FundsTransfer(self.account_repository).transfer(source.account_id, [(other_shard.account_id, 1)])
+        FundsTransfer(self.account_repository).transfer(source.account_id, [(same_shard.account_id, 4)])
+        self.assertEqual(self.account_repository.find_account_by_id(same_shard.account_id).balance, 4)
+
+    def test_bulk_onboarding_is_split_per_shard(self):
+        source = io.StringIO("customer_id,name,email,phone_number\n10,a,a@x.y,1\n11,b,b@x.y,2\n"
+                             "1,dup,d@x.y,3\n12,c,c@x.y,4\n")
+        report = self.account_client.create_accounts(source)
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.rejected, [(3, "Customer already exists")])
+        for customer_id in (10, 11, 12):
+            self.assertIsNotNone(self.account_repository.find_accounts_by_customer_id(customer_id))
+
+    def test_create_transaction_is_routed_to_shard(self):
+        account_id = self.accounts[4].account_id
+        AmountTransaction(self.account_repository).create_transaction(account_id, 9, "deposit")
+        rows = list(self.account_repository.iter_transactions(account_id))
+        self.assertEqual([(row[1], row[2], row[3]) for row in rows], [(account_id, 9, "deposit")])
+        self.assertEqual(self.account_repository.find_account_by_id(account_id).balance, 0)
+
+    def test_snapshot_and_backup_cover_every_shard(self):
+        account_id = self.accounts[2].account_id
+        AmountTransaction(self.account_repository).make_transaction(account_id, 8, "deposit")
+        with self.account_repository.snapshot():
+            self.assertEqual(GenerateStatements(self.account_repository).get_statement_page(account_id)
+                             ['transactions'][0]['amount'], 8)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.account_repository.backup(os.path.join(directory, 'report_{shard}.db'))
+            self.assertEqual(len(paths), 3)
+            shard = self.sharded_database.shard_for_account_id(account_id)
+            copy = DatabaseConnection(paths[shard])
+            self.assertEqual(AccountRepository(copy).find_account_by_id(account_id).balance, 8)
+            copy.close()
+            with self.assertRaises(ValueError):
+                self.account_repository.backup(os.path.join(directory, 'report.db'))
+
+
+class TestQueryMetrics(unittest.TestCase):
+    def setUp(self):
+        self.db_filename = 'test_metrics.db'
+        self.metrics = QueryMetrics(slow_query_threshold=0)
+        self.events = []
+        self.metrics.add_hook(self.events.append)
+        self.db_connection = DatabaseConnection(self.db_filename, metrics=self.metrics)
+        DatabaseInitializer(self.db_connection).initialize_db()
+        self.account_repository = AccountRepository(self.db_connection)
+        self.account = AccountOpening(self.account_repository).create_account(1, 'name', 'a@b.c', '123')
+
+    def tearDown(self):
+        for filename in (self.db_filename, self.db_filename + '-wal', self.db_filename + '-shm'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_queries_are_recorded(self):
+        self.account_repository.find_account_by_id(self.account.account_id)
+        snapshot = self.metrics.to_dict()
+        statement = snapshot['statements'][normalize_statement(
+            f"SELECT {ACCOUNT_COLUMNS} FROM Accounts WHERE account_id =?")]
+        self.assertEqual(statement['count'], 1)
+        self.assertEqual(statement['rows'], 1)
+        self.assertEqual(statement['buckets']['+Inf'], 1)
+        self.assertGreater(snapshot['connections_opened'], 0)
+        self.assertEqual(snapshot['slow_query_count'], len(self.events))
+
+        exposition = self.metrics.to_prometheus()
+        self.assertIn('# TYPE banking_db_query_duration_seconds histogram', exposition)
+        self.assertIn('banking_db_connections_opened_total', exposition)
+        self.assertEqual(json.loads(self.metrics.to_json())['busy_retries'], 0)
+
+    def test_busy_statements_are_retried_only_outside_transactions(self):
+        db_connection = DatabaseConnection(self.db_filename, metrics=self.metrics, busy_retries=2,
+                                           busy_retry_delay=0)
+        run = Mock(side_effect=sqlite3.OperationalError("database is locked"))
+        for in_transaction, calls in ((True, 1), (False, 3)):
+            run.reset_mock()
+            connection = Mock(in_transaction=in_transaction)
+            with self.assertRaises(RuntimeError):
+                db_connection._execute("UPDATE Accounts SET balance = 0", run, connection)
+            self.assertEqual(run.call_count, calls)
+        self.assertEqual(self.metrics.to_dict()['busy_retries'], 2)
+
+    def test_locked_database_fails_the_batch_cleanly(self):
+        db_connection = DatabaseConnection(self.db_filename, metrics=self.metrics)
+        db_connection.create_db_connection = lambda: sqlite3.connect(self.db_filename, timeout=0)
+        writer = sqlite3.connect(self.db_filename)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            with self.assertRaises(TransactionFailedException):
+                AmountTransaction(AccountRepository(db_connection)).make_transactions(
+                    [(self.account.account_id, 1, "deposit")])
+        finally:
+            writer.rollback()
+            writer.close()
+        self.assertEqual(self.metrics.to_dict()['statements']["BEGIN IMMEDIATE"]['errors'], 1)
+
+    def test_streamed_reads_are_recorded(self):
+        account_id = self.account.account_id
+        AmountTransaction(self.account_repository).make_transaction(account_id, 5, "deposit")
+        AmountTransaction(self.account_repository).make_transaction(account_id, 2, "withdraw")
+        self.assertEqual(len(list(self.account_repository.iter_transactions(account_id, fetch_size=1))), 2)
+        list(self.account_repository.iter_account_batches())
+        list(self.account_repository.iter_reconciliation_chunks())
+        statements = self.metrics.to_dict()['statements']
+        ledger = [stats for statement, stats in statements.items()
+                  if statement.endswith("FROM Transactions WHERE account_id = ? ORDER BY transaction_id")]
+        self.assertEqual([(stats['count'], stats['rows']) for stats in ledger], [(1, 2)])
+        self.assertEqual(statements[f"SELECT {ACCOUNT_COLUMNS} FROM Accounts ORDER BY account_id"]['rows'], 1)
+        self.assertEqual(statements["SELECT account_id, COALESCE(balance, 0) FROM Accounts ORDER BY account_id"]
+                         ['count'], 1)
+
+    def test_errors_are_recorded_and_chained(self):
+        with self.assertRaises(RuntimeError) as context:
+            with self.db_connection.connection() as connection:
+                self.db_connection.execute_query("SELECT * FROM Missing", (), connection)
+        self.assertIsNotNone(context.exception.__cause__)
+        self.assertIn("no such table", str(context.exception))
+        self.assertEqual(self.metrics.to_dict()['statements']["SELECT * FROM Missing"]['errors'], 1)
+
+    def test_placeholder_lists_share_a_series(self):
+        self.assertEqual(normalize_statement("SELECT * FROM Accounts WHERE account_id IN (?,?, ?)"),
+                         "SELECT * FROM Accounts WHERE account_id IN (?, ...)")
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_benchmark_report(self):
+        from benchmarks.run_benchmarks import run
+        report = run(['tiny'], ops=5, seed=7)
+        self.assertEqual(len(report['results']), 7)
+        for result in report['results']:
+            self.assertEqual(result['ops'], 5)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
 if __name__ == '__main__':
     unittest.main()